@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AccountConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.account"
+
+    def ready(self):
+        from . import checks  # noqa: F401
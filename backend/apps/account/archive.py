@@ -0,0 +1,185 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max, Subquery
+from django.utils import timezone
+
+from .db import copy_rows, upsert
+from .models import (
+    ArchiveCutoff,
+    ArchivedBalanceHistory,
+    ArchivedTransaction,
+    BalanceHistory,
+    Transaction,
+)
+from .services import transaction_delta
+
+# Hot models and their archive, with the date column they are archived by.
+ARCHIVED_MODELS = (
+    (Transaction, ArchivedTransaction, "date"),
+    (BalanceHistory, ArchivedBalanceHistory, "created_at"),
+)
+
+
+def archive_horizon(days=None):
+    """Return the moment before which rows are archived"""
+
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archive_cutoffs(accounts):
+    """
+    Return the archive cutoff of every account with archived rows among
+    ``accounts``, account numbers or a queryset of accounts.
+    """
+
+    return dict(
+        ArchiveCutoff.objects.filter(account__in=accounts).values_list(
+            "account_id", "cutoff"
+        )
+    )
+
+
+def archive_needed(cutoff, start=None):
+    """
+    Tell whether rows from ``start`` on may be archived, given the archive
+    ``cutoff`` of the accounts read.
+    """
+
+    return cutoff is not None and (start is None or start < cutoff)
+
+
+def checkpoint(totals, horizon):
+    """
+    Add the archived ``totals`` of every account to its archive checkpoint,
+    and move its cutoff up to ``horizon``.
+    """
+
+    table = ArchiveCutoff._meta.db_table
+    for account_id, total in totals.items():
+        upsert(
+            ArchiveCutoff,
+            {
+                "account": account_id,
+                "cutoff": horizon,
+                "balance": total,
+                "updated_at": timezone.now(),
+            },
+            conflict_fields=("account",),
+            updates={
+                "cutoff": f"CASE WHEN excluded.cutoff > {table}.cutoff"
+                f" THEN excluded.cutoff ELSE {table}.cutoff END",
+                "balance": f"{table}.balance + excluded.balance",
+                "updated_at": "excluded.updated_at",
+            },
+        )
+
+
+def archive_batch(model, archive_model, column, horizon, batch_size):
+    """
+    Move the oldest rows of ``model`` dated before ``horizon``, at most
+    ``batch_size`` of them, to ``archive_model`` and return how many moved.
+
+    The rows are copied to the archive first and deleted from the hot table
+    together with the update of the checkpoints, so a batch interrupted
+    between the two is copied again, skipping the rows already there, and
+    never counted twice.
+    """
+
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        rows = model.objects.filter(**{f"{column}__lt": horizon}).order_by(column, "id")
+        pks = list(rows.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return 0
+        rows = model.objects.filter(pk__in=pks)
+
+        archive_using = router.db_for_write(archive_model)
+        with transaction.atomic(using=archive_using):
+            copy_rows(
+                archive_model, rows, archive_using, batch_size, ignore_conflicts=True
+            )
+
+        totals = defaultdict(Decimal)
+        if model is Transaction:
+            for account_id, transaction_type, amount in rows.values_list(
+                "account_id", "type", "amount"
+            ):
+                totals[account_id] += transaction_delta(transaction_type, amount)
+        else:
+            for account_id in rows.values_list("account_id", flat=True).distinct():
+                totals[account_id] += 0
+        checkpoint(totals, horizon)
+        rows.delete()
+    return len(pks)
+
+
+def archive(horizon, batch_size):
+    """
+    Move the transactions dated, and balance history entries created, before
+    ``horizon`` to the archive in batches of ``batch_size`` rows, each in its
+    own transaction. Return the number of rows moved per model.
+    """
+
+    moved = {}
+    for model, archive_model, column in ARCHIVED_MODELS:
+        moved[model] = 0
+        while True:
+            count = archive_batch(model, archive_model, column, horizon, batch_size)
+            moved[model] += count
+            if count < batch_size:
+                break
+    return moved
+
+
+class ArchiveListMixin:
+    """
+    Merge the archived rows into the pages of a keyset paginated list,
+    ordered newest first, that reach past the archive cutoff.
+
+    The hot rows of a page are fetched first, along with the latest archive
+    cutoff of the accounts listed. Only when they do not fill the page with
+    rows newer than the cutoff are the archived rows of the page fetched,
+    with the same cursor, and merged in, so pages of recent rows never read
+    the archive and take no more queries than before it existed.
+    """
+
+    def paginate_archived(self, queryset, accounts, archived, start=None):
+        """
+        Return the page of ``queryset``, the hot rows of ``accounts``, merged
+        with the rows ``archived(account_ids)`` returns when the page needs
+        them. ``start`` is the earliest date listed, if any.
+        """
+
+        paginator = self.paginator
+        cutoffs = ArchiveCutoff.objects.filter(account__in=accounts)
+        queryset = queryset.annotate(
+            archive_cutoff=Subquery(cutoffs.order_by("-cutoff").values("cutoff")[:1])
+        )
+        rows = list(paginator.page_queryset(queryset, self.request, view=self))
+        if rows:
+            last = rows[-1]
+            cutoff = (
+                last["archive_cutoff"]
+                if isinstance(last, dict)
+                else last.archive_cutoff
+            )
+        else:
+            cutoff = cutoffs.aggregate(cutoff=Max("cutoff"))["cutoff"]
+
+        if archive_needed(cutoff, start) and not (
+            len(rows) > paginator.page_size
+            and paginator.position(rows[-1])[0] >= cutoff
+        ):
+            rows = paginator.merge(
+                rows,
+                paginator.page_queryset(
+                    archived(list(archive_cutoffs(accounts))), self.request, self
+                ),
+            )
+        return paginator.get_page(rows)
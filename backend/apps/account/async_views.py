@@ -0,0 +1,172 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from core.metrics import track
+from core.replicas import is_sticky, replica_reads
+from core.sharding import current_shard, get_assignment
+
+from .archive import ArchiveListMixin
+from .db import aexists, aget, aiterator
+from .models import Account, ArchivedBalanceHistory, BalanceHistory
+from .serializers import BalanceHistorySerializer
+from .services import balance_series
+from .views import AccountViewSet, BalanceHistoryViewSet, TransactionViewSet
+
+
+def render(data, status=200, headers=()):
+    with track("serialization"):
+        content = JSONRenderer().render(data)
+    response = HttpResponse(content, status=status, content_type="application/json")
+    for name, value in headers:
+        response[name] = value
+    return response
+
+
+def error_response(exc, request, authenticators):
+    """Render an exception the way DRF's views would"""
+
+    if isinstance(exc, ObjectDoesNotExist):
+        exc = Http404()
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        exc.auth_header = authenticators[0].authenticate_header(request)
+    response = exception_handler(exc, {"request": request})
+    if response is None:
+        raise exc
+    return render(
+        response.data,
+        response.status_code,
+        [(name, value) for name, value in response.items() if name != "Content-Type"],
+    )
+
+
+def get_routing(user_id):
+    """Return the shard of a user and whether their reads may use a replica"""
+
+    alias = get_assignment(user_id)[0] if settings.ACCOUNT_SHARDS else None
+    return alias, not is_sticky(user_id)
+
+
+def async_read(viewset_class, action):
+    """
+    Serve a read ``action`` of ``viewset_class`` from an async view.
+
+    The decorated coroutine gets the viewset, set up for the authenticated
+    user and routed to their shard and to the replicas as the viewset's
+    mixins would, and returns the data of the response. The database is only
+    reached through ``sync_to_async``, so under ASGI a request only holds a
+    thread while its queries run, instead of for its whole duration. Unlike
+    the viewsets, responses are not cached.
+    """
+
+    authenticators = [cls() for cls in viewset_class.authentication_classes]
+
+    def decorator(read):
+        @functools.wraps(read)
+        async def view(request, **kwargs):
+            if request.method != "GET":
+                return HttpResponseNotAllowed(["GET"])
+
+            viewset = viewset_class(
+                action=action, args=(), kwargs=kwargs, format_kwarg=None
+            )
+            request = viewset.request = Request(request, authenticators=authenticators)
+            tokens = []
+            try:
+                user = await sync_to_async(getattr)(request, "user")
+                if not user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                alias, replica = await sync_to_async(get_routing)(user.pk)
+                if alias is not None:
+                    tokens.append((current_shard, current_shard.set(alias)))
+                if replica:
+                    tokens.append((replica_reads, replica_reads.set(True)))
+                data = await read(viewset, request, **kwargs)
+            except Exception as exc:
+                return error_response(exc, request, authenticators)
+            finally:
+                for variable, token in reversed(tokens):
+                    variable.reset(token)
+            return render(data)
+
+        return view
+
+    return decorator
+
+
+async def list_page(viewset, request, queryset):
+    """Return the requested page of ``queryset``, as the viewset's list"""
+
+    paginator = viewset.paginator
+    rows = viewset.get_rows(queryset)
+    if isinstance(viewset, ArchiveListMixin):
+        # The archive is only read once the hot rows of the page are known.
+        page = await sync_to_async(viewset.paginate_queryset)(rows)
+    else:
+        rows = paginator.page_queryset(rows, request, viewset)
+        page = paginator.get_page([row async for row in aiterator(rows)])
+    return paginator.get_paginated_response(
+        viewset.get_row_representation().represent_many(page)
+    ).data
+
+
+@async_read(AccountViewSet, "list")
+async def account_list(viewset, request):
+    return await list_page(
+        viewset, request, viewset.filter_queryset(viewset.get_queryset())
+    )
+
+
+@async_read(AccountViewSet, "retrieve")
+async def account_detail(viewset, request, pk):
+    row = await aget(viewset.get_rows(viewset.get_queryset()), pk=pk)
+    return viewset.get_row_representation().represent(row)
+
+
+@async_read(TransactionViewSet, "list")
+async def transaction_list(viewset, request):
+    return await list_page(
+        viewset, request, viewset.filter_queryset(viewset.get_queryset())
+    )
+
+
+@async_read(BalanceHistoryViewSet, "list")
+async def balance_list(viewset, request):
+    return await list_page(
+        viewset, request, viewset.filter_queryset(viewset.get_queryset())
+    )
+
+
+@async_read(BalanceHistoryViewSet, "account")
+async def balance_account(viewset, request, account_id):
+    """
+    Get the balance history of an account, or its balance series with
+    ``from``/``to`` dates, as ``BalanceHistoryViewSet.account``.
+    """
+    owned = Account.objects.filter(owner_id=request.user.pk, number=str(account_id))
+    if not await aexists(owned):
+        raise serializers.ValidationError("Account does not exist")
+
+    if "from" in request.query_params or "to" in request.query_params:
+        series = await sync_to_async(balance_series)(
+            account_id, *viewset.get_series_range(request)
+        )
+        return BalanceHistorySerializer(series, many=True).data
+
+    page = await sync_to_async(viewset.paginate_archived)(
+        viewset.get_rows(BalanceHistory.objects.filter(account_id=account_id)),
+        [account_id],
+        lambda account_ids: viewset.get_rows(
+            ArchivedBalanceHistory.objects.filter(account_id__in=account_ids)
+        ),
+    )
+    return viewset.paginator.get_paginated_response(
+        viewset.get_row_representation().represent_many(page)
+    ).data
@@ -0,0 +1,400 @@
+import datetime
+import http.client
+import json
+import random
+import socketserver
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .ledger import balance_expression
+from .models import Account, BalanceHistory, Transaction
+from .representation import get_row_representation
+from .serializers import (
+    AccountSerializer,
+    BalanceHistorySerializer,
+    TransactionSerializer,
+)
+
+# Routes driven by the benchmark, formatted with the number of one of the
+# requesting user's accounts and today's date.
+ENDPOINTS = {
+    "account-list": "/account/",
+    "account-detail": "/account/{account}/",
+    "account-statement": "/account/{account}/statement/?format=ndjson",
+    "transaction-list": "/transaction/",
+    "balance-list": "/balance/",
+    "balance-account": "/balance/account/{account}/",
+    "balance-account-date": "/balance/account/{account}/{today}/",
+    "balance-series": "/balance/account/{account}/?from={month_ago}&to={today}",
+    "balance-rollups": (
+        "/balance/account/{account}/rollups/"
+        "?from={year_ago}&to={today}&granularity=month"
+    ),
+    "async-account-list": "/async/account/",
+    "async-account-detail": "/async/account/{account}/",
+    "async-transaction-list": "/async/transaction/",
+    "async-balance-list": "/async/balance/",
+    "async-balance-account": "/async/balance/account/{account}/",
+}
+
+# Querysets and serializers of the list endpoints, serialized by
+# compare_serialization.
+SERIALIZATION_CASES = {
+    "account": (
+        Account.objects.annotate(current_balance=balance_expression()),
+        AccountSerializer,
+    ),
+    "transaction": (Transaction.objects.all(), TransactionSerializer),
+    "balance": (BalanceHistory.objects.all(), BalanceHistorySerializer),
+}
+
+# Latency and throughput metrics compared against a baseline, all of them
+# lower is better except requests per second.
+COMPARED_METRICS = ("p50", "p95", "p99", "rps", "queries")
+
+
+class Target:
+    """A user of the seeded data set, with the JWT and accounts to request."""
+
+    def __init__(self, user, accounts):
+        token = AccessToken.for_user(user)
+        token.set_exp(lifetime=datetime.timedelta(days=1))
+        self.authorization = f"Bearer {token}"
+        self.accounts = accounts
+
+
+def get_targets(users):
+    accounts = {}
+    numbers = Account.objects.filter(owner__in=users).values_list("owner_id", "number")
+    for owner_id, number in numbers:
+        accounts.setdefault(owner_id, []).append(number)
+    return [Target(user, accounts[user.pk]) for user in users if user.pk in accounts]
+
+
+def build_requests(targets, endpoint, count, generator):
+    """Return ``count`` (authorization, path) pairs for an endpoint."""
+
+    today = timezone.localdate()
+    context = {
+        "today": today.isoformat(),
+        "month_ago": (today - datetime.timedelta(days=30)).isoformat(),
+        "year_ago": (today - datetime.timedelta(days=365)).isoformat(),
+    }
+    requests = []
+    for _ in range(count):
+        target = generator.choice(targets)
+        path = ENDPOINTS[endpoint].format(
+            account=generator.choice(target.accounts), **context
+        )
+        requests.append((target.authorization, path))
+    return requests
+
+
+def summarize(latencies, elapsed, queries, errors):
+    """Summarize the latencies (in seconds) of a run of requests."""
+
+    centiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50": round(centiles[49] * 1000, 3),
+        "p95": round(centiles[94] * 1000, 3),
+        "p99": round(centiles[98] * 1000, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "queries": round(queries / len(latencies), 2),
+    }
+
+
+def read_response(response):
+    if response.streaming:
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+def run_in_process(requests):
+    """
+    Send requests one after the other through DRF's test client, counting
+    the queries of each one.
+    """
+
+    client = APIClient()
+    latencies, queries, errors = [], 0, 0
+    started = time.perf_counter()
+    for authorization, path in requests:
+        with CaptureQueriesContext(connections["default"]) as captured:
+            start = time.perf_counter()
+            response = client.get(path, HTTP_AUTHORIZATION=authorization)
+            read_response(response)
+            latencies.append(time.perf_counter() - start)
+        queries += len(captured)
+        errors += response.status_code >= 400
+    return summarize(latencies, time.perf_counter() - started, queries, errors)
+
+
+class QueryCounter:
+    """
+    Count the queries run by every database connection opened while it is
+    connected, whatever the thread serving the request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def connection_created(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.connection_created)
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.connection_created)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class WSGIBenchmarkServer:
+    """Serve the project's WSGI application on a free local port."""
+
+    def __init__(self):
+        from core.wsgi import application
+
+        self.server = make_server(
+            "127.0.0.1",
+            0,
+            application,
+            server_class=ThreadingWSGIServer,
+            handler_class=QuietWSGIRequestHandler,
+        )
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class ASGIBenchmarkServer:
+    """Serve the project's ASGI application with uvicorn, when installed."""
+
+    def __init__(self):
+        import uvicorn
+        from core.asgi import application
+
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                application,
+                host="127.0.0.1",
+                port=0,
+                log_level="warning",
+                lifespan="off",
+            )
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+SERVERS = {"wsgi": WSGIBenchmarkServer, "asgi": ASGIBenchmarkServer}
+
+
+def run_over_server(server, requests, concurrency):
+    """
+    Send requests to a running server from ``concurrency`` client threads,
+    each with its own keep-alive connection.
+    """
+
+    local = threading.local()
+
+    def send(request):
+        authorization, path = request
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection("127.0.0.1", server.port)
+        start = time.perf_counter()
+        try:
+            local.connection.request(
+                "GET", path, headers={"Authorization": authorization}
+            )
+            response = local.connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader("Connection", "").lower() == "close":
+                local.connection.close()
+                del local.connection
+        except (OSError, http.client.HTTPException):
+            local.connection.close()
+            del local.connection
+            status = 599
+        return time.perf_counter() - start, status
+
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, requests))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, status in results]
+    errors = sum(status >= 400 for latency, status in results)
+    return summarize(latencies, elapsed, counter.count, errors)
+
+
+def run(users, endpoints, count, modes, concurrency=8, seed=0):
+    """
+    Benchmark ``endpoints`` in each of ``modes`` ("inprocess", "wsgi" or
+    "asgi") with ``count`` requests spread over the accounts of ``users``,
+    and return the summaries keyed by endpoint and mode.
+    """
+
+    targets = get_targets(users)
+    results = {}
+    for endpoint in endpoints:
+        requests = build_requests(targets, endpoint, count, random.Random(seed))
+        results[endpoint] = {}
+        for mode in modes:
+            if mode == "inprocess":
+                summary = run_in_process(requests)
+            else:
+                with SERVERS[mode]() as server:
+                    summary = run_over_server(server, requests, concurrency)
+            results[endpoint][mode] = summary
+    return results
+
+
+def best_time(func, repeat):
+    """Return the fastest of ``repeat`` runs of ``func``, in milliseconds."""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(min(timings) * 1000, 3)
+
+
+def compare_serialization(rows, repeat=3):
+    """
+    Time fetching ``rows`` rows of every list endpoint's model and rendering
+    them as JSON, through the serializer and through its compiled row
+    representation, and return the timings keyed by model.
+
+    Raises ``AssertionError`` if both paths do not render the same bytes.
+    """
+
+    renderer = JSONRenderer()
+    results = {}
+    for name, (queryset, serializer_class) in SERIALIZATION_CASES.items():
+        queryset = queryset.order_by("pk")[:rows]
+        representation = get_row_representation(serializer_class)
+
+        def serialize():
+            return renderer.render(serializer_class(queryset.all(), many=True).data)
+
+        def represent():
+            return renderer.render(
+                representation.represent_many(queryset.values(*representation.columns))
+            )
+
+        expected = serialize()
+        if represent() != expected:
+            raise AssertionError(f"The {name} representations differ")
+        serializer_ms = best_time(serialize, repeat)
+        rows_ms = best_time(represent, repeat)
+        results[name] = {
+            "rows": queryset.count(),
+            "serializer": serializer_ms,
+            "compiled": rows_ms,
+            "speedup": round(serializer_ms / rows_ms, 2),
+        }
+    return results
+
+
+def compare(baseline, results):
+    """
+    Return the relative change, in percent, of every metric of ``results``
+    found in ``baseline``, keyed like the results.
+    """
+
+    changes = {}
+    for endpoint, modes in results.items():
+        for mode, summary in modes.items():
+            previous = baseline.get(endpoint, {}).get(mode)
+            if not previous:
+                continue
+            changes.setdefault(endpoint, {})[mode] = {
+                metric: round(
+                    (summary[metric] - previous[metric]) * 100 / previous[metric], 1
+                )
+                for metric in COMPARED_METRICS
+                if previous.get(metric)
+            }
+    return changes
+
+
+def regressions(changes, threshold):
+    """
+    Return the (endpoint, mode, metric, change) of every metric that got
+    worse by more than ``threshold`` percent.
+    """
+
+    found = []
+    for endpoint, modes in changes.items():
+        for mode, metrics in modes.items():
+            for metric, change in metrics.items():
+                worse = -change if metric == "rps" else change
+                if worse > threshold:
+                    found.append((endpoint, mode, metric, change))
+    return found
+
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)["results"]
+
+
+def save_baseline(path, results, meta):
+    with open(path, "w") as file:
+        json.dump({"meta": meta, "results": results}, file, indent=2, sort_keys=True)
+        file.write("\n")
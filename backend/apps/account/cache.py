@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Account
+
+KEY_PREFIX = "account-api"
+
+
+def get_cache():
+    return caches[settings.ACCOUNT_API_CACHE]
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def account_scope(account_id):
+    return f"account:{account_id}"
+
+
+def get_versions(scopes):
+    """
+    Return the current version of every scope, starting missing ones.
+
+    A missing version is started from the clock rather than from 1, so a
+    version that was evicted can never come back and revive stale entries.
+    """
+
+    cache = get_cache()
+    keys = [f"{KEY_PREFIX}:version:{scope}" for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = f"{KEY_PREFIX}:version:{scope}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(user_id, account_ids=()):
+    """
+    Drop the cached responses of a user and of some of their accounts.
+
+    The versions are bumped right away and again once the surrounding
+    transaction commits, so a response cached from a concurrent read of the
+    not yet committed data cannot outlive the commit.
+    """
+
+    scopes = [user_scope(user_id)] + [account_scope(pk) for pk in account_ids]
+    bump_versions(scopes)
+    transaction.on_commit(
+        lambda: bump_versions(scopes), using=router.db_for_write(Account)
+    )
+
+
+def invalidate_accounts(account_ids):
+    """Drop the cached responses of some accounts and of their owners"""
+
+    accounts = defaultdict(list)
+    for pk, owner_id in Account.objects.filter(pk__in=account_ids).values_list(
+        "pk", "owner_id"
+    ):
+        accounts[owner_id].append(pk)
+    for owner_id, pks in accounts.items():
+        invalidate(owner_id, pks)
+
+
+def cached_response(account_kwarg=None):
+    """
+    Cache the serialized data of a view action per user, account and URL.
+
+    Entries are keyed by the current version of the user (and account) scope,
+    so ``invalidate`` makes them unreachable without deleting anything. The
+    key doubles as the ETag: a matching ``If-None-Match`` gets a 304 without
+    touching the database or any serializer.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            scopes = [user_scope(request.user.pk)]
+            if account_kwarg in kwargs:
+                scopes.append(account_scope(kwargs[account_kwarg]))
+
+            digest = hashlib.sha256(
+                repr(
+                    (
+                        get_versions(scopes),
+                        scopes,
+                        request.accepted_renderer.format,
+                        request.get_full_path(),
+                    )
+                ).encode()
+            ).hexdigest()
+            etag = quote_etag(digest)
+
+            if etag in parse_etags(request.headers.get("If-None-Match", "")):
+                return Response(
+                    status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+                )
+
+            cache = get_cache()
+            key = f"{KEY_PREFIX}:response:{digest}"
+            data = cache.get(key)
+            if data is None:
+                response = view(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, settings.ACCOUNT_API_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+
+            response["ETag"] = etag
+            return response
+
+        return wrapper
+
+    return decorator
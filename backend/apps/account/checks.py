@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core import checks
+
+# Cache backends only the process writing to them sees.
+PROCESS_CACHES = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+@checks.register(checks.Tags.caches)
+def check_outbox_cache(app_configs, **kwargs):
+    """
+    The process_outbox workers invalidate the cached responses of the
+    accounts they update, which only reaches the web processes through a
+    cache they share.
+    """
+
+    backend = settings.CACHES[settings.ACCOUNT_API_CACHE]["BACKEND"]
+    if settings.OUTBOX_EAGER or backend not in PROCESS_CACHES:
+        return []
+    return [
+        checks.Warning(
+            "The account API cache is local to every process, so the balance "
+            "history and rollups process_outbox writes are served stale until "
+            "the cached responses expire.",
+            hint="Use a shared cache backend for ACCOUNT_API_CACHE, or set "
+            "OUTBOX_EAGER=1.",
+            id="account.W001",
+        )
+    ]
@@ -0,0 +1,114 @@
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+
+
+def upsert(model, values, conflict_fields, updates=None, instance=None):
+    """
+    Insert a row or update the existing one with a single
+    ``INSERT ... ON CONFLICT (...) DO UPDATE`` statement.
+
+    ``values`` maps field names to Python values and ``conflict_fields`` names
+    the unique constraint to resolve on. ``updates`` maps the columns to change
+    on conflict to SQL expressions, where ``excluded.<column>`` is the value
+    that was about to be inserted; by default every non-conflict field takes
+    its new value.
+    """
+
+    using = router.db_for_write(model, instance=instance)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+
+    fields = [model._meta.get_field(name) for name in values]
+    columns = {field.name: quote(field.column) for field in fields}
+    params = [
+        field.get_db_prep_save(values[field.name], connection) for field in fields
+    ]
+    if updates is None:
+        updates = {
+            name: f"excluded.{column}"
+            for name, column in columns.items()
+            if name not in conflict_fields
+        }
+
+    table = quote(model._meta.db_table)
+    conflict = ", ".join(columns[name] for name in conflict_fields)
+    assignments = ", ".join(
+        f"{columns[name]} = {expression}" for name, expression in updates.items()
+    )
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns.values())}) "
+        f"VALUES ({', '.join(['%s'] * len(params))}) "
+        f"ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def copy_rows(model, queryset, using, batch_size=1000, ignore_conflicts=False):
+    """
+    Insert the rows of ``queryset`` as they are into the table of ``model``
+    in database ``using`` and return how many were copied.
+
+    Unlike ``bulk_create``, the primary keys and the ``auto_now`` and
+    ``auto_now_add`` columns keep their stored values. ``queryset`` may be of
+    another model with the same fields. With ``ignore_conflicts``, rows
+    already copied are skipped.
+    """
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    sql = (
+        f"{connection.ops.insert_statement(ignore_conflicts=ignore_conflicts)} "
+        f"{quote(model._meta.db_table)} "
+        f"({', '.join(quote(field.column) for field in fields)}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))}) "
+        f"{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts)}"
+    ).rstrip()
+
+    copied, batch = 0, []
+    rows = queryset.order_by("pk").values_list(*(field.attname for field in fields))
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(
+            [
+                field.get_db_prep_save(value, connection)
+                for field, value in zip(fields, row)
+            ]
+        )
+        if len(batch) == batch_size:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            copied, batch = copied + len(batch), []
+    if batch:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        copied += len(batch)
+    return copied
+
+
+# Async counterparts of QuerySet methods, as the async ORM runs them: in
+# Django's thread for sync code, so that a request keeps using the connection
+# of that thread and its transaction, while async callers do not block the
+# event loop on the database.
+
+
+async def aget(queryset, *args, **kwargs):
+    return await sync_to_async(queryset.get)(*args, **kwargs)
+
+
+async def aexists(queryset):
+    return await sync_to_async(queryset.exists)()
+
+
+async def aiterator(queryset, chunk_size=2000):
+    """Iterate over ``queryset``, fetching ``chunk_size`` rows at a time"""
+
+    rows = queryset.iterator(chunk_size)
+    while True:
+        chunk = await sync_to_async(lambda: list(itertools.islice(rows, chunk_size)))()
+        if not chunk:
+            return
+        for row in chunk:
+            yield row
@@ -0,0 +1,154 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.user.authentication import ClaimsJWTAuthentication
+from core.sharding import use_shard
+
+from .async_views import get_routing
+from .events import format_batch, get_broker, replay
+
+
+def authenticate(raw_token):
+    """Return the id of the user of a raw access token"""
+
+    authentication = ClaimsJWTAuthentication()
+    return authentication.get_user(authentication.get_validated_token(raw_token)).pk
+
+
+def routed_replay(user_id, last_event_id):
+    alias = get_routing(user_id)[0]
+    if alias is None:
+        return replay(user_id, last_event_id)
+    with use_shard(alias):
+        return replay(user_id, last_event_id)
+
+
+class EventStreamApplication:
+    """
+    ASGI application serving ``path`` as a Server-Sent Events stream of the
+    transactions and balance changes of the authenticated user, and passing
+    every other request to ``application``.
+
+    Browsers cannot set headers on an ``EventSource``, so the access token
+    may also be given as the ``token`` query parameter, and the id to resume
+    after as ``last_event_id``. A resuming client first gets the batch it
+    missed, read from the database, then the batches published live.
+    """
+
+    def __init__(self, application, path="/events/"):
+        self.application = application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.application(scope, receive, send)
+
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        query = {
+            name: values[-1]
+            for name, values in parse_qs(scope["query_string"].decode()).items()
+        }
+        cors = []
+        if headers.get("origin") in settings.CORS_ALLOWED_ORIGINS:
+            cors = [(b"access-control-allow-origin", headers["origin"].encode())]
+
+        if scope["method"] != "GET":
+            return await self.error(send, 405, "Method not allowed.", cors)
+
+        raw_token = query.get("token")
+        authorization = headers.get("authorization", "").split()
+        if (
+            len(authorization) == 2
+            and authorization[0] in api_settings.AUTH_HEADER_TYPES
+        ):
+            raw_token = authorization[1]
+        if raw_token is None:
+            return await self.error(
+                send, 401, "Authentication credentials were not provided.", cors
+            )
+        try:
+            user_id = await sync_to_async(authenticate)(raw_token)
+        except (AuthenticationFailed, InvalidToken) as exc:
+            return await self.error(send, 401, str(exc.detail["detail"]), cors)
+
+        try:
+            last_event_id = int(
+                headers.get("last-event-id") or query.get("last_event_id") or ""
+            )
+        except ValueError:
+            last_event_id = None
+
+        # Subscribe before reading what was missed, so nothing falls between.
+        subscription = get_broker().subscribe(user_id)
+        watcher = asyncio.create_task(self.watch_disconnect(receive, subscription))
+        try:
+            await self.stream(send, subscription, user_id, last_event_id, cors)
+        finally:
+            subscription.close()
+            watcher.cancel()
+
+    async def stream(self, send, subscription, user_id, last_event_id, cors):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                    *cors,
+                ],
+            }
+        )
+
+        if last_event_id is not None:
+            batch = await sync_to_async(routed_replay)(user_id, last_event_id)
+            if batch is not None:
+                last_event_id = batch[0]
+                await self.send_body(send, format_batch(*batch))
+
+        while True:
+            batch = await subscription.get(settings.ACCOUNT_EVENTS_HEARTBEAT)
+            if batch is None:
+                break
+            event_id, events = batch
+            if not events:
+                # Keeps proxies from closing idle streams.
+                await self.send_body(send, b": keepalive\n\n")
+            elif last_event_id is None or event_id > last_event_id:
+                last_event_id = event_id
+                await self.send_body(send, format_batch(event_id, events))
+
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send_body(self, send, body):
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    async def watch_disconnect(self, receive, subscription):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        subscription.close()
+
+    async def error(self, send, status, detail, cors):
+        headers = [(b"content-type", b"application/json"), *cors]
+        if status == 401:
+            challenge = ClaimsJWTAuthentication().authenticate_header(None)
+            headers.append((b"www-authenticate", challenge.encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": json.dumps({"detail": detail}).encode(),
+            }
+        )
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .ledger import balances
+from .models import Account, Transaction
+from .serializers import AccountBalanceSerializer, TransactionSerializer
+
+# Events are sent in batches, one per committed change. Only the last event
+# of a batch carries an id, the last transaction id of the user so far, so
+# the Last-Event-ID of a client never points into the middle of a batch.
+
+
+def transaction_event(instance):
+    return ("transaction", TransactionSerializer(instance).data)
+
+
+def balance_event(account_id, balance, as_of):
+    return (
+        "balance",
+        AccountBalanceSerializer(
+            {"ID": account_id, "balance": balance, "as_of": as_of}
+        ).data,
+    )
+
+
+def format_batch(event_id, events):
+    """Return a batch of (type, data) events in the event stream format"""
+
+    lines = []
+    for index, (event_type, data) in enumerate(events, start=1):
+        if index == len(events) and event_id is not None:
+            lines.append(f"id: {event_id}\n")
+        lines.append(f"event: {event_type}\ndata: {json.dumps(data)}\n\n")
+    return "".join(lines).encode()
+
+
+class Subscription:
+    """
+    Batches published to a user, queued for a stream served on the event
+    loop that subscribed.
+    """
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    def deliver(self, batch):
+        """Queue a batch, from the event loop of the subscription"""
+
+        if self.closed:
+            return
+        if self.queue.qsize() >= settings.ACCOUNT_EVENTS_QUEUE_SIZE:
+            # The stream fell behind. Ending it makes the client reconnect
+            # and catch up from the database instead of buffering here.
+            self.close()
+        else:
+            self.queue.put_nowait(batch)
+
+    def close(self):
+        """End the stream once the queued batches are sent"""
+
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(None)
+        self.broker.unsubscribe(self)
+
+    async def get(self, timeout):
+        """
+        Return the next (id, events) batch, None once closed, or an empty
+        batch when nothing was published for ``timeout`` seconds.
+        """
+
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return (None, [])
+
+
+class InProcessBroker:
+    """
+    Fan out the batches published to a user to the streams of the user
+    served by this process.
+
+    An idle subscription is an empty queue, so subscribers cost no thread
+    and no work until something is published to them. Publishers never wait
+    on subscribers: batches are handed over to the event loop of every
+    subscription. Users are keyed by the string of their id, as it appears
+    in tokens.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, str(user_id))
+        with self.lock:
+            self.subscriptions[subscription.user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def has_subscribers(self, user_id):
+        with self.lock:
+            return str(user_id) in self.subscriptions
+
+    def publish(self, user_id, batch):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(str(user_id), ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, batch)
+            except RuntimeError:
+                # The event loop of the subscription is closed.
+                self.unsubscribe(subscription)
+
+
+@functools.lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.ACCOUNT_EVENTS_BROKER)()
+
+
+def publish_postings(user_id, transactions, new_balances):
+    """
+    Publish the transaction events of ``transactions`` and the new balance
+    of every account they touch to the subscribers of ``user_id``, once the
+    surrounding transaction commits.
+    """
+
+    def publish():
+        broker = get_broker()
+        if not broker.has_subscribers(user_id):
+            return
+        now = timezone.now()
+        events = [transaction_event(instance) for instance in transactions]
+        events += [
+            balance_event(account_id, balance, now)
+            for account_id, balance in new_balances.items()
+        ]
+        broker.publish(user_id, (max(instance.pk for instance in transactions), events))
+
+    transaction.on_commit(publish, using=router.db_for_write(Account))
+
+
+def replay(user_id, last_event_id):
+    """
+    Return the batch of events a client resuming after ``last_event_id``
+    missed: the transactions committed since and the balance of the
+    accounts they touched.
+
+    Past ``ACCOUNT_EVENTS_REPLAY_LIMIT`` transactions, a ``reset`` event
+    tells the client to reload instead.
+    """
+
+    limit = settings.ACCOUNT_EVENTS_REPLAY_LIMIT
+    missed = list(
+        Transaction.objects.filter(
+            account__owner_id=user_id, pk__gt=last_event_id
+        ).order_by("pk")[: limit + 1]
+    )
+    if not missed:
+        return None
+    if len(missed) > limit:
+        latest = Transaction.objects.filter(account__owner_id=user_id).aggregate(
+            latest=Max("pk")
+        )["latest"]
+        return (latest, [("reset", {})])
+
+    now = timezone.now()
+    events = [transaction_event(instance) for instance in missed]
+    account_ids = sorted({instance.account_id for instance in missed})
+    events += [
+        balance_event(account_id, balance, now)
+        for account_id, balance in balances(account_ids).items()
+    ]
+    return (missed[-1].pk, events)
@@ -0,0 +1,101 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .ledger import append_entries
+from .models import Account, BalanceHistory, Transaction
+from .services import ROLLUP_MODELS, rebuild_rollups, transaction_delta
+
+# Password of every seeded user.
+SEED_PASSWORD = "Bench123!"
+
+
+def seed(users, accounts, transactions, batch_size=5000, days=365, seed=0):
+    """
+    Bulk create ``users`` users with ``accounts`` accounts each and
+    ``transactions`` transactions per account, spread over the last ``days``
+    days, and return the users.
+
+    Rows are written with ``bulk_create`` and the derived data (balances,
+    balance history and rollups) is computed afterwards with set-based
+    queries, so large data sets can be created quickly.
+    """
+
+    generator = random.Random(seed)
+    User = get_user_model()
+    password = make_password(SEED_PASSWORD)
+    now = timezone.now()
+
+    with transaction.atomic():
+        created = User.objects.bulk_create(
+            User(username=f"bench-{seed}-{index}", password=password)
+            for index in range(users)
+        )
+        Account.objects.bulk_create(
+            Account(owner=user) for user in created for _ in range(accounts)
+        )
+        numbers = list(
+            Account.objects.filter(owner__in=created).values_list("number", flat=True)
+        )
+
+        rows = (
+            Transaction(
+                account_id=number,
+                type=generator.choice(Transaction.TransactionType.values),
+                amount=Decimal(generator.randint(1, 50000)) / 100,
+                note=f"Seeded transaction {index}",
+                date=now
+                - datetime.timedelta(seconds=generator.randint(0, days * 86400)),
+            )
+            for number in numbers
+            for index in range(transactions)
+        )
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                Transaction.objects.bulk_create(batch)
+                batch = []
+        Transaction.objects.bulk_create(batch)
+
+        settle(numbers, batch_size)
+    return created
+
+
+def settle(numbers, batch_size=5000):
+    """
+    Post the transactions of bulk created accounts to the ledger, and derive
+    today's balance history and the rollups from them.
+    """
+
+    rows = (
+        Transaction.objects.filter(account_id__in=numbers)
+        .order_by("account_id", "id")
+        .values_list("account_id", "type", "amount", "id")
+    )
+    balances = append_entries(
+        (
+            (account_id, transaction_delta(transaction_type, amount), pk)
+            for account_id, transaction_type, amount, pk in rows.iterator(
+                chunk_size=batch_size
+            )
+        ),
+        account_ids=numbers,
+        batch_size=batch_size,
+    )
+
+    BalanceHistory.objects.filter(account_id__in=numbers).delete()
+    BalanceHistory.objects.bulk_create(
+        (
+            BalanceHistory(account_id=number, balance=balance)
+            for number, balance in balances.items()
+        ),
+        batch_size=batch_size,
+    )
+    for model in ROLLUP_MODELS:
+        rebuild_rollups(model, numbers)
@@ -0,0 +1,136 @@
+import datetime
+import decimal
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from .ledger import CENT
+from .models import Transaction
+from .money import MONEY_DECIMAL_PLACES, MONEY_MAX_DIGITS
+from .services import day_start
+
+# Full-text index over the transaction notes, see migration 0007.
+TRANSACTION_NOTE_INDEX = "account_transaction_fts"
+
+# The trigram tokenizer cannot match anything shorter.
+MIN_INDEXED_NOTE_LENGTH = 3
+
+# Largest id the 64-bit integer id columns hold.
+MAX_ID = 2**63 - 1
+
+
+def note_search(queryset, note):
+    """
+    Filter ``queryset`` to the transactions whose note contains ``note``,
+    ignoring case, through the full-text index when the database has one.
+    """
+
+    if (
+        queryset.model is not Transaction
+        or connections[queryset.db].vendor != "sqlite"
+        or len(note) < MIN_INDEXED_NOTE_LENGTH
+    ):
+        return queryset.filter(note__icontains=note)
+
+    phrase = '"' + note.replace('"', '""') + '"'
+    return queryset.filter(
+        id__in=RawSQL(
+            f"SELECT rowid FROM {TRANSACTION_NOTE_INDEX} "
+            f"WHERE {TRANSACTION_NOTE_INDEX} MATCH %s",
+            [phrase],
+        )
+    )
+
+
+def parse_date_range(params):
+    """
+    Return the first instant of the ``from`` date and the one after the
+    ``to`` date of the query parameters, None when they are not given.
+    """
+
+    try:
+        start, end = (
+            datetime.date.fromisoformat(params[name]) if params.get(name) else None
+            for name in ("from", "to")
+        )
+    except ValueError:
+        raise serializers.ValidationError("Dates must be formatted as YYYY-MM-DD")
+    return (
+        None if start is None else day_start(start),
+        None if end is None else day_start(end + datetime.timedelta(days=1)),
+    )
+
+
+def parse_amount(value):
+    """Return an amount query parameter, within the range of ``MoneyField``"""
+
+    try:
+        amount = decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise serializers.ValidationError("Amounts must be decimal numbers")
+    digits = MONEY_MAX_DIGITS - MONEY_DECIMAL_PLACES
+    if abs(amount) >= decimal.Decimal(10) ** digits or amount != amount.quantize(CENT):
+        raise serializers.ValidationError(
+            f"Amounts must have at most {digits} digits before the decimal point "
+            f"and {MONEY_DECIMAL_PLACES} after"
+        )
+    return amount
+
+
+def parse_id(value, message):
+    """Return an id query parameter, within the range of the id columns"""
+
+    if not (value.isascii() and value.isdigit()) or int(value) > MAX_ID:
+        raise serializers.ValidationError(message)
+    return int(value)
+
+
+class TransactionFilter(BaseFilterBackend):
+    """
+    Filter transactions by the ``account``, ``type``, ``from`` and ``to``
+    dates, ``amount_min`` and ``amount_max`` and ``note`` query parameters.
+
+    Every filter is served by an index: the account ones by the composite
+    indexes of ``Transaction`` and the note one by a trigram full-text index.
+    Archived transactions are filtered the same way, their notes without an
+    index.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        if params.get("account"):
+            queryset = queryset.filter(
+                account_id=parse_id(params["account"], "Invalid account")
+            )
+
+        if params.get("type"):
+            if params["type"] not in Transaction.TransactionType.values:
+                raise serializers.ValidationError(
+                    "Type must be one of: "
+                    + ", ".join(Transaction.TransactionType.values)
+                )
+            queryset = queryset.filter(type=params["type"])
+
+        start, end = parse_date_range(params)
+        if start is not None:
+            queryset = queryset.filter(date__gte=start)
+        if end is not None:
+            queryset = queryset.filter(date__lt=end)
+
+        low, high = (
+            parse_amount(params[name]) if params.get(name) else None
+            for name in ("amount_min", "amount_max")
+        )
+        if low is not None:
+            queryset = queryset.filter(amount__gte=low)
+        if high is not None:
+            queryset = queryset.filter(amount__lte=high)
+
+        if params.get("note"):
+            queryset = note_search(queryset, params["note"])
+        return queryset
@@ -0,0 +1,157 @@
+import datetime
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .services import run_with_retry
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+KEY_PREFIX = "idempotency"
+
+
+def get_cache():
+    return caches[settings.IDEMPOTENCY_CACHE]
+
+
+def cache_key(user_id, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"{KEY_PREFIX}:{user_id}:{digest}"
+
+
+def fingerprint(request):
+    """Hash the method, path and payload of a request"""
+
+    data = request.data
+    if isinstance(data, QueryDict):
+        data = dict(data.lists())
+    payload = json.dumps(
+        [request.method, request.get_full_path(), data],
+        sort_keys=True,
+        cls=DjangoJSONEncoder,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def remember(user_id, key, entry, expires_at):
+    timeout = (expires_at - timezone.now()).total_seconds()
+    if timeout > 0:
+        get_cache().set(cache_key(user_id, key), entry, timeout)
+
+
+def lookup(user_id, key):
+    """
+    Return the stored entry of a key as a dict, from the front cache when
+    possible, or None when the key is unknown or expired.
+    """
+
+    entry = get_cache().get(cache_key(user_id, key))
+    if entry is not None:
+        return entry
+
+    row = (
+        IdempotencyKey.objects.filter(
+            user_id=user_id, key=key, expires_at__gt=timezone.now()
+        )
+        .values("fingerprint", "status_code", "response", "expires_at")
+        .first()
+    )
+    if row is None:
+        return None
+    expires_at = row.pop("expires_at")
+    remember(user_id, key, row, expires_at)
+    return row
+
+
+def store(user_id, key, entry):
+    """Store the response of a key, replacing an expired entry of it"""
+
+    now = timezone.now()
+    expires_at = now + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    IdempotencyKey.objects.filter(
+        user_id=user_id, key=key, expires_at__lte=now
+    ).delete()
+    IdempotencyKey.objects.create(
+        user_id=user_id, key=key, expires_at=expires_at, **entry
+    )
+    return expires_at
+
+
+def replay(request, entry):
+    if entry["fingerprint"] != fingerprint(request):
+        return Response(
+            {"detail": f"{HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(
+        entry["response"],
+        status=entry["status_code"],
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+def idempotent(view):
+    """
+    Make a view action safe to retry with an ``Idempotency-Key`` header.
+
+    The first successful response of a key is stored in the same database
+    transaction as the writes of the view, and replayed to later requests
+    with the same key without running the view again. A key reused for a
+    different payload is refused. Requests without the header are handled
+    as usual.
+    """
+
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return Response(
+                {"detail": f"{HEADER} is too long"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        user_id = request.user.pk
+        entry = lookup(user_id, key)
+        if entry is not None:
+            return replay(request, entry)
+
+        def run():
+            response = view(self, request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                return response, None
+            entry = {
+                "fingerprint": fingerprint(request),
+                "status_code": response.status_code,
+                "response": json.loads(
+                    json.dumps(response.data, cls=DjangoJSONEncoder)
+                ),
+            }
+            return response, (entry, store(user_id, key, entry))
+
+        try:
+            response, stored = run_with_retry(run)
+        except IntegrityError:
+            # A concurrent request with the same key committed first.
+            entry = lookup(user_id, key)
+            if entry is None:
+                raise
+            return replay(request, entry)
+
+        if stored is not None:
+            remember(user_id, key, *stored)
+        return response
+
+    return wrapper
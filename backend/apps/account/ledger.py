@@ -0,0 +1,203 @@
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import ExpressionWrapper, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Account, BalanceCheckpoint, LedgerEntry
+from .money import MoneyField, money
+
+CENT = Decimal("0.01")
+
+
+def balance_expression(sequence=None):
+    """
+    Expression of the balance of the outer ``Account`` after its entry
+    numbered ``sequence``, or after its last entry: the latest checkpoint
+    plus the entries since, which are fewer than the checkpoint interval.
+    """
+
+    def latest_checkpoint(account):
+        checkpoints = BalanceCheckpoint.objects.filter(account=account)
+        if sequence is not None:
+            checkpoints = checkpoints.filter(sequence__lte=sequence)
+        return checkpoints.order_by("-sequence")[:1]
+
+    entries = LedgerEntry.objects.filter(
+        account=OuterRef("pk"),
+        sequence__gt=Coalesce(
+            Subquery(latest_checkpoint(OuterRef(OuterRef("pk"))).values("sequence")),
+            0,
+        ),
+    )
+    if sequence is not None:
+        entries = entries.filter(sequence__lte=sequence)
+
+    return ExpressionWrapper(
+        Coalesce(
+            Subquery(latest_checkpoint(OuterRef("pk")).values("balance")), money(0)
+        )
+        + Coalesce(
+            Subquery(
+                entries.values("account").annotate(total=Sum("amount")).values("total")
+            ),
+            money(0),
+        ),
+        output_field=MoneyField(),
+    )
+
+
+def balances(account_ids, sequence=None):
+    """Return the balance of every account, in one query"""
+    rows = (
+        Account.objects.filter(pk__in=account_ids)
+        .annotate(balance=balance_expression(sequence))
+        .values_list("pk", "balance")
+    )
+    return {pk: balance.quantize(CENT) for pk, balance in rows}
+
+
+def balance_at(account_id, moment):
+    """
+    Return the balance of an account as of ``moment``, from the checkpoint
+    and entries before the last entry posted by then.
+    """
+
+    sequence = (
+        LedgerEntry.objects.filter(
+            account_id=account_id, posted_at__lte=moment, sequence__isnull=False
+        )
+        .order_by("-posted_at", "-sequence")
+        .values_list("sequence", flat=True)
+        .first()
+    )
+    if sequence is None:
+        return Decimal(0)
+    return balances([account_id], sequence)[account_id]
+
+
+def latest_checkpoint_sequence(account):
+    return Subquery(
+        BalanceCheckpoint.objects.filter(account=account)
+        .order_by("-sequence")
+        .values("sequence")[:1]
+    )
+
+
+def account_state(account_id):
+    """Return the ``ledger_state`` of a single account"""
+
+    checkpoint = (
+        BalanceCheckpoint.objects.filter(account_id=account_id)
+        .order_by("-sequence")
+        .values_list("sequence", "balance")
+        .first()
+    )
+    sequence, balance = checkpoint or (0, Decimal(0))
+    since = LedgerEntry.objects.filter(
+        account_id=account_id, sequence__gt=sequence
+    ).aggregate(last=Max("sequence"), total=Sum("amount"))
+    if since["last"] is None:
+        return [sequence, sequence, balance.quantize(CENT)]
+    return [since["last"], sequence, (balance + since["total"]).quantize(CENT)]
+
+
+def ledger_state(account_ids):
+    """
+    Return the last sequence, last checkpoint sequence and balance of every
+    account, from its latest checkpoint and the entries since.
+
+    Postings read this inside their write lock, so it is kept to two flat
+    queries: ``balance_expression`` costs more to build than to run.
+    """
+
+    account_ids = list(account_ids)
+    if len(account_ids) == 1:
+        return {account_ids[0]: account_state(account_ids[0])}
+
+    state = {pk: [0, 0, Decimal(0)] for pk in account_ids}
+    checkpoints = BalanceCheckpoint.objects.filter(
+        account_id__in=account_ids,
+        sequence=latest_checkpoint_sequence(OuterRef("account")),
+    ).values_list("account_id", "sequence", "balance")
+    for pk, sequence, balance in checkpoints:
+        state[pk] = [sequence, sequence, balance]
+
+    since = (
+        LedgerEntry.objects.filter(
+            account_id__in=account_ids,
+            sequence__gt=Coalesce(latest_checkpoint_sequence(OuterRef("account")), 0),
+        )
+        .values("account_id")
+        .annotate(last=Max("sequence"), total=Sum("amount"))
+        .values_list("account_id", "last", "total")
+    )
+    for pk, last, total in since:
+        state[pk][0] = last
+        state[pk][2] += total
+
+    for account in state.values():
+        account[2] = account[2].quantize(CENT)
+    return state
+
+
+def append_entries(postings, account_ids=None, batch_size=1000):
+    """
+    Append the ledger entries of ``postings``, (account id, signed amount,
+    transaction id) tuples applied in order, and return the new balance of
+    every account they touch.
+
+    Only inserts are written: the two legs of every posting, and a
+    checkpoint whenever an account reaches ``LEDGER_CHECKPOINT_INTERVAL``
+    entries since its last one. ``account_ids`` lists the accounts upfront,
+    so ``postings`` can be streamed.
+    """
+
+    if account_ids is None:
+        postings = list(postings)
+        account_ids = {account_id for account_id, amount, transaction in postings}
+    state = ledger_state(account_ids)
+    interval = settings.LEDGER_CHECKPOINT_INTERVAL
+    now = timezone.now()
+
+    entries, checkpoints = [], []
+    for account_id, amount, transaction_id in postings:
+        account = state[account_id]
+        account[0] += 1
+        account[2] += amount
+        posting = uuid.uuid4()
+        entries += [
+            LedgerEntry(
+                account_id=account_id,
+                book=LedgerEntry.Book.ACCOUNT,
+                sequence=account[0],
+                posting=posting,
+                amount=amount,
+                transaction_id=transaction_id,
+                posted_at=now,
+            ),
+            LedgerEntry(
+                account_id=account_id,
+                book=LedgerEntry.Book.EXTERNAL,
+                posting=posting,
+                amount=-amount,
+                transaction_id=transaction_id,
+                posted_at=now,
+            ),
+        ]
+        if account[0] - account[1] >= interval:
+            checkpoints.append(
+                BalanceCheckpoint(
+                    account_id=account_id, sequence=account[0], balance=account[2]
+                )
+            )
+            account[1] = account[0]
+        if len(entries) >= batch_size:
+            LedgerEntry.objects.bulk_create(entries)
+            entries = []
+
+    LedgerEntry.objects.bulk_create(entries)
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=batch_size)
+    return {account_id: account[2] for account_id, account in state.items()}
@@ -0,0 +1,73 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import archive, archive_horizon
+from ...models import Transaction
+from ...outbox import outbox_databases, routed
+from ...services import day_start
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the transactions and balance history entries older than the "
+        "archive horizon to the archive tables, checkpointing the balance of "
+        "every account at the cutoff. Meant to run on a schedule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help=(
+                "Archive the rows older than this many days. Defaults to "
+                "ARCHIVE_AFTER_DAYS."
+            ),
+        )
+        parser.add_argument(
+            "--before",
+            type=datetime.date.fromisoformat,
+            help="Archive the rows before this day, as YYYY-MM-DD, instead.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows moved per database transaction.",
+        )
+        parser.add_argument(
+            "--database",
+            action="append",
+            help="Only archive the rows of this database. Can be repeated.",
+        )
+
+    def handle(self, *args, days, before, batch_size, **options):
+        aliases = options["database"] or outbox_databases()
+        unknown = set(aliases) - set(settings.DATABASES)
+        if unknown:
+            raise CommandError(f"Unknown databases: {', '.join(sorted(unknown))}")
+        if days is not None and before is not None:
+            raise CommandError("--days and --before are exclusive")
+
+        horizon = archive_horizon(days) if before is None else day_start(before)
+        moved = {}
+        for alias in aliases:
+            with routed(alias):
+                for model, count in archive(horizon, batch_size).items():
+                    moved[model] = moved.get(model, 0) + count
+                    if options["verbosity"] > 1:
+                        self.stdout.write(
+                            f"Archived {count} {model._meta.verbose_name_plural}"
+                            f" of {alias}"
+                        )
+
+        transactions = moved.pop(Transaction)
+        history = sum(moved.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {transactions} transactions and {history} balance "
+                f"history entries before {horizon.isoformat()}"
+            )
+        )
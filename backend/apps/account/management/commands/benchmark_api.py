@@ -0,0 +1,220 @@
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ... import benchmark
+from ...factories import seed
+
+MODES = ("inprocess", "wsgi", "asgi")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and measure the latency, throughput and "
+        "queries per request of the account API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Users to seed.")
+        parser.add_argument(
+            "--accounts", type=int, default=5, help="Accounts seeded per user."
+        )
+        parser.add_argument(
+            "--transactions",
+            type=int,
+            default=200,
+            help="Transactions seeded per account.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Requests sent per endpoint and mode.",
+        )
+        parser.add_argument(
+            "--endpoint",
+            dest="endpoints",
+            action="append",
+            choices=benchmark.ENDPOINTS,
+            help="Only benchmark this endpoint. May be given several times.",
+        )
+        parser.add_argument(
+            "--mode",
+            dest="modes",
+            action="append",
+            choices=MODES,
+            help=(
+                "Drive the API in-process through the test client, or over a "
+                "local WSGI or ASGI (uvicorn) server. May be given several "
+                "times. Defaults to inprocess and wsgi."
+            ),
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Client threads sending requests to the server modes.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the generated data."
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Keep the API response cache enabled.",
+        )
+        parser.add_argument(
+            "--output", help="Save the results as a baseline JSON file."
+        )
+        parser.add_argument(
+            "--compare", help="Compare the results with a baseline JSON file."
+        )
+        parser.add_argument(
+            "--fail-over",
+            type=float,
+            help=(
+                "Fail when a metric is more than this percentage worse than in "
+                "the --compare baseline."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        modes = options["modes"] or ["inprocess", "wsgi"]
+        if "asgi" in modes:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError("The asgi mode requires uvicorn to be installed")
+        if options["fail_over"] is not None and not options["compare"]:
+            raise CommandError("--fail-over requires --compare")
+        baseline = (
+            benchmark.load_baseline(options["compare"]) if options["compare"] else None
+        )
+
+        overrides = {
+            "DEBUG": False,
+            "ALLOWED_HOSTS": ["testserver", "127.0.0.1", "localhost"],
+        }
+        if not options["cache"]:
+            overrides["CACHES"] = {
+                **settings.CACHES,
+                "benchmark": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            }
+            overrides["ACCOUNT_API_CACHE"] = "benchmark"
+
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(**overrides):
+                results = self.run_benchmark(modes, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        if options["output"]:
+            meta = {
+                "commit": git_commit(),
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                **{
+                    name: options[name]
+                    for name in (
+                        "users",
+                        "accounts",
+                        "transactions",
+                        "requests",
+                        "concurrency",
+                        "seed",
+                        "cache",
+                    )
+                },
+            }
+            benchmark.save_baseline(options["output"], results, meta)
+            self.stdout.write(f"Saved the results to {options['output']}")
+        if baseline is not None:
+            self.report_changes(baseline, results, options["fail_over"])
+
+    def run_benchmark(self, modes, options):
+        started = time.perf_counter()
+        users = seed(
+            options["users"],
+            options["accounts"],
+            options["transactions"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            f"Seeded {options['users']} users, "
+            f"{options['users'] * options['accounts']} accounts and "
+            f"{options['users'] * options['accounts'] * options['transactions']} "
+            f"transactions in {time.perf_counter() - started:.1f}s"
+        )
+        return benchmark.run(
+            users,
+            options["endpoints"] or list(benchmark.ENDPOINTS),
+            options["requests"],
+            modes,
+            concurrency=options["concurrency"],
+            seed=options["seed"],
+        )
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<22} {'mode':<10} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'req/s':>9} {'queries':>8} {'errors':>7}"
+        )
+        for endpoint, modes in results.items():
+            for mode, summary in modes.items():
+                self.stdout.write(
+                    f"{endpoint:<22} {mode:<10} {summary['p50']:>9.2f} "
+                    f"{summary['p95']:>9.2f} {summary['p99']:>9.2f} "
+                    f"{summary['rps']:>9.1f} {summary['queries']:>8.2f} "
+                    f"{summary['errors']:>7}"
+                )
+
+    def report_changes(self, baseline, results, threshold):
+        changes = benchmark.compare(baseline, results)
+        self.stdout.write("Change from the baseline, in percent:")
+        for endpoint, modes in changes.items():
+            for mode, metrics in modes.items():
+                self.stdout.write(
+                    f"{endpoint:<22} {mode:<10} "
+                    + " ".join(
+                        f"{metric} {change:+.1f}" for metric, change in metrics.items()
+                    )
+                )
+        if threshold is None:
+            return
+        found = benchmark.regressions(changes, threshold)
+        if found:
+            raise CommandError(
+                "Regressions over {}%: {}".format(
+                    threshold,
+                    ", ".join(
+                        f"{endpoint} {mode} {metric} {change:+.1f}%"
+                        for endpoint, mode, metric, change in found
+                    ),
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(f"No regression over {threshold}%"))
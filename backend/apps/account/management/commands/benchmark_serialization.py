@@ -0,0 +1,64 @@
+import math
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ... import benchmark
+from ...factories import seed
+
+# Users the rows are spread over.
+USERS = 100
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and compare serializing the list endpoints "
+        "through their serializers and through the compiled row path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            action="append",
+            help=(
+                "Rows serialized per model. May be given several times. "
+                "Defaults to 10000 and 100000."
+            ),
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs of every measurement, the fastest one is kept.",
+        )
+
+    def handle(self, *args, rows, repeat, **options):
+        rows = sorted(rows or [10000, 100000])
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            started = time.perf_counter()
+            # One transaction per account, and one balance history entry.
+            seed(USERS, math.ceil(rows[-1] / USERS), 1)
+            self.stdout.write(
+                f"Seeded {rows[-1]} rows per model in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+
+            self.stdout.write(
+                f"{'model':<12} {'rows':>8} {'serializer ms':>14} "
+                f"{'compiled ms':>12} {'speedup':>8}"
+            )
+            for count in rows:
+                results = benchmark.compare_serialization(count, repeat)
+                for name, result in results.items():
+                    self.stdout.write(
+                        f"{name:<12} {result['rows']:>8} "
+                        f"{result['serializer']:>14.1f} "
+                        f"{result['compiled']:>12.1f} {result['speedup']:>7.1f}x"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
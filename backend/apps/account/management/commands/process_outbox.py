@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...outbox import outbox_databases, process_batch
+
+POOLS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+
+class Command(BaseCommand):
+    help = (
+        "Carry out the derived work written to the outbox by postings: balance "
+        "history and rollups. Runs until stopped, or until the outbox is empty "
+        "with --once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of messages carried out per transaction.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of batches carried out concurrently.",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=sorted(POOLS),
+            default="thread",
+            help="Run the workers as threads or processes.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds waited when the outbox is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop once the outbox is empty.",
+        )
+        parser.add_argument(
+            "--database",
+            action="append",
+            help="Only process the outbox of this database. Can be repeated.",
+        )
+
+    def handle(self, *args, batch_size, workers, pool, interval, once, **options):
+        aliases = options["database"] or outbox_databases()
+        unknown = set(aliases) - set(settings.DATABASES)
+        if unknown:
+            raise CommandError(f"Unknown databases: {', '.join(sorted(unknown))}")
+
+        executor = None
+        if workers > 1:
+            # Forked processes must not share the connections of this one.
+            connections.close_all()
+            executor = POOLS[pool](
+                max_workers=workers,
+                **({"initializer": django.setup} if pool == "process" else {}),
+            )
+
+        processed = 0
+        try:
+            while True:
+                tasks = [(alias, batch_size) for alias in aliases] * workers
+                done = sum(self.run(executor, tasks))
+                processed += done
+                if not done:
+                    if once:
+                        break
+                    time.sleep(interval)
+                elif options["verbosity"] > 1:
+                    self.stdout.write(f"Processed {done} messages")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} messages"))
+
+    def run(self, executor, tasks):
+        """Carry out a batch per (database, batch size) task"""
+
+        if executor is None:
+            return [process_batch(*task) for task in tasks]
+        return list(executor.map(process_batch, *zip(*tasks)))
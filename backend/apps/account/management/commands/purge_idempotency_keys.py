@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete the expired idempotency keys. Meant to run on a schedule."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of keys deleted per query.",
+        )
+
+    def handle(self, *args, batch_size, **options):
+        now = timezone.now()
+        expired = IdempotencyKey.objects.filter(expires_at__lte=now).order_by(
+            "expires_at"
+        )
+
+        deleted = 0
+        while True:
+            batch = list(expired.values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired keys"))
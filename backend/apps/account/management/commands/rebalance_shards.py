@@ -0,0 +1,193 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from apps.user.models import ShardAssignment
+from core.sharding import copy_user, forget_assignment, ring_shard
+
+from ...db import copy_rows
+from ...models import (
+    Account,
+    ArchiveCutoff,
+    ArchivedBalanceHistory,
+    ArchivedTransaction,
+    BalanceCheckpoint,
+    BalanceHistory,
+    DailyBalanceRollup,
+    IdempotencyKey,
+    LedgerEntry,
+    MonthlyBalanceRollup,
+    OutboxMessage,
+    Transaction,
+)
+from ...outbox import drain_user
+
+# Sharded models and the lookup of their owner, parents first.
+SHARDED_MODELS = (
+    (Account, "owner_id"),
+    (Transaction, "account__owner_id"),
+    (LedgerEntry, "account__owner_id"),
+    (BalanceCheckpoint, "account__owner_id"),
+    (BalanceHistory, "account__owner_id"),
+    (DailyBalanceRollup, "account__owner_id"),
+    (MonthlyBalanceRollup, "account__owner_id"),
+    (OutboxMessage, "account__owner_id"),
+    (ArchiveCutoff, "account__owner_id"),
+    # Empty on the shards when the archive lives in ARCHIVE_DATABASE.
+    (ArchivedTransaction, "account__owner_id"),
+    (ArchivedBalanceHistory, "account__owner_id"),
+    (IdempotencyKey, "user_id"),
+)
+
+
+def plan_moves():
+    """
+    Return the (user id, source, target, alias) of every user whose data is
+    not all on the shard the ring assigns them to, ``alias`` being where the
+    directory places them now.
+
+    Users with accounts on the primary database move from there, whatever
+    their assignment, so the accounts of users assigned to a shard before
+    the rebalancing moved them are not left behind.
+    """
+
+    owners = set(
+        Account.objects.using(DEFAULT_DB_ALIAS)
+        .values_list("owner_id", flat=True)
+        .distinct()
+    )
+    assigned = dict(
+        ShardAssignment.objects.using(DEFAULT_DB_ALIAS).values_list("user_id", "alias")
+    )
+
+    moves = []
+    for user_id in sorted(owners | set(assigned)):
+        alias = assigned.get(user_id, DEFAULT_DB_ALIAS)
+        source = DEFAULT_DB_ALIAS if user_id in owners else alias
+        target = ring_shard(user_id)
+        if source != target:
+            moves.append((user_id, source, target, alias))
+    return moves
+
+
+def set_assignment(user_id, alias, moving):
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user_id=user_id, defaults={"alias": alias, "moving": moving}
+    )
+    forget_assignment(user_id)
+
+
+def delete_user_rows(user_id, using):
+    for model, lookup in reversed(SHARDED_MODELS):
+        model.objects.using(using).filter(**{lookup: user_id})._raw_delete(using)
+
+
+def copy_user_rows(user_id, source, target, batch_size, merge=False):
+    """
+    Copy the sharded rows of a user, replacing leftovers of a failed run, or
+    adding to the rows already on the target with ``merge``.
+    """
+
+    copy_user(user_id, target)
+    copied = 0
+    with transaction.atomic(using=target):
+        if not merge:
+            delete_user_rows(user_id, target)
+        for model, lookup in SHARDED_MODELS:
+            rows = model.objects.using(source).filter(**{lookup: user_id})
+            copied += copy_rows(model, rows, target, batch_size, ignore_conflicts=merge)
+    return copied
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the account data of users to the shard the hash ring assigns "
+        "them to, while the API keeps serving them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the users that would move.",
+        )
+        parser.add_argument(
+            "--group-size",
+            type=int,
+            default=100,
+            help="Number of users moved together.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows copied per query.",
+        )
+        parser.add_argument(
+            "--settle",
+            type=float,
+            default=None,
+            help=(
+                "Seconds waited for every process to see a directory change. "
+                "Defaults to SHARD_DIRECTORY_TIMEOUT."
+            ),
+        )
+
+    def handle(self, *args, dry_run, group_size, batch_size, settle, **options):
+        if not settings.ACCOUNT_SHARDS:
+            raise CommandError("No shards are configured, set DATABASE_SHARDS")
+        if settle is None:
+            settle = settings.SHARD_DIRECTORY_TIMEOUT
+
+        moves = plan_moves()
+        if dry_run:
+            for user_id, source, target, alias in moves:
+                self.stdout.write(f"User {user_id}: {source} -> {target}")
+            self.stdout.write(f"{len(moves)} users would move")
+            return
+
+        done = 0
+        for offset in range(0, len(moves), group_size):
+            group = moves[offset : offset + group_size]
+
+            # Writes are refused while moving. Once every process saw that,
+            # the source cannot change under the copy.
+            for user_id, source, target, alias in group:
+                set_assignment(user_id, alias, moving=True)
+            time.sleep(settle)
+
+            # The derived work of the writes made before is carried out on
+            # the source, where it was written, and never copied.
+            try:
+                for user_id, source, target, alias in group:
+                    drain_user(source, user_id)
+            except Exception as exc:
+                for user_id, source, target, alias in group:
+                    set_assignment(user_id, alias, moving=False)
+                raise CommandError(
+                    f"Could not carry out the outbox of user {user_id} on "
+                    f"{source}, no user of the group moved: {exc!r}"
+                )
+
+            copied = 0
+            for user_id, source, target, alias in group:
+                # Users already served from the target keep their rows there.
+                copied += copy_user_rows(
+                    user_id, source, target, batch_size, merge=alias == target
+                )
+                set_assignment(user_id, target, moving=False)
+
+            # Processes with a stale entry still read the source until then.
+            time.sleep(settle)
+            for user_id, source, target, alias in group:
+                with transaction.atomic(using=source):
+                    delete_user_rows(user_id, source)
+
+            done += len(group)
+            self.stdout.write(
+                f"Moved {done}/{len(moves)} users ({copied} rows in this group)"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {len(moves)} users"))
@@ -0,0 +1,70 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.sharding import use_shard
+
+from ...models import Account
+from ...services import ROLLUP_MODELS, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and monthly balance rollups from the transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="start",
+            type=datetime.date.fromisoformat,
+            help="First day to rebuild, as YYYY-MM-DD. Defaults to the first transaction.",
+        )
+        parser.add_argument(
+            "--to",
+            dest="end",
+            type=datetime.date.fromisoformat,
+            help="Last day to rebuild, as YYYY-MM-DD. Defaults to the last transaction.",
+        )
+        parser.add_argument(
+            "--account",
+            dest="accounts",
+            type=int,
+            action="append",
+            help="Only rebuild this account number. May be given several times.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of accounts rebuilt per database transaction.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            choices=list(connections),
+            help="Database, or shard, holding the accounts.",
+        )
+
+    def handle(self, *args, database, **options):
+        # The accounts and rollups are read and written on that database.
+        with use_shard(database):
+            self.rebuild(database, **options)
+
+    def rebuild(self, database, start, end, accounts, batch_size, **options):
+        if start and end and start > end:
+            raise CommandError("--from must not be after --to")
+
+        numbers = Account.objects.order_by("number").values_list("number", flat=True)
+        if accounts:
+            numbers = numbers.filter(number__in=accounts)
+        numbers = list(numbers)
+
+        written = 0
+        for offset in range(0, len(numbers), batch_size):
+            batch = numbers[offset : offset + batch_size]
+            with transaction.atomic(using=database):
+                for model in ROLLUP_MODELS:
+                    written += rebuild_rollups(model, batch, start, end)
+            self.stdout.write(f"Rebuilt {offset + len(batch)}/{len(numbers)} accounts")
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup rows"))
@@ -0,0 +1,168 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.sharding import current_shard, use_shard
+
+from ...cache import invalidate
+from ...models import Account
+from ...services import balance_mismatches, fix_balance, run_with_retry
+
+
+def init_worker(database):
+    """Set Django up in a pool process, without the parent's connections"""
+    django.setup()
+    for connection in connections.all():
+        connection.close()
+    current_shard.set(database)
+
+
+def account_chunks(numbers, chunk_size):
+    """
+    Split sorted account numbers into (first, last, count) ranges of at most
+    ``chunk_size`` accounts.
+    """
+    chunks = []
+    for offset in range(0, len(numbers), chunk_size):
+        chunk = numbers[offset : offset + chunk_size]
+        chunks.append((chunk[0], chunk[-1], len(chunk)))
+    return chunks
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that every account balance equals the sum of its transactions, "
+        "and optionally fix the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help=(
+                "Set mismatched balances to the sum of their transactions and "
+                "rebuild their balance history and rollups."
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of accounts checked per query.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes running the checks. 1 checks in this process.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help=(
+                "File recording the progress. An existing checkpoint is resumed, "
+                "and it is removed once every account was checked."
+            ),
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from the first account.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            choices=list(connections),
+            help="Database, or shard, holding the accounts.",
+        )
+
+    def handle(self, *args, database, **options):
+        # The accounts are read and fixed on that database.
+        with use_shard(database):
+            self.reconcile_all(database, **options)
+
+    def reconcile_all(
+        self, database, fix, chunk_size, workers, checkpoint, restart, **options
+    ):
+        if chunk_size < 1 or workers < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+
+        progress = {"last_account": None, "checked": 0, "mismatches": 0, "fixed": 0}
+        if checkpoint and not restart and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                progress.update(json.load(file))
+            self.stdout.write(
+                f"Resuming after account {progress['last_account']} "
+                f"({progress['checked']} accounts checked)"
+            )
+
+        numbers = Account.objects.order_by("number").values_list("number", flat=True)
+        if progress["last_account"] is not None:
+            numbers = numbers.filter(number__gt=progress["last_account"])
+        numbers = list(numbers)
+        chunks = account_chunks(numbers, chunk_size)
+        total = progress["checked"] + len(numbers)
+
+        if workers == 1:
+            results = (balance_mismatches(first, last) for first, last, _ in chunks)
+            self.reconcile(chunks, results, progress, total, fix, checkpoint)
+        else:
+            for connection in connections.all():
+                connection.close()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(database,),
+            ) as executor:
+                # map hands the results back in order, so the checkpoint
+                # only ever moves past chunks that are fully reconciled.
+                results = executor.map(
+                    balance_mismatches,
+                    [first for first, last, _ in chunks],
+                    [last for first, last, _ in chunks],
+                )
+                self.reconcile(chunks, results, progress, total, fix, checkpoint)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        summary = (
+            f"Checked {progress['checked']} accounts, "
+            f"found {progress['mismatches']} mismatches"
+        )
+        if fix:
+            summary += f", fixed {progress['fixed']}"
+        style = self.style.SUCCESS if not progress["mismatches"] else self.style.WARNING
+        self.stdout.write(style(summary))
+
+    def reconcile(self, chunks, results, progress, total, fix, checkpoint):
+        for (first, last, count), mismatches in zip(chunks, results):
+            for number, owner_id, stored, expected in mismatches:
+                line = (
+                    f"Account {number}: balance {stored}, "
+                    f"transactions sum to {expected} ({expected - stored:+})"
+                )
+                if fix:
+                    if run_with_retry(fix_balance, number, stored, expected):
+                        invalidate(owner_id, [number])
+                        progress["fixed"] += 1
+                        line += ", fixed"
+                    else:
+                        line += ", changed concurrently, skipped"
+                self.stdout.write(line)
+
+            progress["mismatches"] += len(mismatches)
+            progress["checked"] += count
+            progress["last_account"] = last
+            if checkpoint:
+                self.save_checkpoint(checkpoint, progress)
+            self.stdout.write(f"Checked {progress['checked']}/{total} accounts")
+
+    def save_checkpoint(self, path, progress):
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(progress, file)
+        os.replace(temporary, path)
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.7 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balancehistory',
+            index=models.Index(fields=['created_at', 'id'], name='balancehistory_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date', 'id'], name='transaction_date_id_idx'),
+        ),
+    ]
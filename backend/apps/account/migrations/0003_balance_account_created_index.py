@@ -0,0 +1,17 @@
+# Generated by Django 4.0.7 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balancehistory',
+            index=models.Index(fields=['account', '-created_at'], name='balance_account_created_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.0.7 on 2026-10-18 17:45
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.utils.timezone
+
+
+def deduplicate_balance_history(apps, schema_editor):
+    """
+    Keep only the latest balance history entry of every account and day,
+    and fill in its day.
+    """
+    BalanceHistory = apps.get_model('account', 'BalanceHistory')
+    db_alias = schema_editor.connection.alias
+
+    latest, duplicates = {}, []
+    rows = (
+        BalanceHistory.objects.using(db_alias)
+        .order_by('account_id', 'created_at', 'id')
+        .values_list('id', 'account_id', 'created_at')
+        .iterator()
+    )
+    for pk, account_id, created_at in rows:
+        key = (account_id, timezone.localdate(created_at))
+        if key in latest:
+            duplicates.append(latest[key])
+        latest[key] = pk
+
+    for start in range(0, len(duplicates), 500):
+        BalanceHistory.objects.using(db_alias).filter(
+            pk__in=duplicates[start:start + 500]
+        ).delete()
+
+    entries = [
+        BalanceHistory(pk=pk, day=day) for (account_id, day), pk in latest.items()
+    ]
+    BalanceHistory.objects.using(db_alias).bulk_update(entries, ['day'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_balance_account_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancehistory',
+            name='day',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(deduplicate_balance_history, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='balancehistory',
+            name='day',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AddConstraint(
+            model_name='balancehistory',
+            constraint=models.UniqueConstraint(fields=('account', 'day'), name='balancehistory_account_day_unique'),
+        ),
+    ]
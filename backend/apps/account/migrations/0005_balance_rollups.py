@@ -0,0 +1,101 @@
+# Generated by Django 4.0.7 on 2026-10-18 17:46
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import Trunc
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    """
+    Roll the existing transactions up, so the rollup endpoints answer for
+    the history of an upgraded database, as rebuild_balance_rollups would.
+    """
+    Transaction = apps.get_model('account', 'Transaction')
+    transactions = Transaction.objects.using(schema_editor.connection.alias)
+    for model_name, kind in (('DailyBalanceRollup', 'day'), ('MonthlyBalanceRollup', 'month')):
+        model = apps.get_model('account', model_name)
+        periods = (
+            transactions.annotate(period=Trunc('date', kind, output_field=DateField()))
+            .values('account_id', 'period')
+            .annotate(
+                credits=Sum('amount', filter=Q(type='credit')),
+                debits=Sum('amount', filter=Q(type='debit')),
+                transaction_count=Count('id'),
+            )
+            .order_by('account_id', 'period')
+        )
+        balances = defaultdict(Decimal)
+        entries = []
+        for row in periods:
+            credits, debits = row['credits'] or 0, row['debits'] or 0
+            opening = balances[row['account_id']]
+            balances[row['account_id']] = opening + credits - debits
+            entries.append(
+                model(
+                    account_id=row['account_id'],
+                    period_start=row['period'],
+                    opening_balance=opening,
+                    closing_balance=opening + credits - debits,
+                    credits=credits,
+                    debits=debits,
+                    transaction_count=row['transaction_count'],
+                )
+            )
+        model.objects.using(schema_editor.connection.alias).bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_balance_history_daily_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyBalanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('closing_balance', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('credits', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('debits', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.account')),
+            ],
+            options={
+                'ordering': ('period_start',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBalanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('closing_balance', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('credits', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('debits', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.account')),
+            ],
+            options={
+                'ordering': ('period_start',),
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlybalancerollup',
+            constraint=models.UniqueConstraint(fields=('account', 'period_start'), name='monthlyrollup_account_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybalancerollup',
+            constraint=models.UniqueConstraint(fields=('account', 'period_start'), name='dailyrollup_account_unique'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
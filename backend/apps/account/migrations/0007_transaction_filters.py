@@ -0,0 +1,80 @@
+# Generated by Django 4.0.7 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+# External content FTS5 index over the transaction notes. The triggers keep it
+# in sync with every insert, update and delete of the table.
+CREATE_NOTE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE account_transaction_fts USING fts5(
+        note, content='account_transaction', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER account_transaction_fts_insert AFTER INSERT ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+    """
+    CREATE TRIGGER account_transaction_fts_delete AFTER DELETE ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (account_transaction_fts, rowid, note)
+        VALUES ('delete', old.id, old.note);
+    END
+    """,
+    """
+    CREATE TRIGGER account_transaction_fts_update AFTER UPDATE OF note ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (account_transaction_fts, rowid, note)
+        VALUES ('delete', old.id, old.note);
+        INSERT INTO account_transaction_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+    "INSERT INTO account_transaction_fts (account_transaction_fts) VALUES ('rebuild')",
+]
+
+DROP_NOTE_INDEX = [
+    "DROP TRIGGER IF EXISTS account_transaction_fts_update",
+    "DROP TRIGGER IF EXISTS account_transaction_fts_delete",
+    "DROP TRIGGER IF EXISTS account_transaction_fts_insert",
+    "DROP TABLE IF EXISTS account_transaction_fts",
+]
+
+
+def run_on_sqlite(statements):
+    """
+    Other databases search the notes with a LIKE, see apps/account/filters.py.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'date', 'id'], name='transaction_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'type', 'date', 'id'], name='transaction_account_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'amount'], name='transaction_account_amount_idx'),
+        ),
+        migrations.RunPython(
+            run_on_sqlite(CREATE_NOTE_INDEX), run_on_sqlite(DROP_NOTE_INDEX)
+        ),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 4.0.7 on 2026-10-18 18:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from decimal import Decimal
+
+# Entries between two checkpoints, LEDGER_CHECKPOINT_INTERVAL when written.
+CHECKPOINT_INTERVAL = 100
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    Post the existing transactions of every account to the ledger, in the
+    order of their dates and as of them, so balances as of any earlier
+    moment hold, with a correction entry, posted now, keeping the stored
+    balance where it drifted from its transactions.
+    """
+    Account = apps.get_model('account', 'Account')
+    Transaction = apps.get_model('account', 'Transaction')
+    LedgerEntry = apps.get_model('account', 'LedgerEntry')
+    BalanceCheckpoint = apps.get_model('account', 'BalanceCheckpoint')
+    db_alias = schema_editor.connection.alias
+    now = django.utils.timezone.now()
+
+    entries, checkpoints = [], []
+
+    def post(account_id, sequence, amount, transaction_id, posted_at):
+        posting = uuid.uuid4()
+        entries.append(LedgerEntry(
+            account_id=account_id, book='account', sequence=sequence,
+            posting=posting, amount=amount, transaction_id=transaction_id,
+            posted_at=posted_at,
+        ))
+        entries.append(LedgerEntry(
+            account_id=account_id, book='external', posting=posting,
+            amount=-amount, transaction_id=transaction_id, posted_at=posted_at,
+        ))
+        if len(entries) >= 1000:
+            LedgerEntry.objects.using(db_alias).bulk_create(entries)
+            entries.clear()
+
+    stored = dict(
+        Account.objects.using(db_alias).values_list('number', 'current_balance')
+    )
+    rows = (
+        Transaction.objects.using(db_alias)
+        .order_by('account_id', 'date', 'id')
+        .values_list('id', 'account_id', 'type', 'amount', 'date')
+        .iterator()
+    )
+    state = {}
+    for pk, account_id, kind, amount, date in rows:
+        sequence, balance = state.get(account_id, (0, Decimal(0)))
+        amount = amount if kind == 'credit' else -amount
+        sequence, balance = sequence + 1, balance + amount
+        # Sequences follow posting times, future dated transactions are
+        # posted now.
+        post(account_id, sequence, amount, pk, min(date, now))
+        if sequence % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append(BalanceCheckpoint(
+                account_id=account_id, sequence=sequence, balance=balance
+            ))
+        state[account_id] = sequence, balance
+
+    for account_id, current_balance in stored.items():
+        sequence, balance = state.get(account_id, (0, Decimal(0)))
+        if current_balance != balance:
+            post(account_id, sequence + 1, current_balance - balance, None, now)
+
+    LedgerEntry.objects.using(db_alias).bulk_create(entries)
+    BalanceCheckpoint.objects.using(db_alias).bulk_create(checkpoints, batch_size=500)
+
+
+def restore_balances(apps, schema_editor):
+    """Store the ledger balance of every account back on the account"""
+    Account = apps.get_model('account', 'Account')
+    LedgerEntry = apps.get_model('account', 'LedgerEntry')
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        LedgerEntry.objects.using(db_alias)
+        .filter(book='account')
+        .values('account_id')
+        .annotate(total=models.Sum('amount'))
+        .values_list('account_id', 'total')
+    )
+    Account.objects.using(db_alias).bulk_update(
+        [Account(number=number, current_balance=total) for number, total in totals],
+        ['current_balance'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_transaction_filters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('book', models.CharField(choices=[('account', 'Account'), ('external', 'External')], max_length=8)),
+                ('sequence', models.PositiveBigIntegerField(null=True)),
+                ('posting', models.UUIDField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('posted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.account')),
+                ('transaction', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='account.transaction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.account')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', 'posted_at', 'sequence'], name='ledgerentry_account_posted_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.UniqueConstraint(fields=('account', 'sequence'), name='ledgerentry_account_seq_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'sequence'), name='balancecheckpoint_account_seq_unique'),
+        ),
+        migrations.RunPython(backfill_ledger, restore_balances),
+        migrations.RemoveField(
+            model_name='account',
+            name='current_balance',
+        ),
+    ]
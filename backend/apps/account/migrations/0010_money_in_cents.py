@@ -0,0 +1,111 @@
+# Generated by Django 4.0.7 on 2026-10-18 19:40
+
+import apps.account.money
+from django.db import migrations, models
+
+# Money columns converted to integers of cents, per model.
+MONEY_FIELDS = {
+    'transaction': ['amount'],
+    'ledgerentry': ['amount'],
+    'balancecheckpoint': ['balance'],
+    'balancehistory': ['balance'],
+    'dailybalancerollup': ['opening_balance', 'closing_balance', 'credits', 'debits'],
+    'monthlybalancerollup': ['opening_balance', 'closing_balance', 'credits', 'debits'],
+}
+
+# SQLite drops the triggers of a table when it is remade, as the field
+# changes below do, so the ones keeping the note index of 0007 are recreated.
+CREATE_NOTE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS account_transaction_fts_insert AFTER INSERT ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS account_transaction_fts_delete AFTER DELETE ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (account_transaction_fts, rowid, note)
+        VALUES ('delete', old.id, old.note);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS account_transaction_fts_update AFTER UPDATE OF note ON account_transaction
+    BEGIN
+        INSERT INTO account_transaction_fts (account_transaction_fts, rowid, note)
+        VALUES ('delete', old.id, old.note);
+        INSERT INTO account_transaction_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+]
+
+
+def create_note_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_NOTE_TRIGGERS:
+        schema_editor.execute(statement)
+
+
+def to_cents(model_name, name, default):
+    """
+    Replace a decimal field by an integer of cents: add the new column, copy
+    the amounts over, drop the old column and take its name.
+    """
+    table = f'account_{model_name}'
+    cents = f'{name}_cents'
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name=cents,
+            field=apps.account.money.MoneyField(default=0),
+            preserve_default=bool(default),
+        ),
+        # Nullable first, so the column can be added back and filled, when reversing.
+        migrations.AlterField(
+            model_name=model_name,
+            name=name,
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True, **default),
+        ),
+        migrations.RunSQL(
+            f'UPDATE {table} SET {cents} = CAST(ROUND({name} * 100) AS BIGINT)',
+            f'UPDATE {table} SET {name} = {cents} / 100.0',
+        ),
+        migrations.RemoveField(
+            model_name=model_name,
+            name=name,
+        ),
+        migrations.RenameField(
+            model_name=model_name,
+            old_name=cents,
+            new_name=name,
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0009_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_note_triggers),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_account_amount_idx',
+        ),
+        *[
+            operation
+            for model_name, names in MONEY_FIELDS.items()
+            for name in names
+            for operation in to_cents(
+                model_name, name, {'default': 0} if 'rollup' in model_name else {}
+            )
+        ],
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'amount'], name='transaction_account_amount_idx'),
+        ),
+        migrations.RunPython(create_note_triggers, migrations.RunPython.noop),
+    ]
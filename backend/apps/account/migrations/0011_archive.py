@@ -0,0 +1,57 @@
+# Generated by Django 4.0.7 on 2026-10-18 19:12
+
+import apps.account.money
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0010_money_in_cents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('type', models.CharField(choices=[('credit', 'Credit'), ('debit', 'Debit')], max_length=6)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('amount', apps.account.money.MoneyField()),
+                ('date', models.DateTimeField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('account', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='account.account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBalanceHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('balance', apps.account.money.MoneyField()),
+                ('day', models.DateField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('account', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='account.account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchiveCutoff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField()),
+                ('balance', apps.account.money.MoneyField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive_cutoff', to='account.account')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['account', 'date', 'id'], name='archivedtx_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbalancehistory',
+            index=models.Index(fields=['account', 'created_at', 'id'], name='archivedbh_account_created_idx'),
+        ),
+    ]
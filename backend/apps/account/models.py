@@ -1,8 +1,17 @@
+import datetime
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.functional import cached_property
+
+from core.metrics import timed_receiver
+
+from .money import MoneyField
 
 
 class Account(models.Model):
@@ -11,13 +20,26 @@ class Account(models.Model):
     """
 
     number = models.AutoField(primary_key=True)
-    current_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     owner = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @cached_property
+    def current_balance(self):
+        """
+        Balance of the account from its ledger. Querysets annotated with
+        ``ledger.balance_expression()`` as current_balance set it upfront.
+        """
+        from .ledger import balances
+
+        return balances([self.pk])[self.pk]
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop("current_balance", None)
+
 
 class Transaction(models.Model):
     """
@@ -31,7 +53,7 @@ class Transaction(models.Model):
     id = models.AutoField(primary_key=True)
     type = models.CharField(max_length=6, choices=TransactionType.choices)
     note = models.CharField(max_length=255, blank=True)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount = MoneyField()
     date = models.DateTimeField(default=timezone.now)
 
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -39,6 +61,88 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=("date", "id"), name="transaction_date_id_idx"),
+            # Back the filters of the transaction list, see filters.py.
+            models.Index(
+                fields=("account", "date", "id"), name="transaction_account_date_idx"
+            ),
+            models.Index(
+                fields=("account", "type", "date", "id"),
+                name="transaction_account_type_idx",
+            ),
+            models.Index(
+                fields=("account", "amount"), name="transaction_account_amount_idx"
+            ),
+        ]
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only, double-entry ledger line.
+
+    Every posting writes a leg on the account book, numbered by a sequence
+    that increases by one per account, and the opposite leg on the external
+    book the money came from or went to, so the legs of a posting sum to
+    zero. Entries are never updated; corrections are new postings.
+    """
+
+    class Book(models.TextChoices):
+        ACCOUNT = "account"
+        EXTERNAL = "external"
+
+    id = models.BigAutoField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    book = models.CharField(max_length=8, choices=Book.choices)
+    # Only set on the account book.
+    sequence = models.PositiveBigIntegerField(null=True)
+    # Shared by the legs of a posting.
+    posting = models.UUIDField()
+    # Signed, positive when the book is credited.
+    amount = MoneyField()
+    # None for corrections. Not a database constraint, so the entries keep
+    # the id of their transaction once it is archived.
+    transaction = models.ForeignKey(
+        Transaction, null=True, on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    posted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("account", "posted_at", "sequence"),
+                name="ledgerentry_account_posted_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "sequence"), name="ledgerentry_account_seq_unique"
+            ),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of an account after the ledger entry numbered ``sequence``.
+
+    A checkpoint is written every ``LEDGER_CHECKPOINT_INTERVAL`` entries, so
+    any balance is a checkpoint plus fewer entries than the interval.
+    """
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    sequence = models.PositiveBigIntegerField()
+    balance = MoneyField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "sequence"),
+                name="balancecheckpoint_account_seq_unique",
+            ),
+        ]
+
 
 class BalanceHistory(models.Model):
     """
@@ -46,53 +150,282 @@ class BalanceHistory(models.Model):
     """
 
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
-    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    balance = MoneyField()
+    day = models.DateField(default=timezone.localdate)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(
+                fields=("created_at", "id"), name="balancehistory_created_id_idx"
+            ),
+            models.Index(
+                fields=("account", "-created_at"), name="balance_account_created_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "day"), name="balancehistory_account_day_unique"
+            ),
+        ]
+
+
+class BalanceRollup(models.Model):
+    """
+    Balance movements of an account over a period, kept current as
+    transactions are posted.
+    """
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    period_start = models.DateField()
+    opening_balance = MoneyField(default=0)
+    closing_balance = MoneyField(default=0)
+    credits = MoneyField(default=0)
+    debits = MoneyField(default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ("period_start",)
+
+    @classmethod
+    def period_for(cls, day):
+        """Return the first day of the period that contains ``day``"""
+        raise NotImplementedError
+
+    @classmethod
+    def next_period(cls, period_start):
+        """Return the first day of the period following ``period_start``"""
+        raise NotImplementedError
+
+
+class DailyBalanceRollup(BalanceRollup):
+    """
+    Daily balance rollup model.
+    """
+
+    kind = "day"
+
+    class Meta(BalanceRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "period_start"), name="dailyrollup_account_unique"
+            ),
+        ]
+
+    @classmethod
+    def period_for(cls, day):
+        return day
+
+    @classmethod
+    def next_period(cls, period_start):
+        return period_start + datetime.timedelta(days=1)
+
+
+class MonthlyBalanceRollup(BalanceRollup):
+    """
+    Monthly balance rollup model.
+    """
+
+    kind = "month"
+
+    class Meta(BalanceRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "period_start"),
+                name="monthlyrollup_account_unique",
+            ),
+        ]
+
+    @classmethod
+    def period_for(cls, day):
+        return day.replace(day=1)
+
+    @classmethod
+    def next_period(cls, period_start):
+        return (period_start + datetime.timedelta(days=31)).replace(day=1)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response stored for an ``Idempotency-Key`` header, replayed to retries of
+    the same request until it expires.
+    """
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("expires_at",), name="idempotencykey_expires_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "key"), name="idempotencykey_user_key_unique"
+            ),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """
+    Derived work of a change to an account, written in the same transaction
+    as the change and carried out once it committed by the process_outbox
+    command, unless ``OUTBOX_EAGER`` carries it out right away.
+    """
+
+    class Topic(models.TextChoices):
+        BALANCE_HISTORY = "balance_history"
+        ROLLUP = "rollup"
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    topic = models.CharField(max_length=32, choices=Topic.choices)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Failed messages are retried with a backoff, up to OUTBOX_MAX_ATTEMPTS.
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("available_at", "id"), name="outbox_available_idx"),
+        ]
+
+
+class ArchiveCutoff(models.Model):
+    """
+    Archive state of an account: its transactions dated, and balance history
+    entries created, before ``cutoff`` were moved to the archive tables, and
+    ``balance`` is the sum of the archived transactions, so the balance of
+    the account is ``balance`` plus its transactions left in the hot table.
+    """
+
+    account = models.OneToOneField(
+        Account, on_delete=models.CASCADE, related_name="archive_cutoff"
+    )
+    cutoff = models.DateTimeField()
+    balance = MoneyField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ArchivedTransaction(models.Model):
+    """
+    Transaction moved out of the transaction table by the
+    archive_transactions command, keeping its id.
+
+    The archive may live in its own database (``ARCHIVE_DATABASE``), so the
+    account is not a database constraint and archived rows are deleted with
+    their account by ``delete_archived_rows``.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    type = models.CharField(max_length=6, choices=Transaction.TransactionType.choices)
+    note = models.CharField(max_length=255, blank=True)
+    amount = MoneyField()
+    date = models.DateTimeField()
+
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("account", "date", "id"), name="archivedtx_account_date_idx"
+            ),
+        ]
+
+
+class ArchivedBalanceHistory(models.Model):
+    """
+    Balance history entry moved out of the balance history table by the
+    archive_transactions command, keeping its id.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    balance = MoneyField()
+    day = models.DateField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("account", "created_at", "id"),
+                name="archivedbh_account_created_idx",
+            ),
+        ]
 
 
 @receiver(post_save, sender=Account)
+@timed_receiver
 def create_balance_history(sender, instance, created, **kwargs):
     """
-    Create balance history when account is created or if it is
-    the first update of the day. If it is not the first
-    transaction of the day, update balance history with
-    the new balance.
+    Store the account balance as today's balance history entry,
+    creating it on the first save of the day and updating it on
+    later ones.
     """
+    from .cache import invalidate
+    from .outbox import enqueue
+    from .services import balance_history_message
 
-    if created:
-        BalanceHistory.objects.create(
-            account=instance, balance=instance.current_balance
-        )
-    else:
-        balance_history = (
-            BalanceHistory.objects.filter(account=instance)
-            .order_by("-created_at")
-            .first()
-        )
-        if balance_history.created_at.date() != instance.updated_at.date():
-            BalanceHistory.objects.create(
-                account=instance, balance=instance.current_balance
-            )
-        else:
-            balance_history.balance = instance.current_balance
-            balance_history.save()
+    enqueue([balance_history_message(instance, timezone.now())])
+    invalidate(instance.owner_id, [instance.pk])
 
 
 @receiver(post_save, sender=Transaction)
+@timed_receiver
 def update_account_balance(sender, instance, created, **kwargs):
     """
     Update account balance after transaction
     """
+    from .services import post_transaction
+
     if created:
-        # Update account balance
-        if instance.type == Transaction.TransactionType.CREDIT:
-            instance.account.current_balance += instance.amount
-        elif instance.type == Transaction.TransactionType.DEBIT:
-            instance.account.current_balance -= instance.amount
-        else:
-            raise ValueError("Invalid transaction type")
-        instance.account.save()
+        post_transaction(instance)
+
+
+@receiver(post_migrate)
+def reserve_shard_id_range(sender, using, **kwargs):
+    """
+    Give every shard its own range of ids, so rows can move between shards
+    """
+    from core.sharding import reserve_id_range
+
+    if sender.label == "account" and using in settings.ACCOUNT_SHARDS:
+        reserve_id_range(using)
+
+
+@receiver(post_delete, sender=Account)
+def delete_archived_rows(sender, instance, **kwargs):
+    """
+    Delete the archived rows of a deleted account, from the archive database
+    when there is one
+    """
+    for model in (ArchivedTransaction, ArchivedBalanceHistory):
+        model.objects.filter(account_id=instance.pk)._raw_delete(
+            router.db_for_write(model)
+        )
+
+
+@receiver(post_delete, sender=Account)
+def invalidate_deleted_account(sender, instance, **kwargs):
+    """
+    Drop the cached responses listing a deleted account
+    """
+    from .cache import invalidate
+
+    invalidate(instance.owner_id, [instance.pk])
@@ -0,0 +1,96 @@
+import itertools
+from decimal import Decimal
+
+from django.db import models
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Digits of the amounts, two of them decimal. Any such amount fits in the
+# 64-bit integer of cents the database stores.
+MONEY_MAX_DIGITS = 18
+MONEY_DECIMAL_PLACES = 2
+
+
+def to_cents(value):
+    """Return a ``Decimal`` amount as an integer number of cents"""
+
+    cents = value.scaleb(MONEY_DECIMAL_PLACES)
+    if cents != cents.to_integral_value():
+        raise ValueError(f"{value} is not a whole number of cents")
+    return int(cents)
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-MONEY_DECIMAL_PLACES)
+
+
+class MoneyField(models.DecimalField):
+    """
+    Amount of money stored as a 64-bit integer of cents.
+
+    Values are ``Decimal`` with two decimal places in Python, as with a
+    ``DecimalField``, so forms and serializers are unchanged, while the
+    database stores, sums and compares exact integers.
+
+    Arithmetic mixing money columns resolves to a plain ``DecimalField``,
+    which would read the result as a number of units: give such expressions
+    an explicit ``output_field=MoneyField()``, and wrap Python amounts in
+    ``money()``.
+    """
+
+    description = "Amount of money, stored in cents"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("max_digits", MONEY_MAX_DIGITS)
+        kwargs.setdefault("decimal_places", MONEY_DECIMAL_PLACES)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get("max_digits") == MONEY_MAX_DIGITS:
+            del kwargs["max_digits"]
+        if kwargs.get("decimal_places") == MONEY_DECIMAL_PLACES:
+            del kwargs["decimal_places"]
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "BigIntegerField"
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_cents(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        cents = value.scaleb(MONEY_DECIMAL_PLACES)
+        # Lookups may compare with fractions of a cent.
+        if cents != cents.to_integral_value():
+            return cents
+        return int(cents)
+
+    def get_db_prep_save(self, value, connection):
+        value = self.get_prep_value(value)
+        return None if value is None else to_cents(value)
+
+
+def money(value):
+    """Expression of a Python amount, for arithmetic with money columns"""
+    return models.Value(Decimal(value), output_field=MoneyField())
+
+
+def running_totals(cents):
+    """
+    Return the running totals of a sequence of integer amounts of cents, as
+    integers. Uses NumPy when it is installed.
+    """
+
+    if numpy is None:
+        return list(itertools.accumulate(cents))
+    return numpy.cumsum(numpy.fromiter(cents, dtype=numpy.int64)).tolist()
@@ -0,0 +1,188 @@
+import contextlib
+import datetime
+import logging
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from core.sharding import use_shard
+
+from .cache import invalidate_accounts
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a failed message is retried, doubled after every attempt.
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 15 * 60
+
+
+def get_handlers():
+    from .services import post_rollup_messages, record_balance_histories
+
+    return {
+        OutboxMessage.Topic.BALANCE_HISTORY: record_balance_histories,
+        OutboxMessage.Topic.ROLLUP: post_rollup_messages,
+    }
+
+
+def handle_messages(messages):
+    """Carry out messages, handing every topic all of its messages at once"""
+
+    handlers = get_handlers()
+    messages = sorted(messages, key=lambda message: message.topic)
+    for topic, group in groupby(messages, key=lambda message: message.topic):
+        handlers[topic](list(group))
+
+
+def carry_out(messages):
+    """
+    Carry out messages taken from the outbox, and drop the cached responses
+    of their accounts once the work commits, as postings do for their own.
+    """
+
+    handle_messages(messages)
+    invalidate_accounts({message.account_id for message in messages})
+
+
+def enqueue(messages):
+    """
+    Write outbox messages in the current transaction, to be carried out by
+    the process_outbox command once it commits, or carry them out right away
+    when ``OUTBOX_EAGER`` is set.
+    """
+
+    if settings.OUTBOX_EAGER:
+        handle_messages(messages)
+    else:
+        OutboxMessage.objects.bulk_create(messages)
+
+
+def outbox_databases():
+    return [DEFAULT_DB_ALIAS, *settings.ACCOUNT_SHARDS]
+
+
+@contextlib.contextmanager
+def routed(using):
+    """Route the account models to database ``using`` inside the block"""
+
+    if using in settings.ACCOUNT_SHARDS:
+        with use_shard(using):
+            yield
+    else:
+        yield
+
+
+def due_messages(using, batch_size):
+    """
+    Return the oldest messages of database ``using`` due to be carried out.
+    Where the database supports it, messages locked by another worker are
+    skipped.
+    """
+
+    return list(
+        OutboxMessage.objects.using(using)
+        .select_for_update(skip_locked=True)
+        .filter(
+            available_at__lte=timezone.now(),
+            attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+        )
+        .order_by("available_at", "id")[:batch_size]
+    )
+
+
+def process_batch(using, batch_size):
+    """
+    Carry out a batch of due messages of database ``using`` and return how
+    many were taken.
+
+    The work of a batch is committed together with the deletion of its
+    messages, so a message is carried out again if the worker dies before
+    committing, and never once it committed. When a batch fails, its
+    messages are carried out one by one to set the failing ones aside.
+    """
+
+    from .services import run_with_retry
+
+    with routed(using):
+        try:
+            return run_with_retry(carry_out_batch, using, batch_size)
+        except Exception:
+            logger.exception("Outbox batch of %s failed, retrying one by one", using)
+
+        with transaction.atomic(using=using):
+            pks = [message.pk for message in due_messages(using, batch_size)]
+        for pk in pks:
+            process_message(using, pk)
+        return len(pks)
+
+
+def carry_out_batch(using, batch_size):
+    messages = due_messages(using, batch_size)
+    carry_out(messages)
+    OutboxMessage.objects.using(using).filter(
+        pk__in=[message.pk for message in messages]
+    ).delete()
+    return len(messages)
+
+
+def drain_user(using, user_id):
+    """
+    Carry out every pending message of the accounts of a user on database
+    ``using``, those set aside after failing included, and return how many
+    there were.
+
+    The rebalancing drains users before copying them to another shard, so
+    no message is carried out both by the worker of the source and by the
+    one of the target. Drained messages are locked like the worker's, so
+    the two never carry out the same message.
+    """
+
+    with routed(using), transaction.atomic(using=using):
+        messages = list(
+            OutboxMessage.objects.using(using)
+            .select_for_update(of=("self",))
+            .filter(account__owner_id=user_id)
+            .order_by("available_at", "id")
+        )
+        carry_out(messages)
+        OutboxMessage.objects.using(using).filter(
+            pk__in=[message.pk for message in messages]
+        ).delete()
+    return len(messages)
+
+
+def process_message(using, pk):
+    """
+    Carry out the message ``pk`` of database ``using`` on its own, locked
+    while it runs, and set it aside with a backoff when it fails. Messages
+    another worker took in the meantime are skipped.
+    """
+
+    with transaction.atomic(using=using):
+        message = (
+            OutboxMessage.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(pk=pk)
+            .first()
+        )
+        if message is None:
+            return
+        try:
+            with transaction.atomic(using=using):
+                carry_out([message])
+                message.delete(using=using)
+        except Exception as exc:
+            logger.exception("Outbox message %s of %s failed", message.pk, using)
+            message.attempts += 1
+            message.last_error = repr(exc)
+            message.available_at = timezone.now() + datetime.timedelta(
+                seconds=min(
+                    RETRY_BACKOFF * 2 ** (message.attempts - 1), RETRY_BACKOFF_MAX
+                )
+            )
+            message.save(
+                using=using, update_fields=("attempts", "last_error", "available_at")
+            )
@@ -0,0 +1,149 @@
+import base64
+import binascii
+import heapq
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite key.
+
+    Pages are selected with a ``WHERE (a, b) < (last_a, last_b)`` filter on
+    the view's ``pagination_ordering`` instead of an ``OFFSET``, so with an
+    index covering the ordering every page costs the same to fetch, however
+    deep it is. The ordering must end in a unique field and all of its fields
+    must sort in the same direction.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = ("-id",)
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.page_queryset(queryset, request, view)))
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Return the rows of the requested page, and the first row of the next
+        one if any, for ``get_page``.
+        """
+
+        self.request = request
+        self.ordering = getattr(view, "pagination_ordering", self.ordering)
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip("-")) for name in self.ordering
+        ]
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[: self.page_size + 1]
+
+    def get_page(self, rows):
+        """Return the page out of the fetched ``page_queryset`` rows"""
+
+        self.next_position = (
+            self.position(rows[self.page_size - 1])
+            if len(rows) > self.page_size
+            else None
+        )
+        return rows[: self.page_size]
+
+    def merge(self, *pages):
+        """
+        Merge the ``page_queryset`` rows of querysets with the same ordering,
+        e.g. hot and archived rows, into the rows of a single queryset for
+        ``get_page``. A row fetched from two of them is kept once.
+        """
+
+        rows, last = [], None
+        descending = self.ordering[0].startswith("-")
+        for row in heapq.merge(*pages, key=self.position, reverse=descending):
+            position = self.position(row)
+            if position != last:
+                rows.append(row)
+                last = position
+            if len(rows) > self.page_size:
+                break
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def after(self, position):
+        """
+        Build the filter selecting the rows that sort after ``position``.
+        """
+
+        lookup = "lt" if self.ordering[0].startswith("-") else "gt"
+        condition = Q()
+        for index, field in enumerate(self.fields):
+            equal = zip(self.fields[:index], position[:index])
+            condition |= Q(
+                **{previous.name: value for previous, value in equal},
+                **{f"{field.name}__{lookup}": position[index]},
+            )
+        return condition
+
+    def position(self, row):
+        if isinstance(row, dict):
+            return [row[field.name] for field in self.fields]
+        return [getattr(row, field.attname) for field in self.fields]
+
+    def encode_cursor(self, position):
+        # str() keeps the full microsecond precision of datetimes, which the
+        # keyset comparison needs to be exact.
+        data = json.dumps(position, default=str).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, list) or len(position) != len(self.fields):
+                raise ValueError
+            return [
+                field.to_python(value) for field, value in zip(self.fields, position)
+            ]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,171 @@
+import decimal
+import functools
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import ISO_8601, fields, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from core.metrics import track
+
+
+def decimal_representation(field):
+    coerce_to_string = getattr(
+        field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING
+    )
+    if not coerce_to_string or field.localize or field.decimal_places is None:
+        return field.to_representation
+    quantum = decimal.Decimal(1).scaleb(-field.decimal_places)
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def represent(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return "{:f}".format(
+            value.quantize(quantum, rounding=field.rounding, context=context)
+        )
+
+    return represent
+
+
+def datetime_representation(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = getattr(field, "timezone", field.default_timezone())
+    if field_timezone is None:
+        return field.to_representation
+
+    def represent(value):
+        if not value or isinstance(value, str) or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return represent
+
+
+def choice_representation(field):
+    choices = field.choice_strings_to_values
+
+    def represent(value):
+        if value == "":
+            return value
+        return choices.get(str(value), value)
+
+    return represent
+
+
+def uuid_representation(field):
+    if field.uuid_format != "hex_verbose":
+        return field.to_representation
+    return str
+
+
+def field_representation(field):
+    """
+    Return a function representing a value of ``field`` as the field would,
+    without going through the field for the common field types.
+    """
+
+    # Subclasses may change the representation, so only exact types match.
+    if type(field) in (fields.CharField, fields.EmailField):
+        return str
+    if type(field) is fields.IntegerField:
+        return int
+    if type(field) is fields.DecimalField:
+        return decimal_representation(field)
+    if type(field) is fields.DateTimeField:
+        return datetime_representation(field)
+    if type(field) is fields.ChoiceField:
+        return choice_representation(field)
+    if type(field) is fields.UUIDField:
+        return uuid_representation(field)
+    return field.to_representation
+
+
+class RowRepresentation:
+    """
+    Serializer compiled to represent the rows of a ``values()`` queryset.
+
+    Every field of the serializer reads a single column, named by its
+    ``source``, and its representation is resolved once instead of for every
+    row. ``SerializerMethodField`` columns and functions are taken from the
+    ``row_methods`` of the serializer's ``Meta``, which maps the field name
+    to its (column, function). The result is identical to the serializer's.
+    """
+
+    def __init__(self, serializer_class):
+        row_methods = getattr(serializer_class.Meta, "row_methods", {})
+        self.columns = []
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                if name not in row_methods:
+                    raise ImproperlyConfigured(
+                        f"{serializer_class.__name__}.Meta.row_methods has no "
+                        f"entry for the {name} field"
+                    )
+                column, represent = row_methods[name]
+            elif "." in field.source or field.source == "*":
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{name} does not read a column"
+                )
+            else:
+                column, represent = field.source, field_representation(field)
+            if column not in self.columns:
+                self.columns.append(column)
+            self.fields.append((name, column, represent))
+
+    def represent(self, row):
+        return {
+            name: None if row[column] is None else represent(row[column])
+            for name, column, represent in self.fields
+        }
+
+    def represent_many(self, rows):
+        with track("serialization"):
+            return [self.represent(row) for row in rows]
+
+
+@functools.lru_cache(maxsize=None)
+def get_row_representation(serializer_class):
+    return RowRepresentation(serializer_class)
+
+
+class RowListMixin:
+    """
+    List the rows of a viewset from a ``values()`` queryset through a
+    compiled representation of its serializer, which skips building a model
+    instance and a serializer per row.
+    """
+
+    def get_row_representation(self):
+        return get_row_representation(self.get_serializer_class())
+
+    def get_rows(self, queryset):
+        """
+        Return the ``values()`` rows of ``queryset`` with the columns of the
+        row representation and of the pagination ordering.
+        """
+
+        columns = list(self.get_row_representation().columns)
+        for name in getattr(self, "pagination_ordering", ()):
+            if name.lstrip("-") not in columns:
+                columns.append(name.lstrip("-"))
+        return queryset.values(*columns)
+
+    def list(self, request, *args, **kwargs):
+        representation = self.get_row_representation()
+        rows = self.get_rows(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(representation.represent_many(page))
+        return Response(representation.represent_many(rows))
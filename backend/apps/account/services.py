@@ -0,0 +1,650 @@
+import datetime
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import (
+    IntegrityError,
+    OperationalError,
+    connections,
+    router,
+    transaction,
+)
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    Count,
+    DateField,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    When,
+)
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .cache import invalidate, invalidate_accounts
+from .db import upsert
+from .events import publish_postings
+from .ledger import CENT, append_entries, balances
+from .models import (
+    Account,
+    ArchiveCutoff,
+    ArchivedTransaction,
+    BalanceHistory,
+    DailyBalanceRollup,
+    MonthlyBalanceRollup,
+    OutboxMessage,
+    Transaction,
+)
+from .money import MoneyField, from_cents, money, running_totals
+from .outbox import enqueue
+
+# Attempts and base delay (in seconds) used when the database reports that it
+# is locked by a concurrent writer. The delay doubles after every attempt and
+# is jittered so that competing writers do not retry in lockstep.
+LOCK_RETRIES = 10
+LOCK_BACKOFF = 0.005
+
+ROLLUP_MODELS = (DailyBalanceRollup, MonthlyBalanceRollup)
+
+
+def transaction_delta(transaction_type, amount):
+    """
+    Return the signed amount a transaction adds to its account balance.
+    """
+
+    if transaction_type == Transaction.TransactionType.CREDIT:
+        return amount
+    if transaction_type == Transaction.TransactionType.DEBIT:
+        return -amount
+    raise ValueError("Invalid transaction type")
+
+
+def signed_amount(output_field=None):
+    """
+    Expression of the signed amount a transaction adds to its account
+    balance, as money by default.
+    """
+
+    return Case(
+        When(type=Transaction.TransactionType.DEBIT, then=F("amount") * -1),
+        default=F("amount"),
+        output_field=output_field or MoneyField(),
+    )
+
+
+def is_lock_error(error):
+    return "locked" in str(error)
+
+
+def is_sequence_conflict(error):
+    """
+    Tell whether ``error`` is another writer taking the ledger sequence a
+    posting read as free, as the SQLite and PostgreSQL backends word it.
+    """
+
+    return any(
+        name in str(error)
+        for name in ("ledgerentry_account_seq_unique", "account_ledgerentry.sequence")
+    )
+
+
+def run_with_retry(func, *args, **kwargs):
+    """
+    Run ``func`` inside an atomic block of the database the accounts are
+    written to, retrying with exponential backoff when the database is locked
+    by another writer, or when another writer appended to the ledger of an
+    account between the read of its last sequence and the insert.
+
+    When called from inside an outer atomic block the retry cannot roll back
+    the outer transaction, so ``func`` runs once and errors propagate.
+    """
+
+    using = router.db_for_write(Account)
+    if connections[using].in_atomic_block:
+        return func(*args, **kwargs)
+
+    for attempt in range(LOCK_RETRIES):
+        try:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+        except OperationalError as error:
+            if not is_lock_error(error) or attempt == LOCK_RETRIES - 1:
+                raise
+        except IntegrityError as error:
+            if not is_sequence_conflict(error) or attempt == LOCK_RETRIES - 1:
+                raise
+        time.sleep(LOCK_BACKOFF * 2**attempt * random.uniform(0.5, 1.5))
+
+
+def post_transaction(instance):
+    """
+    Apply a newly created transaction to its account balance.
+
+    The transaction is appended to the ledger, which only inserts rows, so
+    concurrent postings never contend on the account row. The balance
+    history and rollups are updated through the outbox.
+    """
+
+    account = instance.account
+    account.current_balance = append_entries(
+        [
+            (
+                instance.account_id,
+                transaction_delta(instance.type, transaction_amount(instance.amount)),
+                instance.pk,
+            )
+        ]
+    )[account.pk]
+    enqueue(
+        [
+            balance_history_message(account, timezone.now()),
+            *rollup_messages(rollup_totals([instance])),
+        ]
+    )
+    invalidate(account.owner_id, [account.pk])
+    publish_postings(
+        account.owner_id, [instance], {account.pk: account.current_balance}
+    )
+    return account
+
+
+def post_transactions(transactions):
+    """
+    Insert many transactions at once and append them to the ledger together.
+
+    ``bulk_create`` does not send ``post_save``, so the balance history is
+    updated here once per touched account instead of once per row.
+    """
+
+    transactions = Transaction.objects.bulk_create(transactions)
+    new_balances = append_entries(
+        (
+            instance.account_id,
+            transaction_delta(instance.type, instance.amount),
+            instance.pk,
+        )
+        for instance in transactions
+    )
+
+    now = timezone.now()
+    messages = rollup_messages(rollup_totals(transactions))
+    owners = defaultdict(list)
+    account_owners = {}
+    for account in Account.objects.filter(pk__in=new_balances).only("number", "owner"):
+        account.current_balance = new_balances[account.pk]
+        messages.append(balance_history_message(account, now))
+        owners[account.owner_id].append(account.pk)
+        account_owners[account.pk] = account.owner_id
+    enqueue(messages)
+    for owner_id, account_ids in owners.items():
+        invalidate(owner_id, account_ids)
+        publish_postings(
+            owner_id,
+            [
+                instance
+                for instance in transactions
+                if account_owners[instance.account_id] == owner_id
+            ],
+            {pk: new_balances[pk] for pk in account_ids},
+        )
+    return transactions
+
+
+def record_balance_history(account, moment=None):
+    """
+    Store the account balance as the balance history entry of the day of
+    ``moment``, now by default.
+
+    There is one entry per account and day, so the first change of the day
+    inserts it and later changes overwrite it, in a single upsert statement.
+    An entry is only overwritten from a later moment, so balances recorded
+    out of order do not roll it back.
+    """
+
+    now = moment or timezone.now()
+    table = BalanceHistory._meta.db_table
+    later = f"excluded.updated_at >= {table}.updated_at"
+    upsert(
+        BalanceHistory,
+        {
+            "account": account.pk,
+            "day": timezone.localdate(now),
+            "balance": account.current_balance,
+            "created_at": now,
+            "updated_at": now,
+        },
+        conflict_fields=("account", "day"),
+        updates={
+            "balance": f"CASE WHEN {later} THEN excluded.balance"
+            f" ELSE {table}.balance END",
+            "updated_at": f"CASE WHEN {later} THEN excluded.updated_at"
+            f" ELSE {table}.updated_at END",
+        },
+        instance=account,
+    )
+
+
+def balance_history_message(account, moment):
+    """
+    Return the outbox message recording the current balance of ``account``
+    as of ``moment`` in its balance history.
+    """
+
+    return OutboxMessage(
+        account_id=account.pk,
+        topic=OutboxMessage.Topic.BALANCE_HISTORY,
+        payload={"balance": str(account.current_balance)},
+        created_at=moment,
+    )
+
+
+def record_balance_histories(messages):
+    """
+    Carry out balance history messages. Only the latest balance of every
+    account and day is stored, the earlier ones are superseded by it.
+    """
+
+    latest = {}
+    for message in messages:
+        key = (message.account_id, timezone.localdate(message.created_at))
+        if key not in latest or message.created_at >= latest[key].created_at:
+            latest[key] = message
+    for message in latest.values():
+        account = Account(pk=message.account_id)
+        account.current_balance = Decimal(message.payload["balance"])
+        record_balance_history(account, message.created_at)
+
+
+def day_start(day):
+    """
+    Return the first instant of ``day`` in the current time zone.
+    """
+
+    return timezone.make_aware(
+        datetime.datetime.combine(day, datetime.time.min),
+        timezone.get_current_timezone(),
+    )
+
+
+def bucket_boundaries(start, end, granularity):
+    """
+    Return the last day of every ``day``, ``week`` or ``month`` bucket that
+    overlaps ``start``..``end``, clipped to ``end``.
+    """
+
+    boundaries, day = [], start
+    while day <= end:
+        if granularity == "week":
+            day += datetime.timedelta(days=6 - day.weekday())
+        elif granularity == "month":
+            next_month = (day.replace(day=28) + datetime.timedelta(days=4)).replace(
+                day=1
+            )
+            day = next_month - datetime.timedelta(days=1)
+        boundaries.append(min(day, end))
+        day += datetime.timedelta(days=1)
+    return boundaries
+
+
+def balance_series(account_id, start, end, granularity):
+    """
+    Return the balance of an account as of the end of every bucket boundary
+    between ``start`` and ``end``, as unsaved ``BalanceHistory`` rows.
+
+    The daily rollups inside the range and the last one before it are read in
+    one query and walked once.
+    """
+
+    opening = (
+        DailyBalanceRollup.objects.filter(account_id=account_id, period_start__lt=start)
+        .order_by("-period_start")
+        .values("pk")[:1]
+    )
+    rows = iter(
+        DailyBalanceRollup.objects.filter(account_id=account_id)
+        .filter(Q(period_start__range=(start, end)) | Q(pk__in=Subquery(opening)))
+        .order_by("period_start")
+        .values_list("period_start", "closing_balance")
+    )
+
+    series, balance, pending = [], Decimal(0), next(rows, None)
+    for boundary in bucket_boundaries(start, end, granularity):
+        while pending is not None and pending[0] <= boundary:
+            balance, pending = pending[1], next(rows, None)
+        series.append(
+            BalanceHistory(
+                account_id=account_id, balance=balance, created_at=day_start(boundary)
+            )
+        )
+    return series
+
+
+def transaction_day(value):
+    """
+    Return the calendar day, in the current time zone, of a transaction date.
+    """
+
+    value = Transaction._meta.get_field("date").to_python(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localdate(value)
+
+
+def transaction_amount(value):
+    """
+    Return a transaction amount as a ``Decimal``, whatever it was assigned as.
+    """
+
+    return Transaction._meta.get_field("amount").to_python(value)
+
+
+def rollup_totals(transactions):
+    """
+    Sum the credits, debits and number of transactions per account and day.
+    """
+
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for instance in transactions:
+        entry = totals[instance.account_id, transaction_day(instance.date)]
+        amount = transaction_amount(instance.amount)
+        if instance.type == Transaction.TransactionType.CREDIT:
+            entry[0] += amount
+        else:
+            entry[1] += amount
+        entry[2] += 1
+    return totals
+
+
+def post_rollup_totals(totals):
+    """
+    Add per account and day totals, as returned by ``rollup_totals``, to the
+    daily and monthly balance rollups.
+
+    The period row is upserted, and the opening and closing balances of every
+    later period of the account are shifted by the net amount, so back-dated
+    transactions keep the rollups consistent.
+    """
+
+    for (account_id, day), (credits, debits, count) in totals.items():
+        delta = credits - debits
+        for model in ROLLUP_MODELS:
+            period_start = model.period_for(day)
+            opening = (
+                model.objects.filter(
+                    account_id=account_id, period_start__lt=period_start
+                )
+                .order_by("-period_start")
+                .values_list("closing_balance", flat=True)
+                .first()
+            ) or Decimal(0)
+
+            table = model._meta.db_table
+            upsert(
+                model,
+                {
+                    "account": account_id,
+                    "period_start": period_start,
+                    "opening_balance": opening,
+                    "closing_balance": opening + delta,
+                    "credits": credits,
+                    "debits": debits,
+                    "transaction_count": count,
+                },
+                conflict_fields=("account", "period_start"),
+                updates={
+                    "closing_balance": f"{table}.closing_balance"
+                    " + excluded.closing_balance - excluded.opening_balance",
+                    "credits": f"{table}.credits + excluded.credits",
+                    "debits": f"{table}.debits + excluded.debits",
+                    "transaction_count": f"{table}.transaction_count"
+                    " + excluded.transaction_count",
+                },
+            )
+            model.objects.filter(
+                account_id=account_id, period_start__gt=period_start
+            ).update(
+                opening_balance=F("opening_balance") + money(delta),
+                closing_balance=F("closing_balance") + money(delta),
+            )
+
+
+def rollup_messages(totals):
+    """
+    Return the outbox messages adding per account and day totals, as
+    returned by ``rollup_totals``, to the rollups.
+    """
+
+    return [
+        OutboxMessage(
+            account_id=account_id,
+            topic=OutboxMessage.Topic.ROLLUP,
+            payload={
+                "day": day.isoformat(),
+                "credits": str(credits),
+                "debits": str(debits),
+                "count": count,
+            },
+        )
+        for (account_id, day), (credits, debits, count) in totals.items()
+    ]
+
+
+def post_rollup_messages(messages):
+    """
+    Carry out rollup messages, adding up their totals per account and day
+    first so every period is updated once.
+    """
+
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for message in messages:
+        entry = totals[
+            message.account_id, datetime.date.fromisoformat(message.payload["day"])
+        ]
+        entry[0] += Decimal(message.payload["credits"])
+        entry[1] += Decimal(message.payload["debits"])
+        entry[2] += message.payload["count"]
+    post_rollup_totals(totals)
+
+
+def movement_sums():
+    """
+    Aggregates of the credits, debits and number of transactions of a queryset.
+    """
+
+    return {
+        "credits": Sum("amount", filter=Q(type=Transaction.TransactionType.CREDIT)),
+        "debits": Sum("amount", filter=Q(type=Transaction.TransactionType.DEBIT)),
+        "transaction_count": Count("id"),
+    }
+
+
+def rebuild_rollups(model, account_ids, start=None, end=None):
+    """
+    Recompute the rollups of ``model`` for the given accounts from their
+    transactions, optionally only for the periods overlapping ``start`` to
+    ``end``, and return the number of rollup rows written.
+
+    Transactions are summed per account and period in SQL; only the running
+    balance across periods is carried in Python. Archived transactions are
+    only read for the accounts whose archive the range reaches, the others
+    start from their archive checkpoint.
+    """
+
+    rollups = model.objects.filter(account_id__in=account_ids)
+    if start is not None:
+        start = model.period_for(start)
+        rollups = rollups.filter(period_start__gte=start)
+    if end is not None:
+        end = model.next_period(model.period_for(end))
+        rollups = rollups.filter(period_start__lt=end)
+
+    balances = defaultdict(Decimal)
+    archived = []
+    cutoffs = ArchiveCutoff.objects.filter(account_id__in=account_ids)
+    for account_id, cutoff, balance in cutoffs.values_list(
+        "account_id", "cutoff", "balance"
+    ):
+        if start is not None and cutoff <= day_start(start):
+            balances[account_id] = balance
+        else:
+            archived.append(account_id)
+    sources = [Transaction.objects.filter(account_id__in=account_ids)]
+    if archived:
+        sources.append(ArchivedTransaction.objects.filter(account_id__in=archived))
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    for transactions in sources:
+        if start is not None:
+            before = transactions.filter(date__lt=day_start(start))
+            for row in before.values("account_id").annotate(**movement_sums()):
+                balances[row["account_id"]] += (row["credits"] or 0) - (
+                    row["debits"] or 0
+                )
+            transactions = transactions.filter(date__gte=day_start(start))
+        if end is not None:
+            transactions = transactions.filter(date__lt=day_start(end))
+
+        periods = (
+            transactions.annotate(
+                period=Trunc("date", model.kind, output_field=DateField())
+            )
+            .values("account_id", "period")
+            .annotate(**movement_sums())
+        )
+        for row in periods:
+            entry = totals[row["account_id"], row["period"]]
+            entry[0] += row["credits"] or 0
+            entry[1] += row["debits"] or 0
+            entry[2] += row["transaction_count"]
+
+    entries = []
+    for (account_id, period), (credits, debits, count) in sorted(totals.items()):
+        opening = balances[account_id]
+        balances[account_id] = opening + credits - debits
+        entries.append(
+            model(
+                account_id=account_id,
+                period_start=period,
+                opening_balance=opening,
+                closing_balance=opening + credits - debits,
+                credits=credits,
+                debits=debits,
+                transaction_count=count,
+            )
+        )
+
+    if end is not None:
+        # Later periods open on the closing balance of the rebuilt range.
+        later = model.objects.filter(account_id__in=account_ids, period_start__gte=end)
+        first = (
+            model.objects.filter(account=OuterRef("account"), period_start__gte=end)
+            .order_by("period_start")
+            .values("period_start")[:1]
+        )
+        for account_id, opening in later.filter(
+            period_start=Subquery(first)
+        ).values_list("account_id", "opening_balance"):
+            delta = balances[account_id] - opening
+            if delta:
+                later.filter(account_id=account_id).update(
+                    opening_balance=F("opening_balance") + money(delta),
+                    closing_balance=F("closing_balance") + money(delta),
+                )
+
+    rollups.delete()
+    model.objects.bulk_create(entries, batch_size=500)
+    invalidate_accounts(account_ids)
+    return len(entries)
+
+
+def balance_mismatches(first, last):
+    """
+    Return the (number, owner id, ledger balance, expected balance) of every
+    account numbered ``first`` to ``last`` whose ledger balance differs from
+    the sum of its transactions, in one grouped query. Archived transactions
+    are counted through the archive checkpoint of the account.
+    """
+
+    accounts = (
+        Account.objects.filter(number__range=(first, last))
+        .values("number", "owner_id", "archive_cutoff__balance")
+        .annotate(
+            credits=Sum(
+                "transaction__amount",
+                filter=Q(transaction__type=Transaction.TransactionType.CREDIT),
+            ),
+            debits=Sum(
+                "transaction__amount",
+                filter=Q(transaction__type=Transaction.TransactionType.DEBIT),
+            ),
+        )
+        .order_by("number")
+    )
+    ledger = balances([row["number"] for row in accounts])
+    mismatches = []
+    for row in accounts:
+        expected = Decimal(
+            (row["archive_cutoff__balance"] or 0)
+            + (row["credits"] or 0)
+            - (row["debits"] or 0)
+        ).quantize(CENT)
+        balance = ledger[row["number"]]
+        if balance != expected:
+            mismatches.append((row["number"], row["owner_id"], balance, expected))
+    return mismatches
+
+
+def rebuild_balance_history(account_id):
+    """
+    Recompute the existing balance history entries of an account from its
+    transactions, hot and archived, as the balance at the end of every
+    entry's day given the transactions posted by then.
+
+    Transactions are summed per day in SQL, as integers of cents, and only
+    the running total of the days is computed here.
+    """
+
+    entries = list(BalanceHistory.objects.filter(account_id=account_id).order_by("day"))
+    days = defaultdict(int)
+    for model in (Transaction, ArchivedTransaction):
+        for day, total in (
+            model.objects.filter(account_id=account_id)
+            .annotate(day=Trunc("created_at", "day", output_field=DateField()))
+            .values("day")
+            .annotate(total=Sum(signed_amount(BigIntegerField())))
+            .values_list("day", "total")
+        ):
+            days[day] += total
+    days = sorted(days.items())
+    totals = running_totals(total for day, total in days)
+
+    index = 0
+    for entry in entries:
+        while index < len(days) and days[index][0] <= entry.day:
+            index += 1
+        entry.balance = from_cents(totals[index - 1] if index else 0)
+    BalanceHistory.objects.bulk_update(entries, ["balance"], batch_size=500)
+    return len(entries)
+
+
+def fix_balance(account_id, stored, expected):
+    """
+    Post a correction bringing the ledger balance of an account from
+    ``stored`` to ``expected`` if it is still ``stored``, and rebuild its
+    history and rollups. Return False when the balance changed concurrently
+    and was left alone.
+    """
+
+    with transaction.atomic(using=router.db_for_write(Account)):
+        if balances([account_id])[account_id] != stored:
+            return False
+        append_entries([(account_id, expected - stored, None)])
+    rebuild_balance_history(account_id)
+    for model in ROLLUP_MODELS:
+        rebuild_rollups(model, [account_id])
+    return True
@@ -0,0 +1,211 @@
+import csv
+import datetime
+import heapq
+import json
+from decimal import Decimal
+
+from django.db import router
+from django.db.models import ExpressionWrapper, Sum, Window
+from django.db.models.expressions import RowRange
+from rest_framework import renderers, serializers
+
+from .archive import archive_cutoffs, archive_needed
+from .ledger import balances
+from .models import ArchivedTransaction, Transaction
+from .money import MoneyField, money
+from .serializers import TransactionSerializer
+from .services import day_start, signed_amount, transaction_delta
+
+# Number of transactions fetched from the database, and written to the
+# response, at a time.
+STATEMENT_CHUNK_SIZE = 2000
+
+STATEMENT_COLUMNS = ("ID", "date", "transaction_type", "note", "amount", "balance")
+
+
+class StatementCSVRenderer(renderers.BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render error responses, statements themselves are streamed"""
+        rows = data.items() if isinstance(data, dict) else [[item] for item in data]
+        return "".join(csv_lines(rows)).encode()
+
+
+class StatementNDJSONRenderer(renderers.BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render error responses, statements themselves are streamed"""
+        return (json.dumps(data) + "\n").encode()
+
+
+class Echo:
+    """
+    File-like object that hands back what is written to it, so ``csv.writer``
+    can format single lines.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    return (writer.writerow(row) for row in rows)
+
+
+def opening_balance(account_id, transactions):
+    """
+    Return the balance of an account before ``transactions``, querysets of
+    its transactions dated from the start of the statement on: its ledger
+    balance, less their sum.
+
+    The ledger is read rather than the daily rollups, which the outbox
+    brings up to date later and balance corrections never touch, so a
+    statement running to today ends on the balance the account shows.
+    """
+
+    balance = balances([account_id]).get(account_id, Decimal(0))
+    for queryset in transactions:
+        balance -= queryset.aggregate(total=Sum(signed_amount()))["total"] or 0
+    return balance
+
+
+def statement_rows(transactions, balance):
+    """
+    Yield the statement rows of ``transactions``, as dicts of API formatted
+    values, with the running balance starting from ``balance``.
+
+    The running balance is a window sum computed by the database.
+    """
+
+    fields = TransactionSerializer().fields
+    date, amount = fields["date"], fields["amount"]
+    balance_field = serializers.DecimalField(max_digits=None, decimal_places=2)
+
+    order_by = ("date", "id")
+    rows = (
+        transactions.annotate(
+            balance=ExpressionWrapper(
+                Window(
+                    Sum(signed_amount()),
+                    order_by=order_by,
+                    frame=RowRange(start=None, end=0),
+                )
+                + money(balance),
+                output_field=MoneyField(),
+            )
+        )
+        .order_by(*order_by)
+        .values_list("id", "date", "type", "note", "amount", "balance")
+    )
+    for pk, value_date, transaction_type, note, value, balance in rows.iterator(
+        chunk_size=STATEMENT_CHUNK_SIZE
+    ):
+        yield {
+            "ID": pk,
+            "date": date.to_representation(value_date),
+            "transaction_type": transaction_type,
+            "note": note,
+            "amount": amount.to_representation(value),
+            "balance": balance_field.to_representation(balance),
+        }
+
+
+def merged_statement_rows(querysets, balance):
+    """
+    Yield the statement rows of the transactions of several querysets, hot
+    and archived, merged by date, with the running balance starting from
+    ``balance``.
+    """
+
+    fields = TransactionSerializer().fields
+    date, amount = fields["date"], fields["amount"]
+    balance_field = serializers.DecimalField(max_digits=None, decimal_places=2)
+
+    rows = heapq.merge(
+        *(
+            queryset.order_by("date", "id")
+            .values_list("id", "date", "type", "note", "amount")
+            .iterator(chunk_size=STATEMENT_CHUNK_SIZE)
+            for queryset in querysets
+        ),
+        key=lambda row: (row[1], row[0]),
+    )
+    for pk, value_date, transaction_type, note, value in rows:
+        balance += transaction_delta(transaction_type, value)
+        yield {
+            "ID": pk,
+            "date": date.to_representation(value_date),
+            "transaction_type": transaction_type,
+            "note": note,
+            "amount": amount.to_representation(value),
+            "balance": balance_field.to_representation(balance),
+        }
+
+
+def chunked(lines):
+    """
+    Join lines into blocks of ``STATEMENT_CHUNK_SIZE`` so the response is not
+    written one small line at a time.
+    """
+
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == STATEMENT_CHUNK_SIZE:
+            yield "".join(block)
+            block = []
+    if block:
+        yield "".join(block)
+
+
+def stream_csv(rows):
+    header = csv_lines([STATEMENT_COLUMNS])
+    body = csv_lines([row[column] for column in STATEMENT_COLUMNS] for row in rows)
+    yield from chunked(line for lines in (header, body) for line in lines)
+
+
+def stream_ndjson(rows):
+    yield from chunked(json.dumps(row) + "\n" for row in rows)
+
+
+def stream_statement(account_id, start, end, format):
+    """
+    Stream the statement of an account between two dates as CSV or NDJSON.
+
+    Transactions are read with a chunked iterator and formatted as they go,
+    so memory stays flat whatever the number of rows. The archived ones are
+    merged in when the range reaches past the archive cutoff of the account.
+    """
+
+    # The rows are read while the response streams, after the view returned,
+    # so the databases picked for the request are pinned here.
+    querysets = [
+        model.objects.using(router.db_for_read(model)).filter(account_id=account_id)
+        for model in (Transaction, ArchivedTransaction)
+    ]
+    since = None if start is None else day_start(start)
+    if since is not None:
+        querysets = [queryset.filter(date__gte=since) for queryset in querysets]
+    archived = archive_needed(archive_cutoffs([account_id]).get(account_id), since)
+    if not archived:
+        querysets = querysets[:1]
+
+    balance = opening_balance(account_id, querysets)
+    if end is not None:
+        until = day_start(end + datetime.timedelta(days=1))
+        querysets = [queryset.filter(date__lt=until) for queryset in querysets]
+
+    if archived:
+        rows = merged_statement_rows(querysets, balance)
+    else:
+        rows = statement_rows(querysets[0], balance)
+    if format == StatementCSVRenderer.format:
+        return stream_csv(rows)
+    return stream_ndjson(rows)
@@ -1,14 +1,63 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from .models import Account, Transaction
+from . import benchmark, ledger, outbox
+from .checks import check_outbox_cache
+from .db import copy_rows
+from .event_stream import EventStreamApplication
+from .events import InProcessBroker, get_broker
+from .factories import seed
+from .ledger import append_entries, balances
+from .models import (
+    Account,
+    ArchiveCutoff,
+    ArchivedBalanceHistory,
+    ArchivedTransaction,
+    BalanceCheckpoint,
+    BalanceHistory,
+    DailyBalanceRollup,
+    IdempotencyKey,
+    LedgerEntry,
+    MonthlyBalanceRollup,
+    OutboxMessage,
+    Transaction,
+)
+from .money import MoneyField, running_totals
+from .representation import RowRepresentation
+from .serializers import (
+    AccountSerializer,
+    BalanceHistorySerializer,
+    TransactionSerializer,
+)
+from .services import rebuild_balance_history, run_with_retry
 
 
 class AccountTestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         User = get_user_model()
 
         self.user = User.objects.create_user(
@@ -64,11 +113,13 @@ class AccountTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["ID"], 1)
-        self.assertEqual(response.data[0]["account_number"], "0000 0000 0000 0001")
-        self.assertEqual(response.data[0]["current_balance"], "100.00")
-        self.assertEqual(response.data[0]["user_id"], self.user.id)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["ID"], 1)
+        self.assertEqual(
+            response.data["results"][0]["account_number"], "0000 0000 0000 0001"
+        )
+        self.assertEqual(response.data["results"][0]["current_balance"], "100.00")
+        self.assertEqual(response.data["results"][0]["user_id"], self.user.id)
 
     def test_get_specific_account_without_user_authentication(self):
         url = reverse("account-detail", args=["1"])
@@ -101,13 +152,40 @@ class AccountTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["ID"], 1)
-        self.assertEqual(response.data[0]["account_id"], 1)
-        self.assertEqual(response.data[0]["amount"], "100.00")
-        self.assertEqual(response.data[0]["note"], "Test transaction")
-        self.assertEqual(response.data[0]["transaction_type"], "credit")
-        self.assertEqual(response.data[0]["date"], "2020-01-01T00:00:00Z")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["ID"], 1)
+        self.assertEqual(response.data["results"][0]["account_id"], 1)
+        self.assertEqual(response.data["results"][0]["amount"], "100.00")
+        self.assertEqual(response.data["results"][0]["note"], "Test transaction")
+        self.assertEqual(response.data["results"][0]["transaction_type"], "credit")
+        self.assertEqual(response.data["results"][0]["date"], "2020-01-01T00:00:00Z")
+
+    def test_list_transaction_pages_with_cursor(self):
+        self.client.force_authenticate(user=self.user)
+        for day in (3, 2, 2, 2, 1):
+            Transaction.objects.create(
+                account=self.account,
+                amount=1,
+                type="credit",
+                date=f"2020-02-0{day}T00:00:00Z",
+            )
+
+        ids, url = [], reverse("transaction-list") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids += [row["ID"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(ids, [2, 5, 4, 3, 6, 1])
+
+    def test_list_transaction_with_invalid_cursor(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("transaction-list")
+        response = self.client.get(url, {"cursor": "invalid"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_create_transaction_without_user_authentication(self):
         url = reverse("transaction-list")
@@ -213,6 +291,61 @@ class AccountTestCase(APITestCase):
         self.assertEqual(response.data["transaction_type"], "credit")
         self.assertEqual(response.data["date"], "2020-01-01T00:00:00Z")
 
+    def test_bulk_create_transactions_without_user_authentication(self):
+        url = reverse("transaction-bulk")
+        response = self.client.post(url, [], format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_create_transactions_with_user_authentication(self):
+        self.client.force_authenticate(user=self.user)
+        second_account = Account.objects.create(number=2, owner=self.user)
+        url = reverse("transaction-bulk")
+        data = [
+            {"account": 1, "amount": "25.50", "transaction_type": "credit"},
+            {"account": 1, "amount": "5.25", "transaction_type": "debit"},
+            {"account": 2, "amount": "40", "transaction_type": "credit"},
+            {"account": 1, "amount": "1", "transaction_type": "invalid"},
+            {"account": 3, "amount": "1", "transaction_type": "credit"},
+        ]
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["created"]), 3)
+        self.assertEqual(response.data["created"][0]["account_id"], 1)
+        self.assertEqual(response.data["created"][0]["amount"], "25.50")
+        self.assertEqual(response.data["created"][2]["account_id"], 2)
+        self.assertEqual([error["index"] for error in response.data["errors"]], [3, 4])
+        self.assertEqual(
+            response.data["errors"][0]["errors"]["transaction_type"][0],
+            '"invalid" is not a valid choice.',
+        )
+        self.assertEqual(
+            response.data["errors"][1]["errors"][0], "Account does not exist"
+        )
+
+        self.account.refresh_from_db()
+        second_account.refresh_from_db()
+        self.assertEqual(str(self.account.current_balance), "120.25")
+        self.assertEqual(str(second_account.current_balance), "40.00")
+        self.assertEqual(
+            str(BalanceHistory.objects.filter(account=self.account).first().balance),
+            "120.25",
+        )
+
+    def test_bulk_create_transactions_with_only_invalid_rows(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("transaction-bulk")
+        data = [{"account": 2, "amount": "1", "transaction_type": "credit"}]
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["created"], [])
+        self.assertEqual(len(response.data["errors"]), 1)
+
+        self.account.refresh_from_db()
+        self.assertEqual(str(self.account.current_balance), "100.00")
+
     #
     # Balance
     #
@@ -228,10 +361,12 @@ class AccountTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["account_id"], 1)
-        self.assertEqual(response.data[0]["balance"], "100.00")
-        self.assertEqual(response.data[0]["date"], timezone.now().strftime("%Y-%m-%d"))
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["account_id"], 1)
+        self.assertEqual(response.data["results"][0]["balance"], "100.00")
+        self.assertEqual(
+            response.data["results"][0]["date"], timezone.now().strftime("%Y-%m-%d")
+        )
 
     def test_get_balance_history_with_user_authentication_and_account_id(self):
         self.client.force_authenticate(user=self.user)
@@ -239,10 +374,12 @@ class AccountTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["account_id"], 1)
-        self.assertEqual(response.data[0]["balance"], "100.00")
-        self.assertEqual(response.data[0]["date"], timezone.now().strftime("%Y-%m-%d"))
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["account_id"], 1)
+        self.assertEqual(response.data["results"][0]["balance"], "100.00")
+        self.assertEqual(
+            response.data["results"][0]["date"], timezone.now().strftime("%Y-%m-%d")
+        )
 
     def test_get_balance_history_with_user_authentication_and_account_id_and_date(self):
         self.client.force_authenticate(user=self.user)
@@ -255,3 +392,2126 @@ class AccountTestCase(APITestCase):
         self.assertEqual(response.data["account_id"], 1)
         self.assertEqual(response.data["balance"], "100.00")
         self.assertEqual(response.data["date"], timezone.now().strftime("%Y-%m-%d"))
+
+    def set_balance_history(self, *entries):
+        """Replace the account's balance history with (created_at, balance) rows"""
+        BalanceHistory.objects.filter(account=self.account).delete()
+        for created_at, balance in entries:
+            history = BalanceHistory.objects.create(
+                account=self.account, balance=balance, day=created_at[:10]
+            )
+            BalanceHistory.objects.filter(pk=history.pk).update(created_at=created_at)
+
+    def test_balance_history_keeps_one_entry_per_day(self):
+        Transaction.objects.create(account=self.account, amount=150, type="credit")
+        Transaction.objects.create(account=self.account, amount=50, type="debit")
+
+        self.assertEqual(BalanceHistory.objects.filter(account=self.account).count(), 1)
+        history = BalanceHistory.objects.get(account=self.account)
+        self.assertEqual(str(history.balance), "200.00")
+        self.assertEqual(history.day, timezone.localdate())
+
+    def test_get_balance_history_with_account_id_and_date_before_latest(self):
+        self.client.force_authenticate(user=self.user)
+        self.set_balance_history(
+            ("2021-01-01T10:00:00Z", 10),
+            ("2021-01-03T23:59:59.500Z", 30),
+            ("2021-01-05T00:00:00Z", 50),
+        )
+        url = reverse("balance-account-date", args=[1, "2021-01-04"])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["balance"], "30.00")
+        self.assertEqual(response.data["date"], "2021-01-03")
+
+        url = reverse("balance-account-date", args=[1, "2020-12-31"])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], "No balance history found for this date")
+
+    def test_get_balance_series_with_user_authentication(self):
+        self.client.force_authenticate(user=self.user)
+        for date, amount in (
+            ("2021-01-01T10:00:00Z", 10),
+            ("2021-01-03T12:00:00Z", 20),
+            ("2021-01-05T00:00:00Z", 20),
+            ("2021-02-10T00:00:00Z", 20),
+        ):
+            Transaction.objects.create(
+                account=self.account, amount=amount, type="credit", date=date
+            )
+        url = reverse("balance-account", args=["1"])
+
+        response = self.client.get(url, {"from": "2021-01-02", "to": "2021-01-05"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row["date"], row["balance"]) for row in response.data],
+            [
+                ("2021-01-02", "110.00"),
+                ("2021-01-03", "130.00"),
+                ("2021-01-04", "130.00"),
+                ("2021-01-05", "150.00"),
+            ],
+        )
+
+        response = self.client.get(
+            url, {"from": "2020-12-30", "to": "2021-01-12", "granularity": "week"}
+        )
+        self.assertEqual(
+            [(row["date"], row["balance"]) for row in response.data],
+            [
+                ("2021-01-03", "130.00"),
+                ("2021-01-10", "150.00"),
+                ("2021-01-12", "150.00"),
+            ],
+        )
+
+        response = self.client.get(
+            url, {"from": "2021-01-15", "to": "2021-03-01", "granularity": "month"}
+        )
+        self.assertEqual(
+            [(row["date"], row["balance"]) for row in response.data],
+            [
+                ("2021-01-31", "150.00"),
+                ("2021-02-28", "170.00"),
+                ("2021-03-01", "170.00"),
+            ],
+        )
+
+    def test_get_balance_series_with_invalid_range(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("balance-account", args=["1"])
+
+        response = self.client.get(url, {"from": "2021-01-05", "to": "2021-01-01"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            url, {"from": "2021-01-01", "to": "2021-01-05", "granularity": "year"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BalanceRollupTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+
+        self.user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000001",
+            username="test",
+            email="test@mail.com",
+            password="Test123!",
+        )
+        self.account = Account.objects.create(number=1, owner=self.user)
+
+        for date, amount, transaction_type in (
+            ("2021-01-10T08:00:00Z", 50, "credit"),
+            ("2021-01-10T18:00:00Z", 5, "debit"),
+            ("2021-02-05T00:00:00Z", 20, "debit"),
+            ("2021-01-05T00:00:00Z", 10, "credit"),
+        ):
+            Transaction.objects.create(
+                account=self.account, amount=amount, type=transaction_type, date=date
+            )
+
+    def rollups(self, model):
+        return [
+            (
+                str(rollup.period_start),
+                str(rollup.opening_balance),
+                str(rollup.closing_balance),
+                str(rollup.credits),
+                str(rollup.debits),
+                rollup.transaction_count,
+            )
+            for rollup in model.objects.filter(account=self.account)
+        ]
+
+    def test_rollups_are_maintained_incrementally(self):
+        self.assertEqual(
+            self.rollups(DailyBalanceRollup),
+            [
+                ("2021-01-05", "0.00", "10.00", "10.00", "0.00", 1),
+                ("2021-01-10", "10.00", "55.00", "50.00", "5.00", 2),
+                ("2021-02-05", "55.00", "35.00", "0.00", "20.00", 1),
+            ],
+        )
+        self.assertEqual(
+            self.rollups(MonthlyBalanceRollup),
+            [
+                ("2021-01-01", "0.00", "55.00", "60.00", "5.00", 3),
+                ("2021-02-01", "55.00", "35.00", "0.00", "20.00", 1),
+            ],
+        )
+
+    def test_bulk_postings_update_rollups(self):
+        self.client.force_authenticate(user=self.user)
+        data = [
+            {"account": 1, "amount": "4", "transaction_type": "credit", "date": date}
+            for date in ("2021-01-10T09:00:00Z", "2021-01-20T09:00:00Z")
+        ]
+        self.client.post(reverse("transaction-bulk"), data, format="json")
+
+        self.assertEqual(
+            self.rollups(MonthlyBalanceRollup),
+            [
+                ("2021-01-01", "0.00", "63.00", "68.00", "5.00", 5),
+                ("2021-02-01", "63.00", "43.00", "0.00", "20.00", 1),
+            ],
+        )
+
+    def test_rebuild_balance_rollups(self):
+        daily = self.rollups(DailyBalanceRollup)
+        monthly = self.rollups(MonthlyBalanceRollup)
+        DailyBalanceRollup.objects.all().delete()
+        MonthlyBalanceRollup.objects.update(closing_balance=0, transaction_count=0)
+
+        call_command("rebuild_balance_rollups", stdout=io.StringIO())
+
+        self.assertEqual(self.rollups(DailyBalanceRollup), daily)
+        self.assertEqual(self.rollups(MonthlyBalanceRollup), monthly)
+
+    def test_rebuild_balance_rollups_for_date_range(self):
+        daily = self.rollups(DailyBalanceRollup)
+        DailyBalanceRollup.objects.filter(period_start="2021-01-10").delete()
+        DailyBalanceRollup.objects.filter(period_start="2021-02-05").update(credits=99)
+
+        call_command(
+            "rebuild_balance_rollups",
+            "--from=2021-01-06",
+            "--to=2021-01-31",
+            "--account=1",
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(self.rollups(DailyBalanceRollup)[:2], daily[:2])
+        self.assertEqual(self.rollups(DailyBalanceRollup)[2][3], "99.00")
+
+    def test_ranged_rebuilds_carry_into_later_periods(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("balance-rollups", args=["1"])
+        params = {"from": "2021-01-01", "to": "2021-02-28", "granularity": "day"}
+        self.client.get(url, params)
+        Transaction.objects.filter(date="2021-01-05T00:00:00Z").update(amount=30)
+
+        call_command(
+            "rebuild_balance_rollups",
+            "--from=2021-01-01",
+            "--to=2021-01-31",
+            "--account=1",
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(
+            self.rollups(DailyBalanceRollup),
+            [
+                ("2021-01-05", "0.00", "30.00", "30.00", "0.00", 1),
+                ("2021-01-10", "30.00", "75.00", "50.00", "5.00", 2),
+                ("2021-02-05", "75.00", "55.00", "0.00", "20.00", 1),
+            ],
+        )
+        self.assertEqual(
+            self.rollups(MonthlyBalanceRollup),
+            [
+                ("2021-01-01", "0.00", "75.00", "80.00", "5.00", 3),
+                ("2021-02-01", "75.00", "55.00", "0.00", "20.00", 1),
+            ],
+        )
+        response = self.client.get(url, params)
+        self.assertEqual(response.data[-1]["closing_balance"], "55.00")
+
+    def test_get_balance_rollups(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("balance-rollups", args=["1"])
+        response = self.client.get(
+            url, {"from": "2021-01-15", "to": "2021-02-28", "granularity": "month"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[0]["date"], "2021-01-01")
+        self.assertEqual(response.data[0]["opening_balance"], "0.00")
+        self.assertEqual(response.data[0]["closing_balance"], "55.00")
+        self.assertEqual(response.data[0]["credits"], "60.00")
+        self.assertEqual(response.data[0]["debits"], "5.00")
+        self.assertEqual(response.data[0]["transaction_count"], 3)
+        self.assertEqual(response.data[0]["account_id"], 1)
+
+        response = self.client.get(
+            url, {"from": "2021-01-15", "to": "2021-02-28", "granularity": "week"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StatementTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+
+        self.user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000001",
+            username="test",
+            email="test@mail.com",
+            password="Test123!",
+        )
+        self.account = Account.objects.create(number=1, owner=self.user)
+        for date, amount, transaction_type, note in (
+            ("2021-01-01T08:00:00Z", "100", "credit", "Salary"),
+            ("2021-01-02T09:30:00.250000Z", "20.50", "debit", 'Coffee, "large"'),
+            ("2021-01-03T10:00:00Z", "5", "debit", ""),
+        ):
+            Transaction.objects.create(
+                account=self.account,
+                amount=amount,
+                type=transaction_type,
+                note=note,
+                date=date,
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def get_statement(self, **params):
+        response = self.client.get(reverse("account-statement", args=["1"]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv_statement(self):
+        response, content = self.get_statement(format="csv")
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            content.splitlines(),
+            [
+                "ID,date,transaction_type,note,amount,balance",
+                "1,2021-01-01T08:00:00Z,credit,Salary,100.00,100.00",
+                '2,2021-01-02T09:30:00.250000Z,debit,"Coffee, ""large""",20.50,79.50',
+                "3,2021-01-03T10:00:00Z,debit,,5.00,74.50",
+            ],
+        )
+
+    def test_ndjson_statement_for_date_range(self):
+        response, content = self.get_statement(
+            format="ndjson", **{"from": "2021-01-02", "to": "2021-01-02"}
+        )
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [
+                {
+                    "ID": 2,
+                    "date": "2021-01-02T09:30:00.250000Z",
+                    "transaction_type": "debit",
+                    "note": 'Coffee, "large"',
+                    "amount": "20.50",
+                    "balance": "79.50",
+                }
+            ],
+        )
+
+    def test_opening_balance_comes_from_the_ledger(self):
+        # The rollups lag behind the ledger, and corrections only reach it.
+        DailyBalanceRollup.objects.all().delete()
+        append_entries([(self.account.pk, Decimal("2.00"), None)])
+
+        response, content = self.get_statement(format="csv", **{"from": "2021-01-02"})
+
+        self.assertEqual(
+            content.splitlines()[1:],
+            [
+                '2,2021-01-02T09:30:00.250000Z,debit,"Coffee, ""large""",20.50,81.50',
+                "3,2021-01-03T10:00:00Z,debit,,5.00,76.50",
+            ],
+        )
+        self.assertEqual(
+            Account.objects.get(pk=self.account.pk).current_balance, Decimal("76.50")
+        )
+
+    def test_statement_of_another_users_account(self):
+        User = get_user_model()
+        other = User.objects.create_user(username="other", password="Test123!")
+        self.client.force_authenticate(user=other)
+
+        response = self.client.get(reverse("account-statement", args=["1"]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_statement_with_invalid_date(self):
+        response = self.client.get(
+            reverse("account-statement", args=["1"]), {"from": "yesterday"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CachedResponseTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+
+        self.user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000001",
+            username="test",
+            email="test@mail.com",
+            password="Test123!",
+        )
+        self.other_user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000002",
+            username="other",
+            email="other@mail.com",
+            password="Test123!",
+        )
+        self.account = Account.objects.create(number=1, owner=self.user)
+        Account.objects.create(number=2, owner=self.other_user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_repeated_requests_are_served_from_cache(self):
+        url = reverse("account-list")
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_cache_is_per_user(self):
+        url = reverse("account-list")
+        self.client.get(url)
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(url)
+
+        self.assertEqual(response.data["results"][0]["ID"], 2)
+
+    def test_posting_a_transaction_invalidates_the_cache(self):
+        account_url = reverse("account-detail", args=["1"])
+        history_url = reverse("balance-account", args=["1"])
+        self.client.get(account_url)
+        etag = self.client.get(history_url)["ETag"]
+
+        self.client.post(
+            reverse("transaction-list"),
+            {"account": 1, "amount": 10, "transaction_type": "credit"},
+        )
+
+        response = self.client.get(account_url)
+        self.assertEqual(response.data["current_balance"], "10.00")
+        response = self.client.get(history_url)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["results"][0]["balance"], "10.00")
+
+    def test_bulk_postings_invalidate_the_cache(self):
+        url = reverse("account-list")
+        self.client.get(url)
+        self.client.post(
+            reverse("transaction-bulk"),
+            [{"account": 1, "amount": 10, "transaction_type": "credit"}],
+            format="json",
+        )
+
+        response = self.client.get(url)
+        self.assertEqual(response.data["results"][0]["current_balance"], "10.00")
+
+    def test_deleting_an_account_invalidates_the_cache(self):
+        url = reverse("account-list")
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.delete(reverse("account-detail", args=["1"]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+
+    def test_matching_etag_returns_not_modified_without_queries(self):
+        url = reverse("account-detail", args=["1"])
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(response.content)
+
+    def test_stale_etag_returns_fresh_data(self):
+        url = reverse("account-detail", args=["1"])
+        etag = self.client.get(url)["ETag"]
+        Transaction.objects.create(account=self.account, amount=5, type="credit")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["current_balance"], "5.00")
+
+
+class QueryCountAssertionsMixin:
+    """
+    Assertions pinning the number of queries an endpoint runs.
+    """
+
+    def assertConstantQueries(self, url, num, add_rows, sizes=(1, 20)):
+        """
+        Fetch ``url`` after growing its data set to each of ``sizes`` rows with
+        ``add_rows(count)`` and assert it always takes exactly ``num`` queries.
+        The response cache is cleared first, so the uncached path is measured.
+        """
+
+        for size in sizes:
+            add_rows(size)
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                len(context.captured_queries),
+                num,
+                f"{url} with {size} rows ran {len(context.captured_queries)} "
+                f"queries instead of {num}:\n"
+                + "\n".join(query["sql"] for query in context.captured_queries),
+            )
+
+
+class QueryCountTestCase(QueryCountAssertionsMixin, APITestCase):
+    def setUp(self):
+        User = get_user_model()
+
+        self.user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000001",
+            username="test",
+            email="test@mail.com",
+            password="Test123!",
+        )
+        self.account = Account.objects.create(number=1, owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def add_accounts(self, count):
+        while Account.objects.filter(owner=self.user).count() < count:
+            Account.objects.create(owner=self.user)
+
+    def add_transactions(self, count):
+        Transaction.objects.bulk_create(
+            Transaction(account=self.account, amount=1, type="credit")
+            for _ in range(count - Transaction.objects.count())
+        )
+
+    def add_balance_history(self, count):
+        existing = BalanceHistory.objects.count()
+        BalanceHistory.objects.bulk_create(
+            BalanceHistory(
+                account=self.account,
+                balance=1,
+                day=datetime.date(2020, 1, 1) + datetime.timedelta(days=day),
+            )
+            for day in range(existing, count)
+        )
+
+    def add_daily_rollups(self, count):
+        existing = DailyBalanceRollup.objects.count()
+        DailyBalanceRollup.objects.bulk_create(
+            DailyBalanceRollup(
+                account=self.account,
+                period_start=datetime.date(2020, 1, 1) + datetime.timedelta(days=day),
+                closing_balance=day,
+            )
+            for day in range(existing, count)
+        )
+
+    def test_account_list_queries(self):
+        self.assertConstantQueries(reverse("account-list"), 1, self.add_accounts)
+
+    def test_transaction_list_queries(self):
+        self.assertConstantQueries(
+            reverse("transaction-list"), 1, self.add_transactions
+        )
+
+    def test_balance_history_list_queries(self):
+        self.assertConstantQueries(reverse("balance-list"), 1, self.add_balance_history)
+
+    def test_balance_history_account_date_queries(self):
+        self.assertConstantQueries(
+            reverse("balance-account-date", args=["1", "2100-01-01"]),
+            2,
+            self.add_balance_history,
+        )
+
+    def test_balance_history_account_series_queries(self):
+        url = reverse("balance-account", args=["1"])
+        self.assertConstantQueries(
+            f"{url}?from=2020-01-01&to=2029-01-01&granularity=month",
+            2,
+            self.add_daily_rollups,
+        )
+
+    def test_balance_history_account_queries(self):
+        self.assertConstantQueries(
+            reverse("balance-account", args=["1"]), 2, self.add_balance_history
+        )
+
+
+class ConcurrentPostingTestCase(TransactionTestCase):
+    """
+    Post transactions to one account from several threads at once and check
+    that no balance update is lost.
+    """
+
+    threads = 8
+    postings_per_thread = 25
+
+    def setUp(self):
+        User = get_user_model()
+
+        self.user = User.objects.create_user(
+            id="00000000-0000-0000-0000-000000000001",
+            username="test",
+            email="test@mail.com",
+            password="Test123!",
+        )
+        self.account = Account.objects.create(number=1, owner=self.user)
+
+    def post(self, transaction_type, amount):
+        try:
+            for _ in range(self.postings_per_thread):
+                run_with_retry(
+                    Transaction.objects.create,
+                    account=Account(number=self.account.number, owner=self.user),
+                    amount=amount,
+                    type=transaction_type,
+                )
+        finally:
+            connection.close()
+
+    def test_concurrent_postings_keep_exact_balance(self):
+        workers = [
+            threading.Thread(
+                target=self.post,
+                args=(
+                    ("credit", Decimal("10.25"))
+                    if i % 2
+                    else ("debit", Decimal("3.10"))
+                ),
+            )
+            for i in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        postings = self.postings_per_thread * self.threads // 2
+        expected = postings * Decimal("10.25") - postings * Decimal("3.10")
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, expected)
+        self.assertEqual(
+            Transaction.objects.filter(account=self.account).count(),
+            self.postings_per_thread * self.threads,
+        )
+        self.assertEqual(
+            BalanceHistory.objects.filter(account=self.account).first().balance,
+            expected,
+        )
+
+    def test_sequence_conflicts_are_retried(self):
+        # The state read before another writer appended to the ledger.
+        stale = ledger.ledger_state([self.account.pk])
+        Transaction.objects.create(account=self.account, amount=5, type="credit")
+
+        with mock.patch(
+            "apps.account.ledger.ledger_state",
+            side_effect=[stale, ledger.ledger_state([self.account.pk])],
+        ) as ledger_state:
+            run_with_retry(
+                Transaction.objects.create,
+                account=self.account,
+                amount=7,
+                type="credit",
+            )
+
+        self.assertEqual(ledger_state.call_count, 2)
+        self.assertEqual(self.account.current_balance, Decimal(12))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class BenchmarkTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_settles_balances(self):
+        users = seed(2, 2, 10)
+
+        self.assertEqual(Account.objects.filter(owner__in=users).count(), 4)
+        for account in Account.objects.filter(owner__in=users):
+            credits = sum(
+                t.amount for t in account.transaction_set.filter(type="credit")
+            )
+            debits = sum(t.amount for t in account.transaction_set.filter(type="debit"))
+            self.assertEqual(account.transaction_set.count(), 10)
+            self.assertEqual(account.current_balance, credits - debits)
+            self.assertEqual(
+                BalanceHistory.objects.get(account=account).balance,
+                account.current_balance,
+            )
+            self.assertEqual(
+                MonthlyBalanceRollup.objects.filter(account=account)
+                .last()
+                .closing_balance,
+                account.current_balance,
+            )
+
+    def test_run_in_process(self):
+        users = seed(2, 2, 5)
+
+        results = benchmark.run(users, list(benchmark.ENDPOINTS), 5, ["inprocess"])
+
+        self.assertEqual(set(results), set(benchmark.ENDPOINTS))
+        for modes in results.values():
+            summary = modes["inprocess"]
+            self.assertEqual(summary["requests"], 5)
+            self.assertEqual(summary["errors"], 0)
+            self.assertLessEqual(summary["p50"], summary["p99"])
+            self.assertGreater(summary["queries"], 0)
+
+    def test_compare_serialization(self):
+        seed(2, 3, 4)
+
+        results = benchmark.compare_serialization(10, repeat=1)
+
+        self.assertEqual(set(results), set(benchmark.SERIALIZATION_CASES))
+        self.assertEqual(results["transaction"]["rows"], 10)
+        self.assertEqual(results["account"]["rows"], 6)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"account-list": {"inprocess": {"p95": 10.0, "rps": 100.0}}}
+        results = {"account-list": {"inprocess": {"p95": 12.0, "rps": 70.0}}}
+
+        changes = benchmark.compare(baseline, results)
+
+        self.assertEqual(
+            changes, {"account-list": {"inprocess": {"p95": 20.0, "rps": -30.0}}}
+        )
+        self.assertEqual(
+            benchmark.regressions(changes, 25),
+            [("account-list", "inprocess", "rps", -30.0)],
+        )
+
+
+class IdempotencyTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.account = Account.objects.create(owner=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.payload = {
+            "account": self.account.number,
+            "amount": "25.00",
+            "transaction_type": "credit",
+            "note": "Retried",
+        }
+
+    def post(self, key, payload=None, url=None):
+        return self.client.post(
+            url or reverse("transaction-list"),
+            payload or self.payload,
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_replay_returns_stored_response(self):
+        first = self.post("key-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as captured:
+            replayed = self.post("key-1")
+
+        self.assertEqual(replayed.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(replayed["Idempotent-Replayed"], "true")
+        self.assertEqual(len(captured), 0)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, Decimal("25.00"))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_replay_from_table(self):
+        first = self.post("key-1")
+        cache.clear()
+
+        replayed = self.post("key-1")
+
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_key_reused_for_other_payload(self):
+        self.post("key-1")
+
+        response = self.post("key-1", {**self.payload, "amount": "30.00"})
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_failed_requests_are_not_stored(self):
+        response = self.post("key-1", {**self.payload, "transaction_type": "refund"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.post("key-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_replay(self):
+        url = reverse("transaction-bulk")
+        first = self.post("bulk-1", [self.payload, self.payload], url)
+        replayed = self.post("bulk-1", [self.payload, self.payload], url)
+
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 2)
+
+    def test_expired_keys(self):
+        self.post("key-1")
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        cache.clear()
+
+        response = self.post("key-1")
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 2)
+
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        out = io.StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 expired keys", out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ReconcileBalancesTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.accounts = [Account.objects.create(owner=self.user) for _ in range(3)]
+        for account in self.accounts:
+            Transaction.objects.create(account=account, amount=100, type="credit")
+            Transaction.objects.create(account=account, amount=30, type="debit")
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command("reconcile_balances", "--workers", "1", *args, stdout=out)
+        return out.getvalue()
+
+    def drift(self, account, amount):
+        """Post a ledger entry without a transaction to move the balance"""
+        append_entries([(account.pk, amount - account.current_balance, None)])
+        account.refresh_from_db()
+        BalanceHistory.objects.filter(account=account).update(balance=amount)
+
+    def test_reports_mismatches(self):
+        self.drift(self.accounts[1], Decimal("75.00"))
+
+        output = self.reconcile()
+
+        self.assertIn(
+            f"Account {self.accounts[1].number}: balance 75.00, "
+            "transactions sum to 70.00 (-5.00)",
+            output,
+        )
+        self.assertIn("Checked 3 accounts, found 1 mismatches", output)
+        self.accounts[1].refresh_from_db()
+        self.assertEqual(self.accounts[1].current_balance, Decimal("75.00"))
+
+    def test_fixes_mismatches(self):
+        self.drift(self.accounts[1], Decimal("75.00"))
+        DailyBalanceRollup.objects.filter(account=self.accounts[1]).delete()
+
+        output = self.reconcile("--fix")
+
+        self.assertIn("found 1 mismatches, fixed 1", output)
+        self.accounts[1].refresh_from_db()
+        self.assertEqual(self.accounts[1].current_balance, Decimal("70.00"))
+        self.assertEqual(
+            BalanceHistory.objects.get(account=self.accounts[1]).balance,
+            Decimal("70.00"),
+        )
+        self.assertEqual(
+            DailyBalanceRollup.objects.get(account=self.accounts[1]).closing_balance,
+            Decimal("70.00"),
+        )
+        self.assertIn("found 0 mismatches", self.reconcile())
+
+    def test_resumes_from_checkpoint(self):
+        self.drift(self.accounts[0], Decimal("1.00"))
+        self.drift(self.accounts[2], Decimal("2.00"))
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "checkpoint.json")
+            with open(checkpoint, "w") as file:
+                json.dump({"last_account": self.accounts[0].number, "checked": 1}, file)
+
+            output = self.reconcile("--checkpoint", checkpoint, "--chunk-size", "1")
+
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertNotIn(f"Account {self.accounts[0].number}:", output)
+        self.assertIn(f"Account {self.accounts[2].number}:", output)
+        self.assertIn("Checked 2/3 accounts", output)
+        self.assertIn("Checked 3 accounts, found 1 mismatches", output)
+
+
+class TransactionFilterTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username="test", password="Test123!")
+        self.accounts = [Account.objects.create(owner=self.user) for _ in range(2)]
+        for account, date, amount, transaction_type, note in (
+            (0, "2021-01-01T08:00:00Z", "100", "credit", "Salary January"),
+            (0, "2021-01-02T09:30:00Z", "20.50", "debit", "Coffee, large"),
+            (0, "2021-02-01T08:00:00Z", "100", "credit", "Salary February"),
+            (1, "2021-01-15T12:00:00Z", "7.25", "debit", "COFFEE beans"),
+            (1, "2021-01-20T12:00:00Z", "300", "credit", "Refund"),
+        ):
+            Transaction.objects.create(
+                account=self.accounts[account],
+                amount=amount,
+                type=transaction_type,
+                note=note,
+                date=date,
+            )
+        other = User.objects.create_user(username="other", password="Test123!")
+        Transaction.objects.create(
+            account=Account.objects.create(owner=other),
+            amount=1,
+            type="debit",
+            note="Coffee",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def list_notes(self, **params):
+        response = self.client.get(reverse("transaction-list"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(row["note"] for row in response.json()["results"])
+
+    def test_filter_by_account_and_type(self):
+        self.assertEqual(
+            self.list_notes(account=self.accounts[0].number, type="credit"),
+            ["Salary February", "Salary January"],
+        )
+        self.assertEqual(
+            self.list_notes(account=self.accounts[1].number),
+            ["COFFEE beans", "Refund"],
+        )
+
+    def test_filter_by_date_and_amount_range(self):
+        self.assertEqual(
+            self.list_notes(**{"from": "2021-01-02", "to": "2021-01-31"}),
+            ["COFFEE beans", "Coffee, large", "Refund"],
+        )
+        self.assertEqual(
+            self.list_notes(amount_min="20.50", amount_max="100"),
+            ["Coffee, large", "Salary February", "Salary January"],
+        )
+
+    def test_filter_by_note(self):
+        self.assertEqual(
+            self.list_notes(note="coffee"), ["COFFEE beans", "Coffee, large"]
+        )
+        self.assertEqual(
+            self.list_notes(note="ary"), ["Salary February", "Salary January"]
+        )
+        # Shorter than a trigram, searched without the index.
+        self.assertEqual(self.list_notes(note="Re"), ["Refund"])
+        self.assertEqual(self.list_notes(note='"quoted" OR'), [])
+
+    def test_note_index_follows_updates_and_deletes(self):
+        transaction = Transaction.objects.get(note="Refund")
+        transaction.note = "Chargeback"
+        transaction.save()
+        Transaction.objects.filter(note="COFFEE beans").delete()
+
+        self.assertEqual(self.list_notes(note="refund"), [])
+        self.assertEqual(self.list_notes(note="charge"), ["Chargeback"])
+        self.assertEqual(self.list_notes(note="coffee"), ["Coffee, large"])
+
+    def test_filter_uses_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.list_notes(account=self.accounts[0].number, type="debit", note="cof")
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + queries.captured_queries[-1]["sql"])
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+
+        self.assertIn("transaction_account_type_idx", plan)
+        self.assertIn("VIRTUAL TABLE INDEX", plan)
+
+    def test_invalid_filters(self):
+        for params in (
+            {"account": "abc"},
+            {"type": "refund"},
+            {"from": "yesterday"},
+            {"amount_min": "ten"},
+            {"amount_max": "NaN"},
+            {"amount_min": "1e30"},
+            {"amount_max": "-1e16"},
+            {"amount_min": "0.001"},
+            {"account": "99999999999999999999999"},
+            {"account": "\u00b2"},
+        ):
+            response = self.client.get(reverse("transaction-list"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_filters_at_the_bounds(self):
+        for params in (
+            {"amount_min": "-9999999999999999.99"},
+            {"amount_max": "9999999999999999.99"},
+            {"account": str(2**63 - 1)},
+        ):
+            response = self.client.get(reverse("transaction-list"), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, params)
+
+
+class RowRepresentationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.accounts = [Account.objects.create(owner=self.user) for _ in range(3)]
+        for account, date, amount, transaction_type, note in (
+            (0, "2021-01-01T08:00:00Z", "100", "credit", "Salary"),
+            (0, "2021-01-02T09:30:00.250000Z", "0.5", "debit", 'Coffee, "large"'),
+            (1, "2021-01-03T23:59:59.999999Z", "99999.99", "credit", ""),
+            (2, "2021-01-04T00:00:00Z", "12.3", "debit", "Caf\u00e9 \u2615"),
+        ):
+            Transaction.objects.create(
+                account=self.accounts[account],
+                amount=amount,
+                type=transaction_type,
+                note=note,
+                date=date,
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def assertSameAsSerializer(self, url, serializer_class, queryset):
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = JSONRenderer().render(
+            {"next": None, "results": serializer_class(queryset, many=True).data}
+        )
+        self.assertEqual(response.content, expected)
+
+    def test_account_list(self):
+        self.assertSameAsSerializer(
+            reverse("account-list"),
+            AccountSerializer,
+            Account.objects.order_by("number"),
+        )
+
+    def test_transaction_list(self):
+        self.assertSameAsSerializer(
+            reverse("transaction-list"),
+            TransactionSerializer,
+            Transaction.objects.order_by("-date", "-id"),
+        )
+
+    def test_balance_list(self):
+        self.assertSameAsSerializer(
+            reverse("balance-list"),
+            BalanceHistorySerializer,
+            BalanceHistory.objects.order_by("-created_at", "-id"),
+        )
+
+    def test_pages_follow_the_cursor(self):
+        response = self.client.get(reverse("transaction-list"), {"page_size": 3})
+        second = self.client.get(response.data["next"])
+
+        self.assertEqual(
+            [row["ID"] for row in response.data["results"] + second.data["results"]],
+            list(
+                Transaction.objects.order_by("-date", "-id").values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+
+    def test_method_fields_need_a_row_method(self):
+        class Serializer(AccountSerializer):
+            class Meta(AccountSerializer.Meta):
+                row_methods = {}
+
+        with self.assertRaises(ImproperlyConfigured):
+            RowRepresentation(Serializer)
+
+
+@override_settings(LEDGER_CHECKPOINT_INTERVAL=3)
+class LedgerTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.account = Account.objects.create(owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def post(self, amount, transaction_type="credit"):
+        return Transaction.objects.create(
+            account=self.account, amount=amount, type=transaction_type
+        )
+
+    def test_postings_only_insert_entries(self):
+        updated_at = self.account.updated_at
+        self.post(100)
+        self.post(30, "debit")
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.updated_at, updated_at)
+        self.assertEqual(self.account.current_balance, Decimal("70.00"))
+        entries = LedgerEntry.objects.filter(account=self.account)
+        self.assertEqual(
+            list(
+                entries.filter(book=LedgerEntry.Book.ACCOUNT)
+                .order_by("sequence")
+                .values_list("sequence", "amount")
+            ),
+            [(1, Decimal("100.00")), (2, Decimal("-30.00"))],
+        )
+        for posting in entries.values_list("posting", flat=True).distinct():
+            legs = entries.filter(posting=posting)
+            self.assertEqual(
+                sorted(legs.values_list("book", flat=True)), ["account", "external"]
+            )
+            self.assertEqual(sum(legs.values_list("amount", flat=True)), 0)
+
+    def test_checkpoints_every_interval(self):
+        for amount in range(1, 8):
+            self.post(amount)
+
+        self.assertEqual(
+            list(
+                BalanceCheckpoint.objects.filter(account=self.account)
+                .order_by("sequence")
+                .values_list("sequence", "balance")
+            ),
+            [(3, Decimal("6.00")), (6, Decimal("21.00"))],
+        )
+        self.assertEqual(balances([self.account.pk]), {self.account.pk: 28})
+        self.assertEqual(balances([self.account.pk], 4), {self.account.pk: 10})
+
+    def test_balances_read_bounded_rows(self):
+        for _ in range(10):
+            self.post(1)
+        # Rewrite the entries behind the last checkpoint, which must not be
+        # read anymore.
+        LedgerEntry.objects.filter(account=self.account, sequence__lte=9).update(
+            amount=1000
+        )
+
+        self.assertEqual(balances([self.account.pk]), {self.account.pk: 10})
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, Decimal("10.00"))
+
+    def test_balance_as_of(self):
+        url = reverse("account-balance", args=[self.account.pk])
+        for amount, posted_at in (
+            (10, "2021-01-01T10:00:00Z"),
+            (20, "2021-01-02T10:00:00Z"),
+            (30, "2021-01-03T10:00:00Z"),
+            (40, "2021-01-04T10:00:00Z"),
+        ):
+            transaction = self.post(amount)
+            LedgerEntry.objects.filter(transaction=transaction).update(
+                posted_at=posted_at
+            )
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["balance"], "100.00")
+        self.assertNotIn("as_of", response.data)
+
+        response = self.client.get(url, {"as_of": "2021-01-03T12:00:00Z"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["balance"], "60.00")
+
+        response = self.client.get(url, {"as_of": "2021-01-04T10:00:00Z"})
+        self.assertEqual(response.data["balance"], "100.00")
+
+        response = self.client.get(url, {"as_of": "2020-12-31T00:00:00Z"})
+        self.assertEqual(response.data["balance"], "0.00")
+
+        response = self.client.get(url, {"as_of": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_transactions_appends_in_order(self):
+        other = Account.objects.create(owner=self.user)
+        response = self.client.post(
+            reverse("transaction-bulk"),
+            [
+                {"account": account.pk, "amount": amount, "transaction_type": "credit"}
+                for account, amount in (
+                    (self.account, 1),
+                    (other, 5),
+                    (self.account, 2),
+                    (self.account, 3),
+                    (self.account, 4),
+                )
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            balances([self.account.pk, other.pk]),
+            {self.account.pk: 10, other.pk: 5},
+        )
+        self.assertEqual(
+            list(
+                BalanceCheckpoint.objects.filter(account=self.account).values_list(
+                    "sequence", "balance"
+                )
+            ),
+            [(3, Decimal("6.00"))],
+        )
+        self.assertEqual(
+            BalanceHistory.objects.get(account=self.account).balance, Decimal("10.00")
+        )
+
+
+class LedgerMigrationTestCase(APITransactionTestCase):
+    """Backfill the ledger of the transactions of an upgraded database"""
+
+    def setUp(self):
+        cache.clear()
+        executor = MigrationExecutor(connection)
+        executor.migrate([("account", "0007_transaction_filters")])
+        apps = executor.loader.project_state(
+            ("account", "0007_transaction_filters")
+        ).apps
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        # The stored balance drifted 10.00 away from the transactions.
+        account = apps.get_model("account", "Account").objects.create(
+            owner_id=self.user.pk, current_balance=Decimal("145.25")
+        )
+        # The transaction dated first was created last.
+        for date, amount, transaction_type in (
+            ("2021-02-01T12:00:00Z", "14.75", "debit"),
+            ("2021-04-01T12:00:00Z", "50", "credit"),
+            ("2021-01-01T12:00:00Z", "100", "credit"),
+        ):
+            apps.get_model("account", "Transaction").objects.create(
+                account_id=account.pk,
+                amount=Decimal(amount),
+                type=transaction_type,
+                date=date,
+            )
+        self.number = account.pk
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        self.client.force_authenticate(user=self.user)
+
+    def get_balance(self, as_of):
+        response = self.client.get(
+            reverse("account-balance", args=[self.number]), {"as_of": as_of}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["balance"]
+
+    def test_balances_as_of_backfilled_transactions(self):
+        self.assertEqual(self.get_balance("2020-12-31T00:00:00Z"), "0.00")
+        self.assertEqual(self.get_balance("2021-01-15T00:00:00Z"), "100.00")
+        self.assertEqual(self.get_balance("2021-03-01T00:00:00Z"), "85.25")
+        self.assertEqual(self.get_balance("2021-05-01T00:00:00Z"), "135.25")
+        # The correction is posted when migrating.
+        self.assertEqual(self.get_balance(timezone.now().isoformat()), "145.25")
+        self.assertEqual(
+            Account.objects.get(pk=self.number).current_balance, Decimal("145.25")
+        )
+
+
+class AsyncReadTestCase(APITestCase):
+    """The async read endpoints answer exactly as their DRF counterparts"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "test", "password": "Test123!"}
+        )
+        self.authorization = f"Bearer {response.data['access']}"
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization)
+
+        self.accounts = [Account.objects.create(owner=self.user) for _ in range(3)]
+        for index, account in enumerate(self.accounts):
+            for amount in range(1, 5):
+                Transaction.objects.create(
+                    account=account,
+                    amount=amount * (index + 1),
+                    note=f"Payment {amount}",
+                    type="debit" if amount == 2 else "credit",
+                    date=f"2021-01-0{amount}T10:00:00Z",
+                )
+        other = get_user_model().objects.create_user(username="other", password="x")
+        self.other_account = Account.objects.create(owner=other)
+
+    def get_async(self, path, params=None, **extra):
+        extra.setdefault("authorization", self.authorization)
+
+        async def get():
+            return await self.async_client.get(path, params or {}, **extra)
+
+        return async_to_sync(get)()
+
+    def assertSameResponse(self, path, async_path, params=None):
+        expected = self.client.get(path, params or {})
+        response = self.get_async(async_path, params)
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response["Content-Type"], "application/json")
+        # Only the links to the next page differ.
+        self.assertEqual(response.content.replace(b"/async/", b"/"), expected.content)
+        return response
+
+    def test_account_list_and_detail(self):
+        response = self.assertSameResponse(
+            reverse("account-list"), reverse("async-account-list")
+        )
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertSameResponse(
+            reverse("account-list"), reverse("async-account-list"), {"page_size": 2}
+        )
+
+        account = self.accounts[1]
+        self.assertSameResponse(
+            reverse("account-detail", args=[account.pk]),
+            reverse("async-account-detail", args=[account.pk]),
+        )
+        self.assertSameResponse(
+            reverse("account-detail", args=[self.other_account.pk]),
+            reverse("async-account-detail", args=[self.other_account.pk]),
+        )
+
+    def test_transaction_list_pages_and_filters(self):
+        url, async_url = reverse("transaction-list"), reverse("async-transaction-list")
+        self.assertSameResponse(url, async_url)
+        self.assertSameResponse(
+            url,
+            async_url,
+            {"account": self.accounts[0].pk, "type": "credit", "note": "ment 3"},
+        )
+        self.assertSameResponse(url, async_url, {"from": "invalid"})
+
+        response = self.get_async(async_url, {"page_size": 5})
+        self.assertEqual(len(response.json()["results"]), 5)
+        cursor = response.json()["next"].split("cursor=")[1]
+        self.assertSameResponse(url, async_url, {"page_size": 5, "cursor": cursor})
+
+    def test_balance_history(self):
+        self.assertSameResponse(reverse("balance-list"), reverse("async-balance-list"))
+
+        account = self.accounts[2]
+        url = reverse("balance-account", args=[account.pk])
+        async_url = reverse("async-balance-account", args=[account.pk])
+        self.assertSameResponse(url, async_url)
+        self.assertSameResponse(
+            url, async_url, {"from": "2021-01-01", "to": "2021-01-10"}
+        )
+        self.assertSameResponse(
+            reverse("balance-account", args=[self.other_account.pk]),
+            reverse("async-balance-account", args=[self.other_account.pk]),
+        )
+
+    def test_lists_merge_archived_rows(self):
+        account = self.accounts[2]
+        BalanceHistory.objects.filter(account=account).update(
+            created_at="2021-01-01T12:00:00Z"
+        )
+        call_command(
+            "archive_transactions", "--before", "2021-01-03", stdout=io.StringIO()
+        )
+
+        for name, args in (
+            ("transaction-list", []),
+            ("balance-list", []),
+            ("balance-account", [account.pk]),
+        ):
+            for page_size in (2, 50):
+                self.assertSameResponse(
+                    reverse(name, args=args),
+                    reverse(f"async-{name}", args=args),
+                    {"page_size": page_size},
+                )
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        for name in ("account-list", "transaction-list", "balance-list"):
+            expected = self.client.get(reverse(name))
+            response = self.get_async(reverse(f"async-{name}"), authorization="")
+
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response["WWW-Authenticate"], expected["WWW-Authenticate"])
+
+        response = self.get_async(
+            reverse("async-account-list"), authorization="Bearer invalid"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_only_serves_get(self):
+        async def post():
+            return await self.async_client.post(
+                reverse("async-account-list"), authorization=self.authorization
+            )
+
+        response = async_to_sync(post)()
+
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class EventStreamTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "test", "password": "Test123!"}
+        )
+        self.token = response.data["access"]
+        self.account = Account.objects.create(owner=self.user)
+        self.application = EventStreamApplication(self.django_application)
+
+    async def django_application(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    def communicator(self, path="/events/", query="", headers=()):
+        return ApplicationCommunicator(
+            self.application,
+            {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": query.encode(),
+                "headers": [(name.encode(), value.encode()) for name, value in headers],
+            },
+        )
+
+    def post(self, amount, note=""):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Transaction.objects.create(
+                account=self.account, amount=amount, type="credit", note=note
+            )
+
+    def parse(self, body):
+        """Return the (id, type, data) of the events of a response body"""
+        events = []
+        for block in body.decode().strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append(
+                (fields.get("id"), fields["event"], json.loads(fields["data"]))
+            )
+        return events
+
+    def test_requires_a_valid_token(self):
+        async def scenario(query):
+            communicator = self.communicator(query=query)
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output()
+            body = await communicator.receive_output()
+            return start, json.loads(body["body"])
+
+        start, body = async_to_sync(scenario)("")
+        self.assertEqual(start["status"], 401)
+        self.assertIn((b"www-authenticate", b'Bearer realm="api"'), start["headers"])
+        self.assertEqual(
+            body["detail"], "Authentication credentials were not provided."
+        )
+
+        start, body = async_to_sync(scenario)("token=invalid")
+        self.assertEqual(start["status"], 401)
+
+    def test_other_requests_go_to_django(self):
+        async def scenario():
+            communicator = self.communicator(path="/account/")
+            return await communicator.receive_output()
+
+        self.assertEqual(async_to_sync(scenario)()["status"], 204)
+
+    def test_streams_committed_postings(self):
+        async def scenario():
+            communicator = self.communicator(
+                headers=[("authorization", f"Bearer {self.token}")]
+            )
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output()
+            posted = await sync_to_async(self.post)(Decimal("12.50"), "Salary")
+            body = await communicator.receive_output()
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait()
+            return start, posted, body
+
+        start, posted, body = async_to_sync(scenario)()
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+
+        transaction, balance = self.parse(body["body"])
+        self.assertEqual(
+            transaction,
+            (None, "transaction", dict(TransactionSerializer(posted).data)),
+        )
+        self.assertEqual(balance[:2], (str(posted.pk), "balance"))
+        self.assertEqual(balance[2]["ID"], self.account.pk)
+        self.assertEqual(balance[2]["balance"], "12.50")
+        self.assertFalse(get_broker().has_subscribers(self.user.pk))
+
+    def test_resumes_after_the_last_event_id(self):
+        first = self.post(5)
+        missed = [self.post(7), self.post(1)]
+
+        async def scenario():
+            communicator = self.communicator(
+                query=f"token={self.token}&last_event_id={first.pk}"
+            )
+            await communicator.send_input({"type": "http.request"})
+            await communicator.receive_output()
+            replayed = await communicator.receive_output()
+            # Batches already replayed are not sent again.
+            get_broker().publish(self.user.pk, (missed[-1].pk, [("balance", {})]))
+            live = await sync_to_async(self.post)(2)
+            body = await communicator.receive_output()
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait()
+            return replayed, live, body
+
+        replayed, live, body = async_to_sync(scenario)()
+        events = self.parse(replayed["body"])
+        self.assertEqual(
+            [(event_id, event_type) for event_id, event_type, data in events],
+            [
+                (None, "transaction"),
+                (None, "transaction"),
+                (str(missed[-1].pk), "balance"),
+            ],
+        )
+        self.assertEqual(
+            [data["ID"] for _, _, data in events[:2]], [m.pk for m in missed]
+        )
+        self.assertEqual(events[2][2]["balance"], "13.00")
+        self.assertEqual(self.parse(body["body"])[-1][:2], (str(live.pk), "balance"))
+
+    @override_settings(ACCOUNT_EVENTS_REPLAY_LIMIT=1)
+    def test_resuming_too_far_behind_resets(self):
+        first = self.post(5)
+        self.post(7)
+        latest = self.post(1)
+
+        async def scenario():
+            communicator = self.communicator(
+                query=f"token={self.token}&last_event_id={first.pk}"
+            )
+            await communicator.send_input({"type": "http.request"})
+            await communicator.receive_output()
+            body = await communicator.receive_output()
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait()
+            return body
+
+        events = self.parse(async_to_sync(scenario)()["body"])
+        self.assertEqual(events, [(str(latest.pk), "reset", {})])
+
+    @override_settings(ACCOUNT_EVENTS_HEARTBEAT=0.01)
+    def test_idle_streams_are_kept_alive(self):
+        async def scenario():
+            communicator = self.communicator(query=f"token={self.token}")
+            await communicator.send_input({"type": "http.request"})
+            await communicator.receive_output()
+            body = await communicator.receive_output()
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait()
+            return body
+
+        self.assertEqual(async_to_sync(scenario)()["body"], b": keepalive\n\n")
+
+    @override_settings(ACCOUNT_EVENTS_QUEUE_SIZE=2)
+    def test_lagging_subscriptions_are_closed(self):
+        async def scenario():
+            broker = InProcessBroker()
+            subscription = broker.subscribe(self.user.pk)
+            for event_id in range(1, 5):
+                broker.publish(self.user.pk, (event_id, [("balance", {})]))
+            batches = []
+            while (batch := await subscription.get(1)) is not None:
+                batches.append(batch[0])
+            return batches, broker.has_subscribers(self.user.pk)
+
+        self.assertEqual(async_to_sync(scenario)(), ([1, 2], False))
+
+    def test_postings_without_subscribers_are_not_serialized(self):
+        with mock.patch("apps.account.events.transaction_event") as serialize:
+            self.post(5)
+        serialize.assert_not_called()
+
+
+@override_settings(OUTBOX_EAGER=False)
+class OutboxTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user)
+
+    def post(self, amount, transaction_type="credit"):
+        response = self.client.post(
+            reverse("transaction-list"),
+            {
+                "account": self.account.pk,
+                "amount": amount,
+                "transaction_type": transaction_type,
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def process(self, *args):
+        out = io.StringIO()
+        call_command("process_outbox", "--once", *args, stdout=out)
+        return out.getvalue()
+
+    def test_postings_defer_derived_work_to_the_outbox(self):
+        self.post("10.00")
+        self.post("4.00", "debit")
+
+        self.assertFalse(BalanceHistory.objects.exists())
+        self.assertFalse(DailyBalanceRollup.objects.exists())
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list("topic", flat=True)),
+            ["balance_history"] * 3 + ["rollup"] * 2,
+        )
+        # The ledger is written with the transaction.
+        self.assertEqual(balances([self.account.pk])[self.account.pk], Decimal("6"))
+
+        self.assertIn("Processed 5 messages", self.process())
+        self.assertFalse(OutboxMessage.objects.exists())
+        history = BalanceHistory.objects.get(account=self.account)
+        self.assertEqual(history.balance, Decimal("6"))
+        for model in (DailyBalanceRollup, MonthlyBalanceRollup):
+            rollup = model.objects.get(account=self.account)
+            self.assertEqual(
+                (rollup.credits, rollup.debits, rollup.transaction_count),
+                (Decimal("10"), Decimal("4"), 2),
+            )
+            self.assertEqual(rollup.closing_balance, Decimal("6"))
+
+    def test_processing_invalidates_the_cache(self):
+        today = timezone.localdate().isoformat()
+        history_url = reverse("balance-account", args=[self.account.pk])
+        series = {"from": today, "to": today}
+        self.post("10.00")
+        self.assertEqual(self.client.get(history_url).data["results"], [])
+        self.assertEqual(
+            self.client.get(history_url, series).data[0]["balance"], "0.00"
+        )
+
+        self.process()
+
+        response = self.client.get(history_url)
+        self.assertEqual(response.data["results"][0]["balance"], "10.00")
+        response = self.client.get(history_url, series)
+        self.assertEqual(response.data[0]["balance"], "10.00")
+
+    def test_check_warns_of_a_per_process_cache(self):
+        self.assertEqual(
+            [warning.id for warning in check_outbox_cache(None)], ["account.W001"]
+        )
+        with override_settings(OUTBOX_EAGER=True):
+            self.assertEqual(check_outbox_cache(None), [])
+
+    def test_messages_of_a_batch_are_merged(self):
+        for amount in range(1, 6):
+            self.post(amount)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.process()
+        upserts = [query for query in queries if "ON CONFLICT" in query["sql"]]
+        # One balance history entry and one rollup row per period.
+        self.assertEqual(len(upserts), 3)
+        self.assertEqual(
+            DailyBalanceRollup.objects.get(account=self.account).transaction_count, 5
+        )
+        self.assertEqual(
+            BalanceHistory.objects.get(account=self.account).balance, Decimal("15")
+        )
+
+    def test_balances_delivered_out_of_order_do_not_roll_back(self):
+        now = timezone.now()
+        earlier, later = (
+            OutboxMessage(
+                account=self.account,
+                topic=OutboxMessage.Topic.BALANCE_HISTORY,
+                payload={"balance": balance},
+                created_at=moment,
+            )
+            for balance, moment in (
+                ("1.00", now - datetime.timedelta(seconds=1)),
+                ("2.00", now),
+            )
+        )
+        with override_settings(OUTBOX_EAGER=True):
+            outbox.enqueue([later])
+            outbox.enqueue([earlier])
+
+        self.assertEqual(
+            BalanceHistory.objects.get(account=self.account).balance, Decimal("2")
+        )
+
+    def test_failing_messages_are_retried_later(self):
+        self.post("10.00")
+
+        with mock.patch(
+            "apps.account.services.post_rollup_messages",
+            side_effect=ValueError("Rollup failed"),
+        ), self.assertLogs("apps.account.outbox", "ERROR"):
+            self.process()
+
+        self.assertEqual(
+            BalanceHistory.objects.get(account=self.account).balance, Decimal("10")
+        )
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.topic, OutboxMessage.Topic.ROLLUP)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn("Rollup failed", message.last_error)
+        self.assertGreater(message.available_at, timezone.now())
+
+        # Not due yet.
+        self.assertIn("Processed 0 messages", self.process())
+        message.available_at = timezone.now()
+        message.save()
+        self.process()
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(
+            DailyBalanceRollup.objects.get(account=self.account).credits,
+            Decimal("10"),
+        )
+
+    def test_eager_mode_writes_no_messages(self):
+        with override_settings(OUTBOX_EAGER=True):
+            self.post("10.00")
+
+        self.assertFalse(OutboxMessage.objects.filter(topic="rollup").exists())
+        self.assertEqual(
+            DailyBalanceRollup.objects.get(account=self.account).credits,
+            Decimal("10"),
+        )
+
+
+@override_settings(OUTBOX_EAGER=False)
+class OutboxPoolTestCase(TransactionTestCase):
+    def test_failing_batches_lock_messages_in_transactions(self):
+        user = get_user_model().objects.create_user(username="test", password="x")
+        account = Account.objects.create(owner=user)
+        Transaction.objects.create(account=account, amount=10, type="credit")
+
+        # Row locks as PostgreSQL takes them, which need a transaction.
+        with mock.patch.multiple(
+            connection.features,
+            has_select_for_update=True,
+            has_select_for_update_skip_locked=True,
+        ), mock.patch.object(
+            connection.ops, "for_update_sql", return_value=""
+        ), mock.patch(
+            "apps.account.services.post_rollup_messages",
+            side_effect=ValueError("Rollup failed"),
+        ), self.assertLogs(
+            "apps.account.outbox", "ERROR"
+        ):
+            self.assertEqual(outbox.process_batch("default", 10), 3)
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.topic, OutboxMessage.Topic.ROLLUP)
+        self.assertEqual(message.attempts, 1)
+
+    def test_workers_drain_the_outbox(self):
+        user = get_user_model().objects.create_user(username="test", password="x")
+        accounts = [Account.objects.create(owner=user) for _ in range(4)]
+        for account in accounts:
+            for amount in range(1, 4):
+                Transaction.objects.create(
+                    account=account, amount=amount, type="credit"
+                )
+
+        call_command(
+            "process_outbox",
+            "--once",
+            "--workers",
+            "3",
+            "--batch-size",
+            "5",
+            stdout=io.StringIO(),
+        )
+
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(
+            sorted(BalanceHistory.objects.values_list("balance", flat=True)),
+            [Decimal("6")] * 4,
+        )
+        self.assertEqual(
+            sorted(
+                DailyBalanceRollup.objects.values_list("transaction_count", flat=True)
+            ),
+            [3] * 4,
+        )
+
+
+class MoneyTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(owner=self.user)
+
+    def test_amounts_are_stored_as_integer_cents(self):
+        instance = Transaction.objects.create(
+            account=self.account, amount="12345678.91", type="credit"
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT amount FROM account_transaction WHERE id = %s", [instance.pk]
+            )
+            self.assertEqual(cursor.fetchone(), (1234567891,))
+        instance.refresh_from_db()
+        self.assertEqual(instance.amount, Decimal("12345678.91"))
+
+    def test_fractions_of_cents_are_not_stored(self):
+        with self.assertRaises(ValueError):
+            Transaction.objects.create(
+                account=self.account, amount="0.125", type="credit"
+            )
+
+    def test_lookups_compare_with_fractions_of_cents(self):
+        Transaction.objects.create(account=self.account, amount="0.07", type="credit")
+
+        self.assertTrue(Transaction.objects.filter(amount__gt="0.065").exists())
+        self.assertFalse(Transaction.objects.filter(amount__gt="0.075").exists())
+
+    def test_balances_beyond_ten_digits(self):
+        append_entries([(self.account.pk, Decimal("123456789012.34"), None)] * 2)
+
+        response = self.client.get(reverse("account-detail", args=[self.account.pk]))
+
+        self.assertEqual(response.data["current_balance"], "246913578024.68")
+        self.assertEqual(
+            balances([self.account.pk]),
+            {self.account.pk: Decimal("246913578024.68")},
+        )
+
+    def test_posting_large_amounts(self):
+        url = reverse("transaction-list")
+        response = self.client.post(
+            url,
+            {
+                "account": self.account.pk,
+                "amount": "1234567890123456.78",
+                "transaction_type": "credit",
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["amount"], "1234567890123456.78")
+        self.assertEqual(
+            Account.objects.get(pk=self.account.pk).current_balance,
+            Decimal("1234567890123456.78"),
+        )
+        response = self.client.post(
+            url,
+            {
+                "account": self.account.pk,
+                "amount": "12345678901234567.89",
+                "transaction_type": "credit",
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_statement_running_balance(self):
+        for amount, transaction_type in (("0.10", "credit"), ("0.20", "credit")):
+            Transaction.objects.create(
+                account=self.account, amount=amount, type=transaction_type
+            )
+        Transaction.objects.create(account=self.account, amount="0.05", type="debit")
+
+        response = self.client.get(
+            reverse("account-statement", args=[self.account.pk]), {"format": "ndjson"}
+        )
+
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(
+            [json.loads(line)["balance"] for line in content.splitlines()],
+            ["0.10", "0.30", "0.25"],
+        )
+
+    def test_running_totals(self):
+        cents = [10**15, -1, 2, -(10**15)]
+
+        self.assertEqual(running_totals(cents), [10**15, 10**15 - 1, 10**15 + 1, 1])
+        with mock.patch("apps.account.money.numpy", None):
+            self.assertEqual(running_totals(iter(cents)), running_totals(cents))
+        self.assertEqual(running_totals([]), [])
+
+    def test_field_deconstructs_without_defaults(self):
+        name, path, args, kwargs = MoneyField(default=0).deconstruct()
+
+        self.assertEqual(path, "apps.account.money.MoneyField")
+        self.assertEqual(kwargs, {"default": 0})
+
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.client.force_authenticate(self.user)
+        self.accounts = [Account.objects.create(owner=self.user) for _ in range(2)]
+        for account, date, amount, transaction_type, note in (
+            (0, "2020-01-01T08:00:00Z", "100", "credit", "Salary 2019"),
+            (0, "2020-03-02T09:30:00Z", "20.50", "debit", "Coffee, large"),
+            (1, "2020-06-15T12:00:00Z", "7.25", "credit", "Old refund"),
+            (0, "2021-01-01T08:00:00Z", "100", "credit", "Salary 2020"),
+            (1, "2021-02-20T12:00:00Z", "3", "debit", "Coffee beans"),
+            (0, "2021-03-01T08:00:00Z", "5", "debit", "Fee"),
+        ):
+            Transaction.objects.create(
+                account=self.accounts[account],
+                amount=amount,
+                type=transaction_type,
+                note=note,
+                date=date,
+            )
+        BalanceHistory.objects.all().delete()
+        for day, balance in (("2020-02-01", "100"), ("2021-02-01", "200")):
+            BalanceHistory.objects.create(
+                account=self.accounts[0], balance=balance, day=day
+            )
+        BalanceHistory.objects.filter(day="2020-02-01").update(
+            created_at="2020-02-01T12:00:00Z"
+        )
+        BalanceHistory.objects.filter(day="2021-02-01").update(
+            created_at="2021-02-01T12:00:00Z"
+        )
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command(
+            "archive_transactions", "--before", "2021-01-01", *args, stdout=out
+        )
+        return out.getvalue()
+
+    def get_all(self, url, **params):
+        """Return the results of every page of a list"""
+        results = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results += response.json()["results"]
+            url, params = response.json()["next"], {}
+        return results
+
+    def get_statement(self, **params):
+        response = self.client.get(
+            reverse("account-statement", args=[self.accounts[0].pk]), params
+        )
+        return b"".join(response.streaming_content).decode()
+
+    def test_archive_leaves_the_ledger_untouched(self):
+        entries = list(LedgerEntry.objects.order_by("pk").values())
+        archived = list(
+            Transaction.objects.filter(date__lt="2021-01-01").values_list(
+                "pk", flat=True
+            )
+        )
+
+        self.archive()
+
+        self.assertEqual(list(LedgerEntry.objects.order_by("pk").values()), entries)
+        self.assertEqual(
+            LedgerEntry.objects.filter(transaction_id__in=archived).count(),
+            2 * len(archived),
+        )
+
+    def test_archive_moves_old_rows_and_checkpoints_balance(self):
+        output = self.archive("--batch-size", "2")
+
+        self.assertIn("Archived 3 transactions and 1 balance history entries", output)
+        self.assertEqual(
+            sorted(ArchivedTransaction.objects.values_list("note", flat=True)),
+            ["Coffee, large", "Old refund", "Salary 2019"],
+        )
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(ArchivedBalanceHistory.objects.get().balance, Decimal(100))
+        self.assertEqual(
+            dict(ArchiveCutoff.objects.values_list("account_id", "balance")),
+            {
+                self.accounts[0].pk: Decimal("79.50"),
+                self.accounts[1].pk: Decimal("7.25"),
+            },
+        )
+        self.assertEqual(
+            ArchiveCutoff.objects.get(account=self.accounts[0]).cutoff,
+            datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+        )
+        # Balances come from the ledger, which is not archived.
+        self.assertEqual(self.accounts[0].current_balance, Decimal("174.50"))
+        out = io.StringIO()
+        call_command("reconcile_balances", "--workers", "1", stdout=out)
+        self.assertIn("found 0 mismatches", out.getvalue())
+
+    def test_archive_skips_rows_already_copied(self):
+        instance = Transaction.objects.get(note="Salary 2019")
+        copy_rows(
+            ArchivedTransaction, Transaction.objects.filter(pk=instance.pk), "default"
+        )
+
+        self.assertIn("Archived 3 transactions", self.archive())
+        self.assertEqual(ArchivedTransaction.objects.count(), 3)
+        self.assertEqual(
+            ArchiveCutoff.objects.get(account=self.accounts[0]).balance,
+            Decimal("79.50"),
+        )
+
+    def test_lists_merge_archived_rows(self):
+        transactions = self.get_all(reverse("transaction-list"))
+        history = self.get_all(reverse("balance-list"))
+        account_history = self.get_all(
+            reverse("balance-account", args=[self.accounts[0].pk])
+        )
+        self.archive()
+
+        for page_size in ("1", "2", "50"):
+            self.assertEqual(
+                self.get_all(reverse("transaction-list"), page_size=page_size),
+                transactions,
+            )
+            self.assertEqual(
+                self.get_all(reverse("balance-list"), page_size=page_size), history
+            )
+            self.assertEqual(
+                self.get_all(
+                    reverse("balance-account", args=[self.accounts[0].pk]),
+                    page_size=page_size,
+                ),
+                account_history,
+            )
+
+    def test_filters_apply_to_archived_rows(self):
+        self.archive()
+
+        notes = [
+            row["note"]
+            for row in self.get_all(
+                reverse("transaction-list"),
+                note="coffee",
+                account=self.accounts[0].pk,
+            )
+        ]
+        self.assertEqual(notes, ["Coffee, large"])
+        notes = [
+            row["note"]
+            for row in self.get_all(
+                reverse("transaction-list"), type="credit", to="2020-12-31"
+            )
+        ]
+        self.assertEqual(notes, ["Old refund", "Salary 2019"])
+
+    def test_recent_pages_do_not_read_the_archive(self):
+        self.archive()
+
+        for params in ({"page_size": "2"}, {"from": "2021-01-01"}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("transaction-list"), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(queries), 1, params)
+            self.assertNotIn("archivedtransaction", queries[0]["sql"])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_statement(format="csv", **{"from": "2021-01-01"})
+        self.assertFalse(
+            any("archivedtransaction" in query["sql"] for query in queries)
+        )
+
+    def test_statement_merges_archived_rows(self):
+        statement = self.get_statement(format="csv")
+        self.archive()
+
+        self.assertEqual(self.get_statement(format="csv"), statement)
+        self.assertEqual(
+            self.get_statement(format="csv", **{"from": "2020-03-01"}).splitlines()[1:],
+            statement.splitlines()[2:],
+        )
+
+    def test_balance_history_date_reads_the_archive(self):
+        self.archive()
+
+        response = self.client.get(
+            reverse("balance-account-date", args=[self.accounts[0].pk, "2020-06-01"])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["balance"], "100.00")
+
+    def test_rebuilds_count_archived_transactions(self):
+        self.archive()
+        BalanceHistory.objects.create(account=self.accounts[0], balance=0)
+
+        out = io.StringIO()
+        call_command("rebuild_balance_rollups", stdout=out)
+        self.assertEqual(
+            list(
+                MonthlyBalanceRollup.objects.filter(
+                    account=self.accounts[0]
+                ).values_list("period_start", "closing_balance")
+            ),
+            [
+                (datetime.date(2020, 1, 1), Decimal("100.00")),
+                (datetime.date(2020, 3, 1), Decimal("79.50")),
+                (datetime.date(2021, 1, 1), Decimal("179.50")),
+                (datetime.date(2021, 3, 1), Decimal("174.50")),
+            ],
+        )
+        call_command("rebuild_balance_rollups", "--from", "2021-03-01", stdout=out)
+        self.assertEqual(
+            MonthlyBalanceRollup.objects.get(
+                account=self.accounts[0], period_start="2021-03-01"
+            ).opening_balance,
+            Decimal("179.50"),
+        )
+
+        rebuild_balance_history(self.accounts[0].pk)
+        self.assertEqual(
+            BalanceHistory.objects.get(
+                account=self.accounts[0], day=timezone.localdate()
+            ).balance,
+            Decimal("174.50"),
+        )
+
+    def test_deleting_an_account_deletes_its_archived_rows(self):
+        self.archive()
+
+        self.accounts[0].delete()
+
+        self.assertEqual(
+            list(ArchivedTransaction.objects.values_list("note", flat=True)),
+            ["Old refund"],
+        )
+        self.assertFalse(ArchivedBalanceHistory.objects.exists())
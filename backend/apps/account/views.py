@@ -1,80 +1,332 @@
-from django.db import transaction
+import datetime
+
+from django.db import router, transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from rest_framework import viewsets, serializers, mixins
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, serializers, mixins, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Account, Transaction, BalanceHistory
+from core.replicas import ReplicaReadMixin
+from core.sharding import ShardRoutingMixin
+
+from .archive import ArchiveListMixin, archive_cutoffs
+from .cache import cached_response
+from .filters import TransactionFilter, parse_date_range
+from .idempotency import idempotent
+from .ledger import balance_at, balance_expression
+from .models import (
+    Account,
+    ArchivedBalanceHistory,
+    ArchivedTransaction,
+    BalanceHistory,
+    DailyBalanceRollup,
+    MonthlyBalanceRollup,
+    Transaction,
+)
+from .pagination import KeysetPagination
+from .representation import RowListMixin
 from .serializers import (
+    AccountBalanceSerializer,
     AccountSerializer,
     BalanceHistorySerializer,
+    BalanceRollupSerializer,
     TransactionSerializer,
 )
+from .services import balance_series, day_start, post_transactions, run_with_retry
+from .statements import (
+    StatementCSVRenderer,
+    StatementNDJSONRenderer,
+    stream_statement,
+)
+
+# Largest number of rows accepted by a single bulk transaction request.
+BULK_TRANSACTION_LIMIT = 5000
+
+BALANCE_SERIES_GRANULARITIES = ("day", "week", "month")
 
+BALANCE_ROLLUP_MODELS = {"day": DailyBalanceRollup, "month": MonthlyBalanceRollup}
 
-class AccountViewSet(viewsets.ModelViewSet):
+# Longest date range accepted by a balance series request.
+MAX_BALANCE_SERIES_DAYS = 3660
+
+
+class AccountViewSet(
+    ShardRoutingMixin, ReplicaReadMixin, RowListMixin, viewsets.ModelViewSet
+):
 
     permission_classes = (IsAuthenticated,)
     serializer_class = AccountSerializer
     queryset = Account.objects.all()
+    pagination_class = KeysetPagination
+    pagination_ordering = ("number",)
+
+    @cached_response()
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response(account_kwarg="pk")
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-    @transaction.atomic
     def perform_create(self, serializer):
         """The logged in user is always the owner"""
-        return serializer.save(owner=self.request.user)
+        with transaction.atomic(using=router.db_for_write(Account)):
+            return serializer.save(owner_id=self.request.user.pk)
+
+    @action(
+        detail=True,
+        methods=["GET"],
+        renderer_classes=(StatementCSVRenderer, StatementNDJSONRenderer),
+    )
+    def statement(self, request, pk):
+        """
+        Stream the transactions of an account between the optional from and to
+        dates, with a running balance, as CSV or NDJSON (?format=csv|ndjson).
+        """
+        account = self.get_object()
+        try:
+            start, end = (
+                (
+                    datetime.date.fromisoformat(request.query_params[name])
+                    if request.query_params.get(name)
+                    else None
+                )
+                for name in ("from", "to")
+            )
+        except ValueError:
+            raise serializers.ValidationError("Dates must be formatted as YYYY-MM-DD")
+
+        format = request.accepted_renderer.format
+        response = StreamingHttpResponse(
+            stream_statement(account.pk, start, end, format),
+            content_type=request.accepted_renderer.media_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="statement-{account.pk}.{format}"'
+        )
+        return response
+
+    @action(detail=True, methods=["GET"])
+    def balance(self, request, pk):
+        """
+        Get the balance of an account, or with ``as_of`` (an ISO 8601 date
+        and time) its balance at that moment, from the ledger.
+        """
+        account = self.get_object()
+        if "as_of" not in request.query_params:
+            return Response(
+                AccountBalanceSerializer(
+                    {"ID": account.pk, "balance": account.current_balance}
+                ).data
+            )
+
+        as_of = parse_datetime(request.query_params["as_of"])
+        if as_of is None:
+            raise serializers.ValidationError("as_of must be an ISO 8601 date and time")
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+        return Response(
+            AccountBalanceSerializer(
+                {
+                    "ID": account.pk,
+                    "balance": balance_at(account.pk, as_of),
+                    "as_of": as_of,
+                }
+            ).data
+        )
 
     def get_queryset(self):
         """Limit the queryset to the owner, i.e the logged in user, for fetching/updating data"""
-        return self.queryset.filter(owner=self.request.user)
+        return (
+            self.queryset.filter(owner_id=self.request.user.pk)
+            .only("number", "owner")
+            .annotate(current_balance=balance_expression())
+        )
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(
+    ShardRoutingMixin,
+    ReplicaReadMixin,
+    ArchiveListMixin,
+    RowListMixin,
+    viewsets.ModelViewSet,
+):
 
     permission_classes = (IsAuthenticated,)
     serializer_class = TransactionSerializer
     queryset = Transaction.objects.all()
+    pagination_class = KeysetPagination
+    pagination_ordering = ("-date", "-id")
+    filter_backends = (TransactionFilter,)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
-    @transaction.atomic
     def perform_create(self, serializer):
         """The logged in user always needs to be the account owner"""
         try:
-            return serializer.save(
-                account=Account.objects.get(
-                    owner=self.request.user, number=str(self.request.data["account"])
-                )
+            account = Account.objects.get(
+                owner_id=self.request.user.pk, number=str(self.request.data["account"])
             )
         except Account.DoesNotExist:
             raise serializers.ValidationError("Account does not exist")
+        return run_with_retry(serializer.save, account=account)
+
+    @action(detail=False, methods=["POST"])
+    @idempotent
+    def bulk(self, request):
+        """Create many transactions at once, reporting invalid rows individually"""
+        if not isinstance(request.data, list) or not request.data:
+            raise serializers.ValidationError(
+                "Expected a non-empty list of transactions"
+            )
+        if len(request.data) > BULK_TRANSACTION_LIMIT:
+            raise serializers.ValidationError(
+                f"A batch may contain at most {BULK_TRANSACTION_LIMIT} transactions"
+            )
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        numbers = [
+            str(item.get("account")) if isinstance(item, dict) else None
+            for item in request.data
+        ]
+        accounts = {
+            str(account.number): account
+            for account in Account.objects.filter(
+                owner_id=self.request.user.pk,
+                number__in={
+                    number for number in numbers if number and number.isdigit()
+                },
+            )
+        }
+
+        transactions, errors = [], []
+        for index, (number, row, row_errors) in enumerate(
+            zip(numbers, serializer.validated_data, serializer.row_errors)
+        ):
+            account = accounts.get(number)
+            if row_errors:
+                errors.append({"index": index, "errors": row_errors})
+            elif account is None:
+                errors.append({"index": index, "errors": ["Account does not exist"]})
+            else:
+                transactions.append(Transaction(account=account, **row))
+
+        if transactions:
+            transactions = run_with_retry(post_transactions, transactions)
+        return Response(
+            {
+                "created": self.get_serializer(transactions, many=True).data,
+                "errors": errors,
+            },
+            status=(
+                status.HTTP_201_CREATED if transactions else status.HTTP_400_BAD_REQUEST
+            ),
+        )
 
     def get_queryset(self):
         """Limit the queryset to the owner, i.e the logged in user, for fetching/updating data"""
-        return self.queryset.filter(account__owner=self.request.user)
+        return self.queryset.filter(account__owner_id=self.request.user.pk).only(
+            "id", "date", "type", "note", "amount", "account"
+        )
+
+    def paginate_queryset(self, queryset):
+        """Page through the archived transactions too when the page needs them"""
+        accounts = Account.objects.filter(owner_id=self.request.user.pk)
+        if self.request.query_params.get("account"):
+            accounts = accounts.filter(number=self.request.query_params["account"])
+        start, end = parse_date_range(self.request.query_params)
+        return self.paginate_archived(
+            queryset,
+            accounts,
+            lambda account_ids: self.get_rows(
+                self.filter_queryset(
+                    ArchivedTransaction.objects.filter(account_id__in=account_ids)
+                )
+            ),
+            start=start,
+        )
 
 
 class BalanceHistoryViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+    ShardRoutingMixin,
+    ReplicaReadMixin,
+    ArchiveListMixin,
+    RowListMixin,
+    mixins.RetrieveModelMixin,
+    mixins.ListModelMixin,
+    viewsets.GenericViewSet,
 ):
 
     permission_classes = (IsAuthenticated,)
     serializer_class = BalanceHistorySerializer
     queryset = BalanceHistory.objects.all()
+    pagination_class = KeysetPagination
+    pagination_ordering = ("-created_at", "-id")
 
     def get_queryset(self):
         """Limit the queryset to the owner, i.e the logged in user, for fetching/updating data"""
-        return self.queryset.filter(account__owner=self.request.user)
+        return self.queryset.filter(account__owner_id=self.request.user.pk).only(
+            "created_at", "balance", "account"
+        )
+
+    def paginate_queryset(self, queryset):
+        """Page through the archived entries too when the page needs them"""
+        return self.paginate_archived(
+            queryset,
+            Account.objects.filter(owner_id=self.request.user.pk),
+            lambda account_ids: self.get_rows(
+                ArchivedBalanceHistory.objects.filter(account_id__in=account_ids)
+            ),
+        )
+
+    @cached_response()
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(detail=False, methods=["GET"], url_path="account/(?P<account_id>[0-9]+)")
+    @cached_response(account_kwarg="account_id")
     def account(self, request, account_id):
-        """Get the balance history for a specific account"""
-        try:
-            account = Account.objects.get(
-                owner=self.request.user, number=str(account_id)
-            )
-        except Account.DoesNotExist:
+        """
+        Get the balance history for a specific account.
+
+        With ``from``/``to`` dates, return the balance as of the end of every
+        ``granularity`` (day, week or month) bucket in that range instead.
+        """
+        if not Account.objects.filter(
+            owner_id=self.request.user.pk, number=str(account_id)
+        ).exists():
             raise serializers.ValidationError("Account does not exist")
-        return Response(
-            BalanceHistorySerializer(account.balancehistory_set.all(), many=True).data
+
+        if "from" in request.query_params or "to" in request.query_params:
+            return Response(
+                BalanceHistorySerializer(
+                    balance_series(account_id, *self.get_series_range(request)),
+                    many=True,
+                ).data
+            )
+
+        page = self.paginate_archived(
+            BalanceHistory.objects.filter(account_id=account_id).only(
+                "created_at", "balance", "account"
+            ),
+            [account_id],
+            lambda account_ids: ArchivedBalanceHistory.objects.filter(
+                account_id__in=account_ids
+            ),
+        )
+        return self.get_paginated_response(
+            BalanceHistorySerializer(page, many=True).data
         )
 
     @action(
@@ -82,22 +334,90 @@ class BalanceHistoryViewSet(
         methods=["GET"],
         url_path="account/(?P<account_id>[0-9]+)/(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})",
     )
+    @cached_response(account_kwarg="account_id")
     def account_date(self, request, account_id, date):
         """Get the balance history for a specific account on a specific date, filtered by created_at"""
+        if not Account.objects.filter(
+            owner_id=self.request.user.pk, number=str(account_id)
+        ).exists():
+            raise serializers.ValidationError("Account does not exist")
+
         try:
-            account = Account.objects.get(
-                owner=self.request.user, number=str(account_id)
+            date = datetime.date.fromisoformat(date)
+        except ValueError:
+            raise serializers.ValidationError("Invalid date")
+
+        end = day_start(date + datetime.timedelta(days=1))
+        balance_history = (
+            BalanceHistory.objects.filter(account_id=account_id, created_at__lt=end)
+            .only("created_at", "balance", "account")
+            .order_by("-created_at")
+            .first()
+        )
+        if balance_history is None and archive_cutoffs([account_id]):
+            # Entries older than the archive cutoff were moved to the archive.
+            balance_history = (
+                ArchivedBalanceHistory.objects.filter(
+                    account_id=account_id, created_at__lt=end
+                )
+                .order_by("-created_at")
+                .first()
             )
-        except Account.DoesNotExist:
+        if balance_history is None:
+            raise serializers.ValidationError("No balance history found for this date")
+        return Response(BalanceHistorySerializer(balance_history).data)
+
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="account/(?P<account_id>[0-9]+)/rollups",
+    )
+    @cached_response(account_kwarg="account_id")
+    def rollups(self, request, account_id):
+        """
+        Get the daily or monthly balance rollups of a specific account between
+        the from and to dates.
+        """
+        if not Account.objects.filter(
+            owner_id=self.request.user.pk, number=str(account_id)
+        ).exists():
             raise serializers.ValidationError("Account does not exist")
 
-        date = timezone.datetime.strptime(f"{date} 23:59:59", "%Y-%m-%d %H:%M:%S")
-        date = timezone.make_aware(date, timezone.get_current_timezone())
+        start, end, granularity = self.get_series_range(request)
+        if granularity not in BALANCE_ROLLUP_MODELS:
+            raise serializers.ValidationError(
+                "Granularity must be one of: " + ", ".join(BALANCE_ROLLUP_MODELS)
+            )
+        model = BALANCE_ROLLUP_MODELS[granularity]
+        return Response(
+            BalanceRollupSerializer(
+                model.objects.filter(
+                    account_id=account_id,
+                    period_start__range=(model.period_for(start), end),
+                ),
+                many=True,
+            ).data
+        )
+
+    def get_series_range(self, request):
+        """Parse the from/to/granularity query parameters of a balance series"""
         try:
-            return Response(
-                BalanceHistorySerializer(
-                    account.balancehistory_set.filter(created_at__lte=date), many=True
-                ).data[0]
+            start = datetime.date.fromisoformat(request.query_params["from"])
+            end = datetime.date.fromisoformat(request.query_params["to"])
+        except KeyError:
+            raise serializers.ValidationError("Both from and to dates are required")
+        except ValueError:
+            raise serializers.ValidationError("Dates must be formatted as YYYY-MM-DD")
+
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in BALANCE_SERIES_GRANULARITIES:
+            raise serializers.ValidationError(
+                "Granularity must be one of: " + ", ".join(BALANCE_SERIES_GRANULARITIES)
             )
-        except IndexError:
-            raise serializers.ValidationError("No balance history found for this date")
+        if start > end:
+            raise serializers.ValidationError("The from date must not be after to")
+        if (end - start).days >= MAX_BALANCE_SERIES_DAYS:
+            raise serializers.ValidationError(
+                f"A balance series may span at most {MAX_BALANCE_SERIES_DAYS} days"
+            )
+        return start, end, granularity
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+# Claim holding the token version of the user when the token was issued.
+TOKEN_VERSION_CLAIM = "ver"
+
+# User fields copied into the tokens, so they can be read without a query.
+USER_CLAIMS = ("username", "is_staff", "is_superuser")
+
+KEY_PREFIX = "user-token"
+
+
+class TTLCache:
+    """
+    Thread safe, in-process LRU cache whose entries expire ``timeout`` seconds
+    after they were stored.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                expires, value = self.entries[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_rows = TTLCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def get_user_row(user_id):
+    """Return the user row of an id, from the in-process cache when fresh."""
+
+    key = str(user_id)
+    user = user_rows.get(key)
+    if user is None:
+        user = get_user_model().objects.get(pk=user_id)
+        user_rows.set(key, user)
+    return user
+
+
+def get_token_state_cache():
+    return caches[settings.AUTH_TOKEN_STATE_CACHE]
+
+
+def token_state_key(user_id):
+    return f"{KEY_PREFIX}:state:{user_id}"
+
+
+def store_token_state(user):
+    get_token_state_cache().set(
+        token_state_key(user.pk),
+        (user.token_version, user.is_active),
+        settings.AUTH_TOKEN_STATE_TIMEOUT,
+    )
+
+
+def remember_token_state(user):
+    """
+    Store the token version and active flag of a user in the shared cache and
+    drop their in-process row.
+
+    The state is stored again once the surrounding transaction commits, so a
+    concurrent read of the old row cannot overwrite it for long.
+    """
+
+    store_token_state(user)
+    user_rows.delete(str(user.pk))
+    transaction.on_commit(lambda: store_token_state(user))
+
+
+def get_token_state(user_id):
+    """
+    Return the (token version, is active) of a user, or None when the user
+    does not exist.
+    """
+
+    cache = get_token_state_cache()
+    key = token_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = (
+            get_user_model()
+            .objects.filter(pk=user_id)
+            .values_list("token_version", "is_active")
+            .first()
+        )
+        if state is None:
+            return None
+        cache.set(key, tuple(state), settings.AUTH_TOKEN_STATE_TIMEOUT)
+    return tuple(state)
+
+
+def check_token_state(token):
+    """
+    Raise when the user of a token no longer exists, is inactive or revoked
+    their tokens after it was issued.
+    """
+
+    try:
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    state = get_token_state(user_id)
+    if state is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    version, is_active = state
+    if not is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    if token.get(TOKEN_VERSION_CLAIM, 0) != version:
+        raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+    return user_id
+
+
+class ClaimsUser(TokenUser):
+    """
+    User built from the claims of a validated token.
+
+    Its id, username and staff flags come from the token. Any other attribute
+    is read from the user row, fetched at most once per
+    ``AUTH_USER_CACHE_TIMEOUT`` per process.
+    """
+
+    @property
+    def user(self):
+        return get_user_row(self.pk)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "token":
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def has_perm(self, perm, obj=None):
+        return self.user.has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return self.user.has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return self.user.has_module_perms(module)
+
+    def get_all_permissions(self, obj=None):
+        return self.user.get_all_permissions(obj)
+
+    @property
+    def groups(self):
+        return self.user.groups
+
+    @property
+    def user_permissions(self):
+        return self.user.user_permissions
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the signed claims of the token instead of
+    loading the user row on every request.
+
+    Only the token version and active flag of the user are checked, against a
+    cached per-user state, so revoked tokens and deactivated users are still
+    refused.
+    """
+
+    def get_user(self, validated_token):
+        check_token_state(validated_token)
+        return ClaimsUser(validated_token)
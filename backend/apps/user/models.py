@@ -2,7 +2,52 @@ from uuid import uuid4
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid4)
+    # Bumped to revoke every token issued to the user so far.
+    token_version = models.PositiveIntegerField(default=0)
+
+    def revoke_tokens(self):
+        """Invalidate every access and refresh token issued to the user"""
+        User.objects.filter(pk=self.pk).update(token_version=F("token_version") + 1)
+        self.refresh_from_db(fields=["token_version"])
+
+        from .authentication import remember_token_state
+
+        remember_token_state(self)
+
+
+class ShardAssignment(models.Model):
+    """
+    Shard holding the accounts of a user. Kept on the primary database.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    alias = models.CharField(max_length=100)
+    # Set while the rebalancing copies the user to another shard.
+    moving = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+@receiver(post_save, sender=User)
+def refresh_token_state(sender, instance, **kwargs):
+    """
+    Keep the cached token state in sync, so deactivating a user takes effect
+    on their tokens right away
+    """
+    from .authentication import remember_token_state
+
+    remember_token_state(instance)
+
+
+@receiver(post_delete, sender=User)
+def forget_token_state(sender, instance, **kwargs):
+    from .authentication import get_token_state_cache, token_state_key, user_rows
+
+    get_token_state_cache().delete(token_state_key(instance.pk))
+    user_rows.delete(str(instance.pk))
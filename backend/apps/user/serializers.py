@@ -1,8 +1,13 @@
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
 from django.contrib.auth import get_user_model
 
+from core.metrics import TimedSerializerMixin
 
-class UserSerializer(serializers.ModelSerializer):
+from .authentication import TOKEN_VERSION_CLAIM, USER_CLAIMS, check_token_state
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     password = serializers.CharField(write_only=True, required=True)
 
@@ -30,3 +35,21 @@ class UserSerializer(serializers.ModelSerializer):
         user.set_password(validated_data["password"])
         user.save()
         return user
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        """Sign the user fields read by the claims based authentication"""
+        token = super().get_token(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    def validate(self, attrs):
+        """Refuse refresh tokens that were revoked"""
+        check_token_state(self.token_class(attrs["refresh"]))
+        return super().validate(attrs)
@@ -1,3 +1,130 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from apps.account.models import Account, Transaction
+
+from .authentication import ClaimsUser, user_rows
+
+
+class ClaimsAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user_rows.clear()
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@example.com", password="Test123!"
+        )
+        response = self.client.post(
+            reverse("token_obtain_pair"),
+            {"username": "testuser", "password": "Test123!"},
+        )
+        self.tokens = response.data
+
+    def authenticate(self, token=None):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {token or self.tokens['access']}"
+        )
+
+    def test_requests_skip_user_query(self):
+        # An empty transaction list also looks up the archive cutoff.
+        account = Account.objects.create(owner=self.user)
+        Transaction.objects.create(account=account, amount=1, type="credit")
+        self.authenticate()
+        self.client.get(reverse("account-list"))
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse("transaction-list"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(captured), 1)
+        self.assertNotIn('"user_user"', captured[0]["sql"])
+
+    def test_user_is_built_from_claims(self):
+        self.authenticate()
+        response = self.client.get(reverse("user-list"))
+        user = response.wsgi_request.user
+
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.pk, str(self.user.pk))
+        self.assertEqual(user.username, "testuser")
+        self.assertFalse(user.is_staff)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(user.email, "test@example.com")
+            self.assertEqual(user.first_name, "")
+        self.assertEqual(len(captured), 1)
+
+    def test_revoked_tokens_are_refused(self):
+        self.authenticate()
+        response = self.client.post(
+            reverse("user-revoke-tokens", kwargs={"pk": self.user.pk})
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials()
+        response = self.client.post(
+            reverse("token_refresh"), {"refresh": self.tokens["refresh"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(
+            reverse("token_obtain_pair"),
+            {"username": "testuser", "password": "Test123!"},
+        )
+        self.authenticate(response.data["access"])
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_users_cannot_revoke_the_tokens_of_others(self):
+        other = get_user_model().objects.create_user(
+            username="other", password="Test123!"
+        )
+        tokens = self.client.post(
+            reverse("token_obtain_pair"), {"username": "other", "password": "Test123!"}
+        ).data
+        self.authenticate()
+
+        response = self.client.post(
+            reverse("user-revoke-tokens", kwargs={"pk": other.pk})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.authenticate(tokens["access"])
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_staff_can_revoke_the_tokens_of_others(self):
+        get_user_model().objects.create_user(
+            username="admin", password="Test123!", is_staff=True
+        )
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "admin", "password": "Test123!"}
+        )
+        self.authenticate(response.data["access"])
+
+        response = self.client.post(
+            reverse("user-revoke-tokens", kwargs={"pk": self.user.pk})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.authenticate()
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_users_are_refused(self):
+        self.authenticate()
+        self.assertEqual(
+            self.client.get(reverse("account-list")).status_code, status.HTTP_200_OK
+        )
+
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
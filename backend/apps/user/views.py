@@ -1,9 +1,10 @@
-import imp
 from uuid import uuid4
 
 from django.contrib.auth import get_user_model
-from rest_framework import viewsets
+from rest_framework import exceptions, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
 from .serializers import UserSerializer
 
@@ -17,3 +18,15 @@ class UserViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Generate a random UUID for the user"""
         return serializer.save(id=uuid4())
+
+    @action(detail=True, methods=["POST"])
+    def revoke_tokens(self, request, pk):
+        """
+        Invalidate every token issued to the user so far. Only the user
+        themselves and staff may.
+        """
+        user = self.get_object()
+        if str(user.pk) != str(request.user.pk) and not request.user.is_staff:
+            raise exceptions.PermissionDenied()
+        user.revoke_tokens()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,25 @@
+from django.conf import settings
+
+
+class ArchiveRouter:
+    """
+    Route the models of ``ARCHIVE_MODELS`` to ``ARCHIVE_DATABASE`` when one
+    is configured.
+
+    Otherwise the archive tables live next to the hot ones, and the other
+    routers decide, e.g. to place them on the shard of the current user.
+    """
+
+    def archive(self, model):
+        if (
+            settings.ARCHIVE_DATABASE
+            and model._meta.label_lower in settings.ARCHIVE_MODELS
+        ):
+            return settings.ARCHIVE_DATABASE
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.archive(model)
+
+    def db_for_write(self, model, **hints):
+        return self.archive(model)
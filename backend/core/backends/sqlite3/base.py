@@ -0,0 +1,41 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend applying a tuning profile to every new connection.
+
+    Two extra ``OPTIONS`` are understood besides the ``sqlite3.connect``
+    arguments (such as ``timeout``, the busy timeout in seconds):
+
+    - ``pragmas``: a mapping of PRAGMA names to values, run in order on
+      connect, e.g. ``{"journal_mode": "wal", "synchronous": "normal"}``.
+    - ``transaction_mode``: ``DEFERRED``, ``IMMEDIATE`` or ``EXCLUSIVE``,
+      used to begin atomic blocks. ``IMMEDIATE`` takes the write lock up
+      front, so a transaction that reads before it writes waits on the busy
+      timeout instead of failing with "database is locked" when it upgrades
+      its lock.
+    """
+
+    TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pragmas", None)
+        params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict["OPTIONS"].get("pragmas", {})
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        if mode.upper() not in self.TRANSACTION_MODES:
+            raise ValueError(f"Invalid SQLite transaction mode: {mode}")
+        self.cursor().execute(f"BEGIN {mode.upper()}")
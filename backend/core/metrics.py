@@ -0,0 +1,325 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the request being handled, if it is being measured.
+current_request = contextvars.ContextVar("current_request_metrics", default=None)
+
+# Upper bounds of the histogram buckets, in seconds and in queries.
+DURATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    """
+    In-process histogram of observations per set of label values, exposed in
+    the Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Count per bucket, including +Inf, and the sum.
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def collect(self):
+        with self.lock:
+            series = {
+                key: (list(counts), total)
+                for key, (counts, total) in self.series.items()
+            }
+
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = format_labels(labels + [("le", bound)])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{format_labels(labels)} {total}"
+            yield f"{self.name}_count{format_labels(labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        return "".join(
+            f"{line}\n" for metric in self.metrics for line in metric.collect()
+        )
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Wall time of the requests.",
+    ("view", "method", "status"),
+)
+REQUEST_QUERIES = REGISTRY.histogram(
+    "http_request_db_queries",
+    "Database queries run by the requests.",
+    ("view", "method"),
+    buckets=QUERY_BUCKETS,
+)
+REQUEST_DB_DURATION = REGISTRY.histogram(
+    "http_request_db_duration_seconds",
+    "Time the requests spent in database queries.",
+    ("view", "method"),
+)
+REQUEST_PHASE_DURATION = REGISTRY.histogram(
+    "http_request_phase_duration_seconds",
+    "Time the requests spent in serialization and signal handlers.",
+    ("view", "method", "phase"),
+)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        # Seconds spent per phase, and how deep each phase is nested.
+        self.phases = {}
+        self.depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+@contextlib.contextmanager
+def track(phase):
+    """
+    Add the time spent in the block to ``phase`` of the current request.
+    Nested blocks of the same phase are only counted once.
+    """
+
+    metrics = current_request.get()
+    if metrics is None or metrics.depth.get(phase):
+        yield
+        return
+    metrics.depth[phase] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[phase] = (
+            metrics.phases.get(phase, 0.0) + time.perf_counter() - started
+        )
+        metrics.depth[phase] = 0
+
+
+def timed_receiver(func):
+    """Track the time spent in a signal receiver as a ``signal:<name>`` phase"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with track(f"signal:{func.__name__}"):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class TimedSerializerMixin:
+    """Track the time serializers spend representing data as serialization"""
+
+    def to_representation(self, instance):
+        with track("serialization"):
+            return super().to_representation(instance)
+
+
+def record_query(execute, sql, params, many, context):
+    """Add a query to the metrics of the request being measured, if any"""
+
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def measure_queries(**kwargs):
+    """
+    Install ``record_query`` on the database connections of the thread
+    handling a request, once. Under ASGI that is Django's thread for sync
+    code, where the sync views and ``sync_to_async`` calls run.
+    """
+
+    for connection in connections.all():
+        if record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(record_query)
+
+
+request_started.connect(measure_queries)
+
+
+class MetricsMiddleware:
+    """
+    Measure the wall time, database queries and time, serialization time and
+    signal handler time of every request, aggregated per view into the
+    histograms served by ``metrics_view``.
+
+    Requests slower than ``SLOW_REQUEST_SECONDS`` are logged with their
+    breakdown. Histograms are kept per process.
+
+    The middleware runs natively under both WSGI and ASGI: a sync-only
+    middleware would run every ASGI request on Django's single thread for
+    sync code.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin
+            # does, so that the handler awaits it.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        # Render DRF responses here, so rendering counts as serialization.
+        with track("serialization"):
+            response.render()
+        return response
+
+    def record(self, request, response, metrics, duration):
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        method = request.method
+
+        REQUEST_DURATION.observe(
+            duration, view=view, method=method, status=response.status_code
+        )
+        REQUEST_QUERIES.observe(metrics.queries, view=view, method=method)
+        REQUEST_DB_DURATION.observe(metrics.db_time, view=view, method=method)
+        for phase, seconds in metrics.phases.items():
+            REQUEST_PHASE_DURATION.observe(
+                seconds, view=view, method=method, phase=phase
+            )
+
+        if duration >= settings.SLOW_REQUEST_SECONDS:
+            phases = ", ".join(
+                f"{phase} {seconds * 1000:.1f}ms"
+                for phase, seconds in sorted(metrics.phases.items())
+            )
+            logger.warning(
+                "Slow request %s %s (%s) %s in %.1fms: %d queries in %.1fms%s",
+                method,
+                request.path,
+                view,
+                response.status_code,
+                duration * 1000,
+                metrics.queries,
+                metrics.db_time * 1000,
+                f", {phases}" if phases else "",
+            )
+
+
+def metrics_view(request):
+    """
+    Serve the request histograms in the Prometheus text format, to scrapers
+    presenting ``METRICS_TOKEN`` as a bearer token when it is set.
+    """
+
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
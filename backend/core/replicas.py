@@ -0,0 +1,76 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+
+# Set while a view that may read from the replicas handles a request.
+replica_reads = contextvars.ContextVar("replica_reads", default=False)
+
+KEY_PREFIX = "replica-sticky"
+
+
+def stick_to_primary(user_id):
+    """Send the reads of a user to the primary for the stickiness window"""
+    cache.set(f"{KEY_PREFIX}:{user_id}", True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user_id):
+    return cache.get(f"{KEY_PREFIX}:{user_id}", False)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a random replica in ``DATABASE_REPLICAS`` while a replica
+    read is allowed, and leave everything else to the instance hints and the
+    primary.
+
+    Reads are only allowed on replicas inside views using
+    ``ReplicaReadMixin``, and never inside an atomic block of the primary, so
+    a transaction always sees its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not replica_reads.get():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Let the safe requests of a view read from the replicas.
+
+    A user whose write succeeded keeps reading from the primary for
+    ``REPLICA_STICKY_SECONDS``, so they see their own writes despite the
+    replication lag. Authentication always reads from the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_sticky(request.user.pk):
+            self.replica_token = replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "replica_token", None)
+        if token is not None:
+            replica_reads.reset(token)
+            self.replica_token = None
+        if (
+            request.method not in SAFE_METHODS
+            and status.is_success(response.status_code)
+            and request.user.is_authenticated
+        ):
+            stick_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
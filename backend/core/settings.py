@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -55,12 +56,18 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "apps.user.authentication.ClaimsJWTAuthentication",
     ),
     # 'COERCE_DECIMAL_TO_STRING': False,
 }
 
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "apps.user.serializers.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "apps.user.serializers.TokenRefreshSerializer",
+}
+
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -72,6 +79,12 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
 ]
 
+# Requests slower than this many seconds are logged with their breakdown.
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 1))
+
+# Bearer token required to read /metrics, which is open when it is empty.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",
 ]
@@ -96,17 +109,152 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "core.wsgi.application"
 
+TEST_RUNNER = "core.test_runner.TestRunner"
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# The SQLite profile is tuned for concurrent writers: WAL journaling lets
+# readers run alongside the writer, transactions take the write lock up front
+# and wait up to the busy timeout for it, and connections are kept open
+# between requests. Every knob can be set from the environment.
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "ENGINE": "core.backends.sqlite3",
+        "NAME": os.environ.get("DATABASE_NAME", BASE_DIR / "db.sqlite3"),
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 600)),
+        "OPTIONS": {
+            # Seconds a connection waits for a lock before failing.
+            "timeout": float(os.environ.get("SQLITE_BUSY_TIMEOUT", 20)),
+            "transaction_mode": os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+            "pragmas": {
+                "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "wal"),
+                "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "normal"),
+                # Bytes of the database file memory mapped.
+                "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024**2)),
+                # Negative values are in KiB rather than pages.
+                "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),
+                "temp_store": os.environ.get("SQLITE_TEMP_STORE", "memory"),
+            },
+        },
     }
 }
 
+# Read replicas, as a comma separated list of SQLite files kept in sync with
+# the primary. Safe requests of the account API read from a random replica,
+# except for users who wrote in the last REPLICA_STICKY_SECONDS.
+
+DATABASE_REPLICAS = []
+for index, name in enumerate(
+    filter(None, os.environ.get("DATABASE_REPLICAS", "").split(",")), start=1
+):
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "NAME": name,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{index}")
+
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+# Shards of the account data, as a comma separated list of SQLite files. The
+# accounts, transactions and balances of a user live on one shard, picked by
+# a consistent hash ring of the user id and recorded in the shard directory
+# on the primary. Entries of the directory are cached for
+# SHARD_DIRECTORY_TIMEOUT seconds.
+
+ACCOUNT_SHARDS = []
+for index, name in enumerate(
+    filter(None, os.environ.get("DATABASE_SHARDS", "").split(",")), start=1
+):
+    DATABASES[f"shard{index}"] = {**DATABASES["default"], "NAME": name}
+    ACCOUNT_SHARDS.append(f"shard{index}")
+
+SHARDED_APPS = ["account"]
+
+SHARD_DIRECTORY_TIMEOUT = int(os.environ.get("SHARD_DIRECTORY_TIMEOUT", 5))
+
+# Archive of the transactions and balance history entries older than
+# ARCHIVE_AFTER_DAYS days, moved there by the archive_transactions command.
+# The archive tables live next to the hot ones, or in the DATABASE_ARCHIVE
+# SQLite file when it is set.
+
+ARCHIVE_DATABASE = None
+if os.environ.get("DATABASE_ARCHIVE"):
+    DATABASES["archive"] = {
+        **DATABASES["default"],
+        "NAME": os.environ["DATABASE_ARCHIVE"],
+    }
+    ARCHIVE_DATABASE = "archive"
+
+ARCHIVE_MODELS = ["account.archivedtransaction", "account.archivedbalancehistory"]
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+
+DATABASE_ROUTERS = [
+    "core.archive.ArchiveRouter",
+    "core.sharding.ShardRouter",
+    "core.replicas.ReplicaRouter",
+]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Cache alias and timeout (in seconds) of the account API response cache.
+ACCOUNT_API_CACHE = "default"
+ACCOUNT_API_CACHE_TIMEOUT = 300
+
+# Ledger entries posted to an account between two balance checkpoints, which
+# bounds the rows read to compute any balance.
+LEDGER_CHECKPOINT_INTERVAL = 100
+
+# Broker fanning out the transaction and balance events of the /events/
+# stream, as the dotted path of a class. The in-process broker only reaches
+# the streams served by the process that committed the change.
+ACCOUNT_EVENTS_BROKER = "apps.account.events.InProcessBroker"
+# Seconds between keepalive comments on an idle stream.
+ACCOUNT_EVENTS_HEARTBEAT = 15
+# Batches queued for a stream that falls behind before it is ended, to
+# catch up from the database when the client reconnects.
+ACCOUNT_EVENTS_QUEUE_SIZE = 100
+# Transactions replayed to a resuming client before it is told to reload.
+ACCOUNT_EVENTS_REPLAY_LIMIT = 1000
+
+# Carry out the balance history and rollup updates of a posting inside the
+# request, for development and the tests. By default they are written to the
+# outbox in the posting's transaction and carried out by the process_outbox
+# command, so requests only wait for the ledger. The workers then invalidate
+# the cached responses of the accounts they update, which needs a cache the
+# web processes share (see ACCOUNT_API_CACHE).
+OUTBOX_EAGER = os.environ.get("OUTBOX_EAGER", "0") != "0"
+# Attempts at a failing outbox message before it is left for inspection.
+OUTBOX_MAX_ATTEMPTS = 10
+
+# Cache alias fronting the idempotency key table, and lifetime (in seconds)
+# of the keys. Expired keys are deleted by the purge_idempotency_keys command.
+IDEMPOTENCY_CACHE = "default"
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Cache alias and timeout (in seconds) of the token version and active flag
+# of users, checked on every request. With a per-process cache a revocation
+# reaches the other processes within the timeout.
+AUTH_TOKEN_STATE_CACHE = "default"
+AUTH_TOKEN_STATE_TIMEOUT = 60
+
+# Size and timeout (in seconds) of the in-process cache of user rows, read
+# when a view needs more than the token claims.
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TIMEOUT = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
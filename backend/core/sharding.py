@@ -0,0 +1,223 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+
+# Database alias of the shard holding the data of the current request's user.
+current_shard = contextvars.ContextVar("current_shard", default=None)
+
+KEY_PREFIX = "shard"
+
+# Size of the id range reserved for every shard, so rows keep their primary
+# key (and accounts their number) when they move to another shard.
+SHARD_ID_SPAN = 10**12
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes.
+
+    Every node is placed at ``replicas`` points of the ring, and a key belongs
+    to the first node point at or after its own hash. Adding or removing a
+    node only moves the keys of the ring segments it gains or loses.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        self.points = sorted(
+            (self.hash(f"{node}#{index}"), node)
+            for node in nodes
+            for index in range(replicas)
+        )
+        self.hashes = [point for point, node in self.points]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, key):
+        if not self.points:
+            raise ValueError("The ring has no nodes")
+        index = bisect.bisect(self.hashes, self.hash(str(key))) % len(self.points)
+        return self.points[index][1]
+
+
+@functools.lru_cache(maxsize=8)
+def get_ring(shards):
+    return HashRing(shards)
+
+
+def ring_shard(user_id):
+    """Return the shard the ring assigns a user to"""
+    return get_ring(tuple(settings.ACCOUNT_SHARDS)).node_for(user_id)
+
+
+def assignment_key(user_id):
+    return f"{KEY_PREFIX}:assignment:{user_id}"
+
+
+def forget_assignment(user_id):
+    cache.delete(assignment_key(user_id))
+
+
+def get_assignment(user_id):
+    """
+    Return the (shard, moving) of a user from the shard directory, placing
+    users seen for the first time on their ring shard. Users whose accounts
+    are still on the primary database stay there, until the rebalancing
+    moves them.
+
+    Entries are cached for ``SHARD_DIRECTORY_TIMEOUT`` seconds, which bounds
+    how long a process may keep using an entry the rebalancing changed.
+    """
+
+    from apps.account.models import Account
+    from apps.user.models import ShardAssignment
+
+    key = assignment_key(user_id)
+    entry = cache.get(key)
+    if entry is None:
+        assignment = (
+            ShardAssignment.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .values_list("alias", "moving")
+            .first()
+        )
+        if assignment is None:
+            if (
+                Account.objects.using(DEFAULT_DB_ALIAS)
+                .filter(owner_id=user_id)
+                .exists()
+            ):
+                alias = DEFAULT_DB_ALIAS
+            else:
+                alias = ring_shard(user_id)
+                copy_user(user_id, alias)
+            assignment, _ = ShardAssignment.objects.using(
+                DEFAULT_DB_ALIAS
+            ).get_or_create(user_id=user_id, defaults={"alias": alias})
+            assignment = (assignment.alias, assignment.moving)
+        entry = tuple(assignment)
+        cache.set(key, entry, settings.SHARD_DIRECTORY_TIMEOUT)
+    return entry
+
+
+def copy_user(user_id, alias):
+    """
+    Copy the row of a user to a shard, where it backs the owner foreign keys
+    of their accounts. The primary database keeps the authoritative row.
+    """
+
+    User = get_user_model()
+    users = User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id)
+    User.objects.using(alias).bulk_create(users, ignore_conflicts=True)
+
+
+@contextlib.contextmanager
+def use_shard(alias):
+    """Route the sharded models to ``alias`` inside the block"""
+    token = current_shard.set(alias)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def reserve_id_range(alias):
+    """
+    Start the primary key sequences of the sharded tables of a SQLite shard
+    at the shard's own range, so ids never collide across shards.
+    """
+
+    connection = connections[alias]
+    if connection.vendor != "sqlite":
+        return
+    from django.apps import apps
+
+    start = (settings.ACCOUNT_SHARDS.index(alias) + 1) * SHARD_ID_SPAN
+    with connection.cursor() as cursor:
+        for app_label in settings.SHARDED_APPS:
+            for model in apps.get_app_config(app_label).get_models():
+                table = model._meta.db_table
+                cursor.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = %s", [table]
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)",
+                        [table, start],
+                    )
+                elif row[0] < start:
+                    cursor.execute(
+                        "UPDATE sqlite_sequence SET seq = %s WHERE name = %s",
+                        [start, table],
+                    )
+
+
+class ShardRouter:
+    """
+    Route the models of ``SHARDED_APPS`` to the shard of the current user.
+
+    Outside of a shard context the other routers, and the instance hints,
+    decide.
+    """
+
+    def shard(self, model):
+        if model._meta.app_label in settings.SHARDED_APPS:
+            return current_shard.get()
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.shard(model)
+
+    def db_for_write(self, model, **hints):
+        return self.shard(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are copied to the shards holding their accounts.
+        return True
+
+
+class ShardMoving(exceptions.APIException):
+    status_code = 503
+    default_detail = "Your data is being moved, try again shortly."
+    default_code = "shard_moving"
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler.
+        self.wait = wait
+
+
+class ShardRoutingMixin:
+    """
+    Route the sharded models to the shard of the authenticated user while a
+    view handles a request.
+
+    Writes of a user whose data is being moved between shards are refused
+    with a 503 and a Retry-After header.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.ACCOUNT_SHARDS or not request.user.is_authenticated:
+            return
+        alias, moving = get_assignment(request.user.pk)
+        if moving and request.method not in SAFE_METHODS:
+            raise ShardMoving(settings.SHARD_DIRECTORY_TIMEOUT)
+        self.shard_token = current_shard.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "shard_token", None)
+        if token is not None:
+            current_shard.reset(token)
+            self.shard_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,19 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run the tests with the outbox carried out eagerly, so postings update
+    the balance history and rollups before they return. The tests of the
+    outbox turn it back off.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.eager_outbox = override_settings(OUTBOX_EAGER=True)
+        self.eager_outbox.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.eager_outbox.disable()
+        super().teardown_test_environment(**kwargs)
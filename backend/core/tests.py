@@ -0,0 +1,563 @@
+import io
+import os
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.account.models import (
+    Account,
+    ArchiveCutoff,
+    ArchivedTransaction,
+    BalanceHistory,
+    LedgerEntry,
+    OutboxMessage,
+    Transaction,
+)
+from apps.user.models import ShardAssignment
+from core.backends.sqlite3.base import DatabaseWrapper
+from core.metrics import REGISTRY, Histogram
+from core.replicas import replica_reads
+from core.sharding import SHARD_ID_SPAN, HashRing, copy_user, ring_shard
+
+
+class SQLiteProfileTestCase(SimpleTestCase):
+    alias = "sqlite_profile"
+    threads = 8
+    writes_per_thread = 50
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_dict = {
+            **connection.settings_dict,
+            "NAME": os.path.join(directory.name, "profile.sqlite3"),
+        }
+
+        wrapper = self.connect()
+        with wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, value INT)")
+            cursor.execute("INSERT INTO counter VALUES (1, 0)")
+        wrapper.close()
+
+    def connect(self):
+        wrapper = DatabaseWrapper(self.settings_dict, alias=self.alias)
+        connections[self.alias] = wrapper
+        return wrapper
+
+    def write(self, errors):
+        wrapper = self.connect()
+        try:
+            for _ in range(self.writes_per_thread):
+                # Read then write, the pattern of the balance postings, which
+                # fails on lock upgrade when transactions start deferred.
+                with transaction.atomic(using=self.alias):
+                    with wrapper.cursor() as cursor:
+                        cursor.execute("SELECT value FROM counter WHERE id = 1")
+                        (value,) = cursor.fetchone()
+                        cursor.execute(
+                            "UPDATE counter SET value = %s WHERE id = 1", [value + 1]
+                        )
+        except OperationalError as error:
+            errors.append(error)
+        finally:
+            wrapper.close()
+            del connections[self.alias]
+
+    def test_pragmas_are_applied(self):
+        wrapper = self.connect()
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_concurrent_writers_do_not_fail(self):
+        errors = []
+        workers = [
+            threading.Thread(target=self.write, args=(errors,))
+            for _ in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        wrapper = self.connect()
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT value FROM counter WHERE id = 1")
+            self.assertEqual(
+                cursor.fetchone()[0], self.threads * self.writes_per_thread
+            )
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTestCase(APITransactionTestCase):
+    """Route reads between two local SQLite files, the primary and a replica"""
+
+    # The replica is only registered in setUpClass, resolved from there.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings["replica"] = {
+            **connection.settings_dict,
+            "NAME": os.path.join(cls.directory.name, "replica.sqlite3"),
+        }
+        call_command("migrate", database="replica", verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.account = Account.objects.create(owner=self.user)
+        # The replica lags behind: it has the account with an older balance.
+        self.user.save(using="replica")
+        Account.objects.using("replica").bulk_create(
+            [Account(number=self.account.number, owner=self.user)]
+        )
+        LedgerEntry.objects.using("replica").create(
+            account_id=self.account.number,
+            book=LedgerEntry.Book.ACCOUNT,
+            sequence=1,
+            posting=uuid.uuid4(),
+            amount=5,
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def get_balance(self):
+        response = self.client.get(reverse("account-list"))
+        return Decimal(response.data["results"][0]["current_balance"])
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.get_balance(), Decimal(5))
+
+    def test_reads_stick_to_primary_after_write(self):
+        response = self.client.post(
+            reverse("transaction-list"),
+            {
+                "account": self.account.number,
+                "amount": 10,
+                "transaction_type": "credit",
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(self.get_balance(), Decimal(10))
+
+    def test_router(self):
+        self.assertEqual(router.db_for_read(Account), "default")
+        token = replica_reads.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Account), "replica")
+            self.assertEqual(router.db_for_write(Account), "default")
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Account), "default")
+        finally:
+            replica_reads.reset(token)
+
+
+class HashRingTestCase(SimpleTestCase):
+    keys = [f"user-{index}" for index in range(2000)]
+
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(["shard1", "shard2", "shard3"])
+        counts = Counter(ring.node_for(key) for key in self.keys)
+
+        self.assertEqual(set(counts), {"shard1", "shard2", "shard3"})
+        for count in counts.values():
+            self.assertGreater(count, len(self.keys) / 3 * 0.7)
+
+    def test_adding_a_node_only_moves_its_keys(self):
+        before = HashRing(["shard1", "shard2", "shard3"])
+        after = HashRing(["shard1", "shard2", "shard3", "shard4"])
+
+        moved = [
+            key for key in self.keys if before.node_for(key) != after.node_for(key)
+        ]
+
+        self.assertTrue(all(after.node_for(key) == "shard4" for key in moved))
+        self.assertLess(len(moved), len(self.keys) / 4 * 1.3)
+
+
+@override_settings(ACCOUNT_SHARDS=["shard1", "shard2"], SHARD_DIRECTORY_TIMEOUT=60)
+class ShardingTestCase(APITransactionTestCase):
+    """Route the account data of users to two local SQLite shards"""
+
+    shards = ("shard1", "shard2")
+    # The shards are only registered in setUpClass, resolved from there.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in cls.shards:
+            connections.settings[alias] = {
+                **connection.settings_dict,
+                "NAME": os.path.join(cls.directory.name, f"{alias}.sqlite3"),
+            }
+            with override_settings(ACCOUNT_SHARDS=list(cls.shards)):
+                call_command("migrate", database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.shards:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.shard = ring_shard(self.user.pk)
+        self.other = next(alias for alias in self.shards if alias != self.shard)
+        self.client.force_authenticate(user=self.user)
+
+    def test_account_data_lives_on_user_shard(self):
+        response = self.client.post(reverse("account-list"))
+        number = response.data["ID"]
+        self.client.post(
+            reverse("transaction-list"),
+            {"account": number, "amount": 10, "transaction_type": "credit"},
+        )
+
+        start = (self.shards.index(self.shard) + 1) * SHARD_ID_SPAN
+        self.assertGreater(number, start)
+        self.assertEqual(ShardAssignment.objects.get().alias, self.shard)
+        for model in (Account, Transaction, BalanceHistory):
+            self.assertEqual(model.objects.using(self.shard).count(), 1)
+            self.assertFalse(model.objects.using(self.other).exists())
+            self.assertFalse(model.objects.exists())
+
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(response.data["results"][0]["current_balance"], "10.00")
+
+    def test_rebalance_moves_users_to_ring_shard(self):
+        # The user's data starts on the primary, before sharding.
+        account = Account.objects.create(owner=self.user)
+        Transaction.objects.create(account=account, amount=25, type="credit")
+        created_at = Transaction.objects.get().created_at
+
+        out = io.StringIO()
+        call_command("rebalance_shards", "--settle", "0", stdout=out)
+
+        self.assertIn("Moved 1 users", out.getvalue())
+        self.assertEqual(
+            ShardAssignment.objects.values_list("alias", "moving").get(),
+            (self.shard, False),
+        )
+        self.assertFalse(Account.objects.exists())
+        self.assertEqual(
+            Transaction.objects.using(self.shard).get().created_at, created_at
+        )
+        response = self.client.get(reverse("account-detail", args=[account.number]))
+        self.assertEqual(response.data["current_balance"], "25.00")
+
+    def test_rebalance_moves_users_off_other_shard(self):
+        copy_user(self.user.pk, self.other)
+        ShardAssignment.objects.create(user=self.user, alias=self.other)
+        response = self.client.post(reverse("account-list"))
+        number = response.data["ID"]
+        self.assertTrue(Account.objects.using(self.other).exists())
+
+        call_command("rebalance_shards", "--settle", "0", stdout=io.StringIO())
+
+        self.assertFalse(Account.objects.using(self.other).exists())
+        response = self.client.get(reverse("account-detail", args=[number]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_requests_before_rebalance_read_the_primary(self):
+        account = Account.objects.create(owner=self.user)
+        Transaction.objects.create(account=account, amount=25, type="credit")
+
+        response = self.client.get(reverse("account-list"))
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(ShardAssignment.objects.get().alias, "default")
+
+        out = io.StringIO()
+        call_command("rebalance_shards", "--settle", "0", stdout=out)
+
+        self.assertIn("Moved 1 users", out.getvalue())
+        self.assertFalse(Account.objects.exists())
+        self.assertEqual(Account.objects.using(self.shard).get(), account)
+        response = self.client.get(reverse("account-detail", args=[account.number]))
+        self.assertEqual(response.data["current_balance"], "25.00")
+
+    def test_rebalance_merges_primary_rows_into_assigned_shard(self):
+        # Assigned to their shard while their first account is on the primary.
+        old = Account.objects.create(owner=self.user)
+        copy_user(self.user.pk, self.shard)
+        ShardAssignment.objects.create(user=self.user, alias=self.shard)
+        new = self.client.post(reverse("account-list")).data["ID"]
+
+        call_command("rebalance_shards", "--settle", "0", stdout=io.StringIO())
+
+        self.assertFalse(Account.objects.exists())
+        self.assertEqual(
+            sorted(Account.objects.using(self.shard).values_list("pk", flat=True)),
+            [old.pk, new],
+        )
+
+    @override_settings(OUTBOX_EAGER=False)
+    def test_rebalance_carries_out_the_outbox_before_copying(self):
+        account = Account.objects.create(owner=self.user)
+        Transaction.objects.create(account=account, amount=25, type="credit")
+        self.assertTrue(OutboxMessage.objects.exists())
+
+        call_command("rebalance_shards", "--settle", "0", stdout=io.StringIO())
+
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertFalse(OutboxMessage.objects.using(self.shard).exists())
+        self.assertEqual(
+            BalanceHistory.objects.using(self.shard).get().balance, Decimal(25)
+        )
+
+    def test_writes_are_refused_while_moving(self):
+        ShardAssignment.objects.create(user=self.user, alias=self.shard, moving=True)
+
+        response = self.client.post(reverse("account-list"))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "60")
+        self.assertEqual(self.client.get(reverse("account-list")).status_code, 200)
+
+
+@override_settings(ARCHIVE_DATABASE="archive")
+class ArchiveRouterTestCase(APITransactionTestCase):
+    """Archive old transactions to their own local SQLite file"""
+
+    # The archive is only registered in setUpClass, resolved from there.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings["archive"] = {
+            **connection.settings_dict,
+            "NAME": os.path.join(cls.directory.name, "archive.sqlite3"),
+        }
+        call_command("migrate", database="archive", verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["archive"].close()
+        del connections["archive"]
+        del connections.settings["archive"]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.account = Account.objects.create(owner=self.user)
+        for date, amount in (("2020-01-01T00:00:00Z", 10), ("2021-06-01T00:00:00Z", 5)):
+            Transaction.objects.create(
+                account=self.account, amount=amount, type="credit", date=date
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_old_transactions_move_to_the_archive_database(self):
+        call_command(
+            "archive_transactions", "--before", "2021-01-01", stdout=io.StringIO()
+        )
+
+        self.assertEqual(router.db_for_write(ArchivedTransaction), "archive")
+        self.assertEqual(
+            list(ArchivedTransaction.objects.using("archive").values_list("amount")),
+            [(Decimal(10),)],
+        )
+        self.assertFalse(ArchivedTransaction.objects.using("default").exists())
+        self.assertEqual(Transaction.objects.get().amount, Decimal(5))
+        self.assertEqual(ArchiveCutoff.objects.get().balance, Decimal(10))
+
+        response = self.client.get(reverse("transaction-list"))
+        self.assertEqual(
+            [row["amount"] for row in response.json()["results"]], ["5.00", "10.00"]
+        )
+
+        self.account.delete()
+        self.assertFalse(ArchivedTransaction.objects.using("archive").exists())
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_collect_cumulative_buckets(self):
+        histogram = Histogram("latency_seconds", "Latency.", ("view",), (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, view='a"b')
+
+        self.assertEqual(
+            list(histogram.collect()),
+            [
+                "# HELP latency_seconds Latency.",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{view="a\\"b",le="0.1"} 2',
+                'latency_seconds_bucket{view="a\\"b",le="1"} 3',
+                'latency_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+                'latency_seconds_sum{view="a\\"b"} 3.65',
+                'latency_seconds_count{view="a\\"b"} 4',
+            ],
+        )
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        REGISTRY.clear()
+        self.user = get_user_model().objects.create_user(
+            username="test", password="Test123!"
+        )
+        self.account = Account.objects.create(owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def scrape(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        return response.content.decode()
+
+    def sample(self, metrics, line):
+        """Return the value of the sample starting with ``line``"""
+        for sample in metrics.splitlines():
+            if sample.startswith(line + " "):
+                return float(sample.rsplit(" ", 1)[1])
+        self.fail(f"No {line} sample in:\n{metrics}")
+
+    def test_requests_are_measured_per_view(self):
+        self.client.get(reverse("transaction-list"))
+        self.client.post(
+            reverse("transaction-list"),
+            {
+                "account": self.account.number,
+                "amount": "10",
+                "transaction_type": "credit",
+            },
+        )
+
+        metrics = self.scrape()
+
+        labels = 'view="transaction-list",method="GET"'
+        self.assertEqual(
+            self.sample(
+                metrics,
+                f'http_request_duration_seconds_count{{{labels},status="200"}}',
+            ),
+            1,
+        )
+        self.assertGreater(
+            self.sample(metrics, f"http_request_db_queries_sum{{{labels}}}"), 0
+        )
+        self.assertGreater(
+            self.sample(metrics, f"http_request_db_duration_seconds_sum{{{labels}}}"),
+            0,
+        )
+        self.assertEqual(
+            self.sample(
+                metrics,
+                "http_request_phase_duration_seconds_count"
+                f'{{{labels},phase="serialization"}}',
+            ),
+            1,
+        )
+        self.assertEqual(
+            self.sample(
+                metrics,
+                "http_request_phase_duration_seconds_count"
+                '{view="transaction-list",method="POST",'
+                'phase="signal:update_account_balance"}',
+            ),
+            1,
+        )
+
+    def test_account_signal_is_measured(self):
+        self.client.post(reverse("account-list"))
+
+        self.assertEqual(
+            self.sample(
+                self.scrape(),
+                "http_request_phase_duration_seconds_count"
+                '{view="account-list",method="POST",'
+                'phase="signal:create_balance_history"}',
+            ),
+            1,
+        )
+
+    def test_async_requests_are_measured(self):
+        token = AccessToken.for_user(self.user)
+
+        async def get():
+            return await self.async_client.get(
+                reverse("async-account-list"), authorization=f"Bearer {token}"
+            )
+
+        self.assertEqual(async_to_sync(get)().status_code, 200)
+
+        metrics = self.scrape()
+        labels = 'view="async-account-list",method="GET"'
+        self.assertEqual(
+            self.sample(
+                metrics,
+                f'http_request_duration_seconds_count{{{labels},status="200"}}',
+            ),
+            1,
+        )
+        self.assertGreater(
+            self.sample(metrics, f"http_request_db_queries_sum{{{labels}}}"), 0
+        )
+        self.assertEqual(
+            self.sample(
+                metrics,
+                "http_request_phase_duration_seconds_count"
+                f'{{{labels},phase="serialization"}}',
+            ),
+            1,
+        )
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs("core.metrics", "WARNING") as logs:
+            self.client.get(reverse("account-list"))
+
+        self.assertIn("Slow request GET /account/ (account-list) 200", logs.output[0])
+        self.assertIn("queries in", logs.output[0])
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
@@ -6,13 +6,34 @@ from rest_framework_simplejwt.views import (
 )
 from rest_framework.routers import DefaultRouter
 
+from apps.account import async_views
 from apps.account.views import AccountViewSet, BalanceHistoryViewSet, TransactionViewSet
 from apps.user.views import UserViewSet
+from core.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("metrics", metrics_view, name="metrics"),
+    # Async counterparts of the read endpoints, for ASGI servers.
+    path("async/account/", async_views.account_list, name="async-account-list"),
+    path(
+        "async/account/<int:pk>/",
+        async_views.account_detail,
+        name="async-account-detail",
+    ),
+    path(
+        "async/transaction/",
+        async_views.transaction_list,
+        name="async-transaction-list",
+    ),
+    path("async/balance/", async_views.balance_list, name="async-balance-list"),
+    path(
+        "async/balance/account/<int:account_id>/",
+        async_views.balance_account,
+        name="async-balance-account",
+    ),
 ]
 
 router = DefaultRouter()